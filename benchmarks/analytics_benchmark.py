@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+analytics_benchmark.py
+
+Times analytics.analyze_session() on a synthetic class of 50 riders with 60 minutes
+of 1 Hz power and cadence, and compares Normalized Power and the mean-maximal power
+curve against per-sample Python loops over the same data.
+
+Run from the repository root:
+    python -m benchmarks.analytics_benchmark
+"""
+
+import time
+
+import numpy as np
+
+from mqtt_services import analytics
+
+N_RIDERS = 50
+DURATION = 60 * 60
+PLAN = [(0, 50, 90, "Warmup")] + [
+    (600 + 240 * i, 100 if i % 2 == 0 else 50, 80, "Interval" if i % 2 == 0 else "Rest") for i in range(10)
+] + [(3000, 50, 85, "Cooldown"), (DURATION, 0, 85, "stop")]
+
+
+def synthetic_class(seed=0):
+    rng = np.random.default_rng(seed)
+    series = {}
+    for i in range(N_RIDERS):
+        times = np.arange(DURATION, dtype=np.float64) + rng.uniform(0, 0.2, DURATION)
+        power = rng.normal(200, 40, DURATION).clip(0)
+        cadence = rng.normal(88, 4, DURATION)
+        series[f"trainer_{i}"] = (times, power, cadence)
+    ftps = {uuid_trainer: 200 + 5 * i for i, uuid_trainer in enumerate(series)}
+    return series, ftps
+
+
+def python_loops(power_rows):
+    """NP and the MMP curve with per-sample loops, as a baseline."""
+    for power in power_rows:
+        power = power.tolist()
+        rolling = [sum(power[i - 29:i + 1]) / 30 for i in range(29, len(power))]
+        sum(p ** 4 for p in rolling) / len(rolling)
+        for d in (1, 5, 60, 300):
+            window = sum(power[:d])
+            best = window
+            for i in range(d, len(power)):
+                window += power[i] - power[i - d]
+                best = max(best, window)
+
+
+def _time(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    series, ftps = synthetic_class()
+    _, power = analytics.session_matrix(series, DURATION)
+    print(f"{N_RIDERS} riders x {DURATION} s at 1 Hz, {len(PLAN)} plan segments")
+    print(f"{'stage':<24}{'ms':>10}")
+    stages = (
+        ("resample", lambda: analytics.session_matrix(series, DURATION)),
+        ("normalized power", lambda: analytics.normalized_power(power)),
+        ("mean-maximal power", lambda: analytics.mean_max_power(power)),
+        ("segment compliance", lambda: analytics.segment_compliance(power, PLAN, list(ftps.values()))),
+        ("analyze_session", lambda: analytics.analyze_session(PLAN, series, ftps, DURATION)),
+    )
+    for name, func in stages:
+        print(f"{name:<24}{_time(func, 10) * 1000:>10.2f}")
+    loops = _time(lambda: python_loops(power[:5]), 1) * N_RIDERS / 5
+    print(f"{'python loops (NP+MMP)':<24}{loops * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
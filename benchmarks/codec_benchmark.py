@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+codec_benchmark.py
+
+Compares the JSON payload path with the fixed-layout binary codecs for the
+high-rate telemetry topics: bytes on the wire and encode/decode time.
+
+Run from the repository root:
+    python -m benchmarks.codec_benchmark
+"""
+
+import timeit
+
+from mqtt_services.codec import (
+    JSON_CODEC,
+    MEASURED_POWER_STRUCT,
+    MEASURED_CADENCE_STRUCT,
+    MEASURED_TELEMETRY_STRUCT,
+    decode_payload,
+)
+
+WALL = 1740853800.123456
+MONO = 81234.567891
+N_TRAINERS = 40
+
+CASES = [
+    ("set_measured_power", MEASURED_POWER_STRUCT,
+     dict(uuid_trainer='trainer_123', measured_power=215, percent_ftp=98, time=WALL, mono=MONO)),
+    ("set_measured_cadence", MEASURED_CADENCE_STRUCT,
+     dict(uuid_trainer='trainer_123', measured_cadence=88, time=WALL, mono=MONO)),
+    (f"set_measured_telemetry ({N_TRAINERS} trainers)", MEASURED_TELEMETRY_STRUCT,
+     dict(uuid_trainer=[f'trainer_{i:03d}' for i in range(N_TRAINERS)],
+          measured_power=[200 + i for i in range(N_TRAINERS)],
+          measured_cadence=[85 + i % 10 for i in range(N_TRAINERS)],
+          percent_ftp=[90 + i % 20 for i in range(N_TRAINERS)],
+          time=WALL, mono=MONO)),
+]
+
+
+def _time_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number=20000):
+    print(f"{'topic':<38}{'codec':<8}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+    for topic, binary_codec, kw in CASES:
+        # Scale the iteration count down for the large batched frame.
+        power = kw.get('measured_power')
+        n = max(1, number // len(power)) if isinstance(power, list) else number
+        for codec in (JSON_CODEC, binary_codec):
+            payload = codec.encode(kw)
+            wire = payload.encode() if isinstance(payload, str) else payload
+            assert decode_payload(wire) == kw
+            encode_us = _time_us(lambda: codec.encode(kw), n)
+            decode_us = _time_us(lambda: decode_payload(wire), n)
+            print(f"{topic:<38}{codec.name:<8}{len(wire):>7}{encode_us:>11.2f}{decode_us:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
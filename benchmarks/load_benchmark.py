@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+load_benchmark.py
+
+Load test of the messaging backbone: K simulated WirelessBridges with N trainers each
+publish telemetry to one Coach and R Riders, for each (K, N) in the given ranges.
+
+Per run it reports, as JSON:
+  - publish throughput (messages/s published by the bridges);
+  - end-to-end latency percentiles from the bridge's sample stamp to the coach handler;
+  - message loss (readings published vs readings the coach handled);
+  - CPU seconds per agent, from per-thread CPU clocks.
+
+By default the agents share an in-process broker (mqtt_services.fake_broker). Deliveries
+then run in the publishing thread, so the coach's and riders' handler time is charged to
+the bridges. Pass --broker host[:port] to use a real broker instead. Each client then
+has its own network thread and the CPU split per agent is meaningful.
+
+Run from the repository root:
+    python -m benchmarks.load_benchmark --bridges 1 4 --trainers 10 50 --output load.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from mqtt_services import clock
+from mqtt_services.coach import Coach
+from mqtt_services.codec import decode_payload
+from mqtt_services.devices import SimulatedBackend
+from mqtt_services.fake_broker import FakeBroker, FakeClient
+from mqtt_services.rider import Rider
+from mqtt_services.wireless_bridge import WirelessBridge
+
+
+class _LatencyCoach(Coach):
+    """A Coach that records the latency and count of every reading it handles."""
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        self.received = 0
+        super().__init__(*args, **kwargs)
+
+    def _observe(self, msg, readings):
+        # Decoding twice (here and in the handler) costs the coach, not the measurement.
+        payload = decode_payload(msg.payload)
+        self.latencies.append(clock.now().mono - payload["mono"])
+        self.received += readings(payload)
+
+    def _handle_measured_power(self, client, userdata, msg):
+        self._observe(msg, lambda payload: 1)
+        super()._handle_measured_power(client, userdata, msg)
+
+    def _handle_measured_telemetry(self, client, userdata, msg):
+        self._observe(msg, lambda payload: len(payload["uuid_trainer"]))
+        super()._handle_measured_telemetry(client, userdata, msg)
+
+
+class _CountingBridge(WirelessBridge):
+    """A WirelessBridge that counts the readings and messages it publishes."""
+
+    def __init__(self, *args, **kwargs):
+        self.readings_published = 0
+        self.messages_published = 0
+        super().__init__(*args, **kwargs)
+
+    def _publish_readings(self, readings, stamp=None):
+        self.readings_published += len(readings)
+        self.messages_published += 1 if self.batch_telemetry else len(readings)
+        super()._publish_readings(readings, stamp)
+
+
+def _thread_cpu(thread):
+    """Returns the CPU seconds a live thread has used, or 0.0 if it cannot be measured."""
+    if thread is None or thread.ident is None or not thread.is_alive():
+        return 0.0
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def _agent_threads(client, *threads):
+    return [t for t in (getattr(client, "_thread", None),) + threads if t is not None]
+
+
+class LoadRun:
+    def __init__(self, n_bridges, n_trainers, n_riders, period, batch, binary, broker):
+        self.broker = FakeBroker() if broker is None else None
+        self.broker_address = broker
+        self.clients = []
+        self.coach = _LatencyCoach(self._client("coach"))
+        self.riders = [Rider(self._client(f"rider_{i}")) for i in range(n_riders)]
+        self.bridges = []
+        for k in range(n_bridges):
+            trainer_ids = [f"bridge{k}_trainer{i}" for i in range(n_trainers)]
+            backend = SimulatedBackend(trainer_ids, rate=1.0 / period, seed=k)
+            self.bridges.append(_CountingBridge(
+                self._client(f"bridge_{k}"), trainer_ids, batch_telemetry=batch,
+                binary_telemetry=binary, poll_period=period, max_stale=3 * period, backend=backend))
+
+    def _client(self, client_id):
+        if self.broker is not None:
+            client = FakeClient(self.broker, client_id)
+        else:
+            host, _, port = self.broker_address.partition(":")
+            client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311,
+                                 callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+            client.connect(host, int(port or 1883))
+            client.loop_start()
+        self.clients.append(client)
+        return client
+
+    def _cpu(self):
+        bridges = sum(_thread_cpu(t) for bridge in self.bridges
+                      for t in _agent_threads(bridge.client, bridge._thread, bridge.backend.scheduler._thread))
+        coach = sum(_thread_cpu(t) for t in _agent_threads(self.coach.client))
+        riders = sum(_thread_cpu(t) for rider in self.riders for t in _agent_threads(rider.client))
+        return {"bridges": bridges, "coach": coach, "riders": riders, "process": time.process_time()}
+
+    def run(self, duration, warmup=0.5):
+        for bridge in self.bridges:
+            bridge.start()
+        time.sleep(warmup)
+        # Measure from a clean slate once every bridge has reached steady state.
+        cpu0 = self._cpu()
+        for bridge in self.bridges:
+            bridge.readings_published = bridge.messages_published = 0
+        self.coach.latencies.clear()
+        self.coach.received = 0
+        wall0 = time.perf_counter()
+        time.sleep(duration)
+        published = sum(bridge.readings_published for bridge in self.bridges)
+        messages = sum(bridge.messages_published for bridge in self.bridges)
+        cpu1 = self._cpu()
+        wall = time.perf_counter() - wall0
+        for bridge in self.bridges:
+            bridge.stop()
+        # Give in-flight messages on a real broker time to arrive before counting.
+        time.sleep(0 if self.broker is not None else 0.5)
+        received = self.coach.received
+        latencies = np.array(self.coach.latencies) * 1000
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+        return {
+            "wall_s": wall,
+            "messages_published": messages,
+            "readings_published": published,
+            "readings_received": received,
+            "loss": 1 - received / published if published else 0.0,
+            "throughput_msgs_per_s": messages / wall,
+            "throughput_readings_per_s": published / wall,
+            "latency_ms": {
+                name: float(np.percentile(latencies, q)) if len(latencies) else None
+                for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+            },
+            "cpu_s": {name: cpu1[name] - cpu0[name] for name in cpu1},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the MQTT messaging backbone.")
+    parser.add_argument("--bridges", type=int, nargs="+", default=[1, 4], help="Values of K.")
+    parser.add_argument("--trainers", type=int, nargs="+", default=[10, 50], help="Values of N.")
+    parser.add_argument("--riders", type=int, default=1, help="Rider dashboards per run.")
+    parser.add_argument("--period", type=float, default=0.1, help="Bridge poll period in s.")
+    parser.add_argument("--duration", type=float, default=3.0, help="Measured seconds per run.")
+    parser.add_argument("--batch", action="store_true", help="Publish batched telemetry frames.")
+    parser.add_argument("--binary", action="store_true", help="Use the binary telemetry codec.")
+    parser.add_argument("--broker", help="host[:port] of a real broker; default in-process.")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    report = {
+        "benchmark": "load_benchmark",
+        "time": clock.isoformat(time.time()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {name: value for name, value in vars(args).items() if name != "output"},
+        "results": [],
+    }
+    for n_bridges in args.bridges:
+        for n_trainers in args.trainers:
+            run = LoadRun(n_bridges, n_trainers, args.riders, args.period, args.batch, args.binary, args.broker)
+            result = {"bridges": n_bridges, "trainers": n_trainers, **run.run(args.duration)}
+            report["results"].append(result)
+            latency = result["latency_ms"]
+            print(f"K={n_bridges:<3} N={n_trainers:<4} {result['throughput_msgs_per_s']:>9.0f} msg/s  "
+                  f"p50 {latency['p50'] or 0:.3f} ms  p99 {latency['p99'] or 0:.3f} ms  "
+                  f"loss {result['loss']:.2%}", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
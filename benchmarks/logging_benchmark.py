@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+logging_benchmark.py
+
+Publish throughput of set_measured_power with every log record emitted versus the
+hot-path log limits of mqtt_services.logs, with and without the queue handler.
+
+A Coach and a Rider on an in-process broker handle every message in the publishing
+thread, so their per-message logging is included, as it is on a busy bridge host.
+Records go to a log file in a temporary directory, at INFO.
+
+Run from the repository root:
+    python -m benchmarks.logging_benchmark [--messages 20000] [--trainers 40]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from mqtt_services import logs
+from mqtt_services.coach import Coach
+from mqtt_services.fake_broker import FakeBroker, FakeClient
+from mqtt_services.messaging import SetMeasuredPower
+from mqtt_services.rider import Rider
+
+MODES = [
+    # (name, level, per_second, interval, use_queue)
+    ("every record", logging.INFO, None, None, False),
+    ("every record, queued", logging.INFO, None, None, True),
+    ("rate limited", logging.INFO, 1.0, 10.0, False),
+    ("rate limited, queued", logging.INFO, 1.0, 10.0, True),
+    ("WARNING level", logging.WARNING, None, None, False),
+]
+
+
+def _run(path, level, per_second, interval, use_queue, n_messages, n_trainers):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.FileHandler(path, mode="w")
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level)
+    logs.configure(per_second, interval, use_queue)
+
+    broker = FakeBroker()
+    Coach(FakeClient(broker, "coach"))
+    Rider(FakeClient(broker, "rider"))
+    msg = SetMeasuredPower(FakeClient(broker, "bridge"), validate=False)
+    trainers = [f"trainer_{i:03d}" for i in range(n_trainers)]
+
+    start = time.perf_counter()
+    cpu = time.process_time()
+    for i in range(n_messages):
+        msg.publish(uuid_trainer=trainers[i % n_trainers], measured_power=200 + i % 50, percent_ftp=90)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    # Stopping the queue flushes it; its drain time is not on the publishing thread.
+    logs.configure(per_second, interval, use_queue=False)
+    handler.close()
+    root.removeHandler(handler)
+    return n_messages / elapsed, cpu / n_messages * 1e6, os.path.getsize(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish throughput with and without log limits.")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages published per mode.")
+    parser.add_argument("--trainers", type=int, default=40, help="Trainers the messages cycle over.")
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<24}{'msgs/s':>10}{'cpu us/msg':>12}{'log bytes':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.log")
+        for name, level, per_second, interval, use_queue in MODES:
+            rate, cpu_us, size = _run(path, level, per_second, interval, use_queue,
+                                      args.messages, args.trainers)
+            print(f"{name:<24}{rate:>10.0f}{cpu_us:>12.1f}{size:>12}")
+    logs.configure()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+session_benchmark.py
+
+Runs 100 concurrent classes two ways and reports CPU time and thread count:
+  - thread-per-plan: 100 stand-alone Coach instances, each with its own plan thread;
+  - SessionManager: 100 sessions on one client, fired by a single shared scheduler.
+
+Plans are compressed (one segment every 50 ms) so the run is short; no broker is
+needed because publishes go to an in-memory client.
+
+Run from the repository root:
+    python -m benchmarks.session_benchmark
+"""
+
+import logging
+import threading
+import time
+
+from mqtt_services.coach import Coach
+from mqtt_services.sessions import SessionManager
+
+N_SESSIONS = 100
+PLAN = [(0.05 * i, 50 + 5 * i, 85, f"Segment {i}") for i in range(20)] + [(1.0, 0, 85, "stop")]
+
+
+class _Result:
+    rc = 0
+
+
+class _NullClient:
+    """Implements the paho calls the agents make, without any network I/O."""
+    def subscribe(self, topic, *args, **kwargs):
+        return 0, 1
+
+    def unsubscribe(self, topic, *args, **kwargs):
+        return 0, 1
+
+    def message_callback_add(self, sub, callback):
+        pass
+
+    def message_callback_remove(self, sub):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def publish(self, topic, payload, *args, **kwargs):
+        return _Result()
+
+
+def _measure(start, is_done):
+    """Runs start(), samples the thread count until is_done() and returns (cpu s, wall s, peak threads)."""
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    start()
+    peak = threading.active_count()
+    while not is_done():
+        peak = max(peak, threading.active_count())
+        time.sleep(0.01)
+    return time.process_time() - cpu0, time.perf_counter() - wall0, peak
+
+
+def thread_per_plan():
+    coaches = [Coach(_NullClient(), PLAN) for _ in range(N_SESSIONS)]
+
+    def start():
+        for coach in coaches:
+            coach.start_plan()
+    return _measure(start, lambda: not any(coach.plan_thread.is_alive() for coach in coaches))
+
+
+def session_manager():
+    manager = SessionManager(_NullClient())
+    for i in range(N_SESSIONS):
+        manager.create_session(f"class_{i}", PLAN)
+
+    def start():
+        manager.start()
+        for session_id in manager.sessions:
+            manager.start_session(session_id)
+    result = _measure(start, lambda: len(manager.scheduler) == 0)
+    manager.stop()
+    return result
+
+
+def main():
+    logging.disable(logging.WARNING)
+    print(f"{N_SESSIONS} concurrent sessions, {len(PLAN)} segments each")
+    print(f"{'mode':<18}{'cpu s':>8}{'wall s':>8}{'threads':>9}")
+    for name, run in (("thread-per-plan", thread_per_plan), ("SessionManager", session_manager)):
+        cpu, wall, threads = run()
+        print(f"{name:<18}{cpu:>8.3f}{wall:>8.3f}{threads:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+timestamp_benchmark.py
+
+Measures the cost of timestamping in the messaging layer:
+  - import time of mqtt_services.messaging, and of numpy which it used to pull in;
+  - per-call cost of the old np.datetime64('now', 's') stamp against clock.now();
+  - per-publish cost of MQTT_MessageType.publish with a fresh and a precomputed stamp.
+
+Run from the repository root:
+    python -m benchmarks.timestamp_benchmark
+"""
+
+import logging
+import subprocess
+import sys
+import timeit
+
+from mqtt_services import clock
+from mqtt_services.messaging import SetMeasuredPower
+
+
+def _import_ms(module):
+    """Imports a module in a fresh interpreter and returns the import time in milliseconds."""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - t) * 1e3)"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _per_call_us(func, number=100000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+class _Result:
+    rc = 0
+
+
+class _NullClient:
+    """Accepts publishes without any network I/O."""
+    def publish(self, topic, payload, *args, **kwargs):
+        return _Result()
+
+
+def main():
+    logging.disable(logging.INFO)
+
+    print("import time (ms, fresh interpreter)")
+    print(f"  mqtt_services.messaging   {_import_ms('mqtt_services.messaging'):8.1f}")
+    try:
+        import numpy as np
+        print(f"  numpy (previous hard dep) {_import_ms('numpy'):8.1f}")
+    except ImportError:
+        np = None
+
+    print("per-stamp cost (us)")
+    if np is not None:
+        print(f"  np.datetime64('now','s')  {_per_call_us(lambda: np.datetime64('now', 's').astype(str)):8.3f}")
+    print(f"  clock.now()               {_per_call_us(clock.now):8.3f}")
+
+    msg = SetMeasuredPower(_NullClient())
+    stamp = clock.now()
+    print("per-publish cost (us)")
+    print(f"  fresh stamp               "
+          f"{_per_call_us(lambda: msg.publish(uuid_trainer='t1', measured_power=200, percent_ftp=95), 20000):8.3f}")
+    print(f"  precomputed tick stamp    "
+          f"{_per_call_us(lambda: msg.publish(stamp=stamp, uuid_trainer='t1', measured_power=200, percent_ftp=95), 20000):8.3f}")
+
+
+if __name__ == "__main__":
+    main()
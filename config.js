@@ -4,6 +4,8 @@ var Config = (function() {
   return {
     mqtt_hostname: localStorage.getItem('mqtt_hostname') || 'mqtt.eclipseprojects.io',
     mqtt_port: Number(localStorage.getItem('mqtt_port')) || 80,
-    APP_ID: localStorage.getItem('APP_ID') || 'UniqueAppID_for_training_sessions'
+    APP_ID: localStorage.getItem('APP_ID') || 'UniqueAppID_for_training_sessions',
+    // Set when the bridge publishes APP_ID/trainer/<uuid>/power and .../cadence.
+    per_trainer_topics: localStorage.getItem('per_trainer_topics') === 'true'
   };
 })();
@@ -7,26 +7,43 @@ This script runs an integrated test of three agents:
   - Rider
   - WirelessBridge
 
-Each agent is run in its own thread with its own MQTT client.
-They interact via MQTT messages on the common broker (hostname) using the APP_ID namespace.
+The agents talk through an in-process broker (mqtt_services.fake_broker) instead of a
+network broker, and every plan and poll loop runs on a shared VirtualClock. The full
+coach -> bridge -> rider flow of a 12-minute plan therefore runs in exact virtual time
+and finishes in well under a second, with no network access. The bridge and riders run
+the plan locally from the retained start_plan, including a rider that joins mid-plan.
+
+It also checks that every segment fires exactly at its plan offset on the virtual
+clock, from the plan thread and from a Scheduler, with and without a pause, and that
+a bridge with a deadband republishes a steady trainer within the analytics' MAX_GAP,
+and that a bridge and rider joined to one of several sessions follow its plan.
+
+Run from the repository root:
+    python integrated_test.py [-v]
 """
 
+import sys
 import time
-import threading
 import logging
-import paho.mqtt.client as mqtt
+from collections import Counter
 
 # Import agent classes from the new mqtt_services directory.
 from mqtt_services.coach import Coach
 from mqtt_services.rider import Rider
 from mqtt_services.wireless_bridge import WirelessBridge
-from mqtt_services.constants import APP_ID, hostname
+from mqtt_services.sessions import SessionManager
+from mqtt_services.devices import SimulatedBackend
+from mqtt_services.fake_broker import FakeBroker, FakeClient
+from mqtt_services.clock import VirtualClock
+from mqtt_services.codec import decode_payload
+from mqtt_services.scheduler import Scheduler
+from mqtt_services.analytics import MAX_GAP, resample
+from mqtt_services.constants import APP_ID
 
 # Configure logging.
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("IntegratedTest")
 
-# ----- Define functions to run each agent -----
 plan = [
         (0, 60, 85, "New Warmup"),
         (60 * 6, 110, 80, "New Interval"),
@@ -35,78 +52,239 @@ plan = [
         (60 * 12, 0, 85, "New Stop"),
     ]
 
-def run_coach():
-    logger.info("Starting Coach agent...")
-    coach = Coach(coach_client)
-    coach.request_device_list()
-    time.sleep(2)
-    # Start the training plan.
-    coach.start_plan()
-    # Let the training plan run for a while, then stop it.
-    time.sleep(20)
-    coach.stop_plan()
-    logger.info("Coach agent finished.")
-
-def run_rider():
-    logger.info("Starting Rider agent...")
-    rider = Rider(rider_client)
-    time.sleep(3)
+
+class TopicCounter:
+    """Counts the messages published on each APP_ID topic."""
+    def __init__(self, client):
+        self.counts = Counter()
+        client.message_callback_add(f"{APP_ID}/#", self._count)
+        client.subscribe(f"{APP_ID}/#")
+
+    def _count(self, client, userdata, msg):
+        self.counts[msg.topic[len(APP_ID) + 1:]] += 1
+
+
+def check(condition, description):
+    logger.info(f"{'PASS' if condition else 'FAIL'}: {description}")
+    return condition
+
+
+def run(verbose=False):
+    """Runs the whole plan on virtual time. Returns True if every check passed."""
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    broker = FakeBroker()
+    clock = VirtualClock()
+    counter = TopicCounter(FakeClient(broker, "monitor"))
+
+    coach = Coach(FakeClient(broker, "coach"), plan, clock=clock)
+    rider = Rider(FakeClient(broker, "rider"), clock=clock)
+    backend = SimulatedBackend(rate=1.0, seed=0, clock=clock)
+    wb = WirelessBridge(FakeClient(broker, "wireless_bridge"), backend=backend, clock=clock)
+
+    start = time.perf_counter()
     rider.request_device_list()
-    time.sleep(1)
     rider.pair_device("trainer_123", "rider_001")
-    time.sleep(1)
     rider.set_ftp("trainer_123", 100)
     rider.set_ftp("trainer_456", 200)
     rider.set_ftp("trainer_789", 300)
-    time.sleep(1)
     rider.request_training_plan()
-    # Let the rider run and process incoming messages.
-    time.sleep(25)
-    logger.info("Rider agent finished.")
 
-def run_wireless_bridge():
-    logger.info("Starting WirelessBridge agent...")
-    wb = WirelessBridge(wb_client)
     wb.start()
-    # Let the WirelessBridge simulate polling & measured power for a while.
-    time.sleep(300)
+    coach.start_plan()
+    # A rider joining 70 s into the warmup gets the retained plan and start_plan.
+    clock.advance(70)
+    late_rider = Rider(FakeClient(broker, "late_rider"), clock=clock)
+    late_segment, late_targets, late_countdown = late_rider.segment, late_rider.targets, late_rider.countdown()
+    # Halfway through the interval, the locally run plans must agree with the coach.
+    clock.advance(plan[1][0] + 30 - clock.monotonic())
+    rider_segment, rider_countdown = rider.segment, rider.countdown()
+    late_interval = late_rider.segment, late_rider.countdown()
+    bridge_interval = wb.segment, wb.target_power
+    # Run the plan to its stop segment and a few seconds beyond.
+    clock.advance(plan[-1][0] + 5 - clock.monotonic())
+    wb.stop()
+    # start_plan was cleared on stop, so a rider joining now runs nothing.
+    after_rider = Rider(FakeClient(broker, "after_rider"), clock=clock)
+    elapsed = time.perf_counter() - start
+
+    logging.getLogger().setLevel(logging.INFO)
+    counts = counter.counts
+    logger.info(f"Ran {clock.monotonic():.0f} virtual seconds in {elapsed:.3f} s; "
+                f"{broker.published} messages: {dict(counts)}")
+    ticks = int(plan[-1][0] + 5)
+    results = [
+        check(counts["set_segment"] == counts["set_target_power"] == counts["set_target_cadence"] == 0,
+              "no per-segment broadcasts: the plan ran locally"),
+        check(bridge_interval == (1, plan[1][1]), "bridge ran the plan locally"),
+        check(wb.segment == len(plan) - 1 and wb.target_power == 0, "bridge applied the last segment"),
+        check(counts["stop_plan"] == 1, "coach stopped the plan"),
+        check(rider_segment == 1 and abs(rider_countdown - 30) < 0.5 and rider.targets is None,
+              "rider ran the plan locally until stop_plan"),
+        check(late_segment == 0 and late_targets == plan[0][1:3] and abs(late_countdown - (plan[1][0] - 70)) < 0.5
+              and late_interval[0] == 1 and abs(late_interval[1] - 30) < 0.5,
+              "a rider joining mid-plan ran it from the segment in force"),
+        check(after_rider.plan_version == coach._plan_cache[0] and after_rider.segment is None,
+              "a rider joining after stop_plan got the plan but did not run it"),
+        check(rider.plan_version == coach._plan_cache[0] and counts["send_plan"] == 1,
+              "rider got the retained plan without a second broadcast"),
+        check(counts["device_list"] == 1, "bridge answered list_devices"),
+        check(wb.pairings.get("trainer_123") == "rider_001", "bridge recorded the pairing"),
+        check(wb.ftps == {"trainer_123": 100, "trainer_456": 200, "trainer_789": 300}, "bridge recorded the FTPs"),
+        check(abs(counts["set_measured_power"] - 3 * ticks) <= 6, "bridge published one reading per trainer per second"),
+        check(coach.telemetry.summary("trainer_123")["samples"] >= ticks - 2, "coach recorded the telemetry"),
+        check(elapsed < 1.0, "the 12-minute plan finished in under a second"),
+    ]
+    return all(results)
+
+
+def segment_fire_times(use_scheduler=False, pause=None, restart=None):
+    """
+    Runs the plan on a VirtualClock and returns, for every set_segment as it is published,
+    (segment, plan running time, virtual time since the start).
+
+    Parameters:
+        use_scheduler (bool): Fire the segments from a Scheduler instead of the plan thread.
+        pause (tuple, optional): (at, length): pause the plan at `at` seconds for `length` seconds.
+        restart (float, optional): Start the plan again this many seconds after the first start.
+    """
+    broker = FakeBroker()
+    clock = VirtualClock()
+    scheduler = Scheduler(clock) if use_scheduler else None
+    coach = Coach(FakeClient(broker, "coach"), plan, clock=clock, scheduler=scheduler, broadcast_segments=True)
+    fired = []
+    listener = FakeClient(broker, "listener")
+    listener.message_callback_add(f"{APP_ID}/set_segment", lambda client, userdata, msg: fired.append(
+        (decode_payload(msg.payload)["segment"], coach.plan_elapsed(), clock.monotonic())))
+    listener.subscribe(f"{APP_ID}/set_segment")
+    if scheduler is not None:
+        scheduler.start()
+    coach.start_plan()
+    if pause is not None:
+        at, length = pause
+        clock.advance(at)
+        coach.pause_plan()
+        clock.advance(length)
+        coach.resume_plan()
+    if restart is not None:
+        clock.advance(restart)
+        coach.start_plan()
+    clock.advance(plan[-1][0] + 5 + (pause[1] if pause else 0) + (restart or 0) - clock.monotonic())
+    coach.close()
+    if scheduler is not None:
+        scheduler.stop()
+    return fired
+
+
+def run_segment_timing():
+    """
+    Checks that every segment fires exactly at its plan offset, with and without a
+    scheduler, that a pause shifts the later segments by exactly its length, and that
+    a plan started again on the scheduler runs from its new start.
+    Returns True if every check passed.
+    """
+    offsets = [segment[0] for segment in plan]
+    pause = (60 * 6 + 30, 90)   # within the interval segment
+    results = []
+    for use_scheduler in (False, True):
+        mode = "scheduler" if use_scheduler else "plan thread"
+        fired = segment_fire_times(use_scheduler)
+        results.append(check(
+            [index for index, _, _ in fired] == list(range(len(plan)))
+            and [elapsed for _, elapsed, _ in fired] == offsets
+            and [t for _, _, t in fired] == offsets,
+            f"{mode}: every segment fired at its offset"))
+        fired = segment_fire_times(use_scheduler, pause)
+        expected = [offset + (pause[1] if offset > pause[0] else 0) for offset in offsets]
+        results.append(check(
+            [index for index, _, _ in fired] == list(range(len(plan)))
+            and [elapsed for _, elapsed, _ in fired] == offsets
+            and [t for _, _, t in fired] == expected,
+            f"{mode}: segments after a pause fired at their offset plus the pause"))
+    # Starting a running plan again restarts it from segment 0. The plan thread keeps its timing,
+    # so only the scheduler restarts.
+    restart = 30
+    fired = segment_fire_times(True, restart=restart)
+    results.append(check(
+        [index for index, _, _ in fired] == [0] + list(range(len(plan)))
+        and [elapsed for _, elapsed, _ in fired] == [0] + offsets
+        and [t for _, _, t in fired] == [0] + [offset + restart for offset in offsets],
+        "scheduler: a restarted plan fired every segment at its offset from the restart"))
+    return all(results)
+
+
+def run_deadband_heartbeat():
+    """
+    Checks that a bridge with a deadband publishes a steady trainer only on its heartbeat, often
+    enough that the analytics, resampling with MAX_GAP, see no dropout. Returns True if every
+    check passed.
+    """
+    broker = FakeBroker()
+    clock = VirtualClock()
+    # The simulated power and cadence scatter by 20 and 15, within the deadbands.
+    backend = SimulatedBackend(["trainer_123"], rate=1.0, seed=0, clock=clock)
+    wb = WirelessBridge(FakeClient(broker, "wireless_bridge"), backend=backend, clock=clock,
+                        power_deadband=25, cadence_deadband=25)
+    times = []
+    listener = FakeClient(broker, "listener")
+    listener.message_callback_add(f"{APP_ID}/set_measured_power",
+                                  lambda client, userdata, msg: times.append(clock.monotonic()))
+    listener.subscribe(f"{APP_ID}/set_measured_power")
+    duration = 120
+    wb.start()
+    clock.advance(duration)
     wb.stop()
-    logger.info("WirelessBridge agent finished.")
-
-# ----- Create separate MQTT client instances for each agent -----
-coach_client = mqtt.Client(client_id="coach", protocol=mqtt.MQTTv311, callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
-rider_client = mqtt.Client(client_id="rider", protocol=mqtt.MQTTv311, callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
-wb_client = mqtt.Client(client_id="wireless_bridge", protocol=mqtt.MQTTv311, callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
-
-# Connect and subscribe each client.
-for client in [coach_client, rider_client, wb_client]:
-    client.connect(hostname)
-    client.subscribe(f"{APP_ID}/#")
-    client.loop_start()
-
-# ----- Start each agent in its own thread -----
-#coach_thread = threading.Thread(target=run_coach)
-#rider_thread = threading.Thread(target=run_rider)
-wb_thread = threading.Thread(target=run_wireless_bridge)
-wb_thread.start()
-time.sleep(1)
-#coach_thread.start()
-time.sleep(1)
-#rider_thread.start()
-
-# Wait for all threads to complete.
-wb_thread.join()
-time.sleep(1)
-#coach_thread.join()
-time.sleep(1)
-#rider_thread.join()
-
-
-
-# ----- Clean up MQTT clients -----
-#for client in [coach_client, rider_client, wb_client]:
-for client in [rider_client, coach_client]:
-    client.loop_stop()
-    client.disconnect()
-
-logger.info("Integrated test complete.")
+    power = resample(times, [100] * len(times), duration)
+    try:
+        WirelessBridge(FakeClient(broker, "slow_heartbeat"), backend=backend, clock=clock,
+                       power_deadband=25, heartbeat=MAX_GAP)
+        rejected = False
+    except ValueError:
+        rejected = True
+    return all([
+        check(0 < len(times) <= duration / wb.heartbeat + 1, "deadband: a steady trainer is published on its heartbeat only"),
+        check(times and power[int(times[0]) + 1:].all(), "heartbeat: the analytics see no dropout"),
+        check(rejected, "a heartbeat the analytics would count as a dropout is rejected"),
+    ])
+
+
+def run_sessions():
+    """
+    Runs two classes from one SessionManager: a bridge and a rider joined to one session must
+    follow its plan, and each session must record only the telemetry of its own trainers.
+    Returns True if every check passed.
+    """
+    broker = FakeBroker()
+    clock = VirtualClock()
+    manager = SessionManager(FakeClient(broker, "sessions"), clock=clock)
+    class_a = manager.create_session("classA", plan)
+    class_b = manager.create_session("classB", plan)
+    manager.pair_device("classA", "trainer_123", "rider_001")
+    manager.pair_device("classB", "trainer_456", "rider_002")
+    rider = Rider(FakeClient(broker, "rider"), clock=clock, session="classA")
+    backend = SimulatedBackend(rate=1.0, seed=0, clock=clock)
+    wb = WirelessBridge(FakeClient(broker, "wireless_bridge"), backend=backend, clock=clock,
+                        batch_telemetry=True, session="classA")
+    manager.start()
+    wb.start()
+    manager.start_session("classA")
+    clock.advance(70)
+    bridge_state = wb.segment, wb.target_power
+    rider_state = rider.plan_version, rider.segment
+    wb.stop()
+    manager.stop()
+    return all([
+        check(bridge_state == (0, plan[0][1]), "a session's bridge follows its plan"),
+        check(rider_state == (class_a._plan_cache[0], 0), "a session's rider gets and runs its plan"),
+        check(class_a.telemetry.trainers() == ["trainer_123"] and class_b.telemetry.trainers() == ["trainer_456"],
+              "telemetry frames are split by the sessions' pairings"),
+    ])
+
+
+if __name__ == "__main__":
+    ok = run(verbose="-v" in sys.argv)
+    ok = run_segment_timing() and ok
+    ok = run_deadband_heartbeat() and ok
+    ok = run_sessions() and ok
+    logger.info("Integrated test complete." if ok else "Integrated test FAILED.")
+    sys.exit(0 if ok else 1)
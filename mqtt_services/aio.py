@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+aio.py
+
+An asyncio runtime for the Coach, Rider and WirelessBridge agents.
+
+By default every agent calls paho's loop_start(), which runs the network loop in a
+background thread, and the coach and bridge add their own plan and polling threads.
+Handlers then touch shared dicts such as pairings and ftps from several threads.
+
+Here all of that runs in one event loop thread instead:
+    - AsyncMQTTClient drives a paho client from the event loop using paho's socket
+      callbacks, so message handlers run on the loop and loop_start() is a no-op.
+    - AsyncScheduler implements the Scheduler interface on loop.call_at(), so a Coach
+      created with it fires its plan segments as loop callbacks instead of a thread, and
+      so do the plans that riders and bridges run locally.
+    - WirelessBridge.run_async() is the polling loop as a coroutine, and the bridge's
+      simulated trainers push their notifications through the AsyncScheduler too.
+
+AgentRuntime wires these together so one process can host a coach, bridges and many
+simulated riders, each with its own broker connection, without a thread per agent.
+"""
+
+import asyncio
+import logging
+
+import paho.mqtt.client as mqtt
+
+from . import clock
+from .coach import Coach
+from .devices import SimulatedBackend
+from .rider import Rider
+from .wireless_bridge import WirelessBridge
+from .constants import hostname
+
+# Configure logging.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("AgentRuntime")
+
+
+class AsyncMQTTClient:
+    """
+    Runs a paho client's network I/O on an asyncio event loop.
+
+    Every other attribute (subscribe, publish, message_callback_add, ...) is forwarded
+    to the wrapped paho client, so agents use it exactly like an mqtt.Client.
+    """
+
+    def __init__(self, client, loop):
+        """
+        Parameters:
+            client (mqtt.Client): The paho client to drive.
+            loop (asyncio.AbstractEventLoop): The event loop to run it on.
+        """
+        self._client = client
+        self._loop = loop
+        self._misc_task = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._client, name, value)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        # Keepalive pings and retries; paho expects loop_misc() about once per second.
+        while self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def loop_start(self):
+        """No-op: the event loop already drives the network I/O."""
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        """No-op counterpart of loop_start()."""
+        return mqtt.MQTT_ERR_SUCCESS
+
+
+class _LoopClock:
+    """Clock interface (see clock.SystemClock) backed by the event loop's monotonic time."""
+
+    def __init__(self, loop):
+        self._loop = loop
+
+    def monotonic(self):
+        return self._loop.time()
+
+    def wall(self):
+        return clock.wall()
+
+    def wait(self, condition, timeout=None):
+        raise RuntimeError("Blocking waits are not allowed on the event loop; use AsyncScheduler.")
+
+    def started(self, thread):
+        pass
+
+    def notified(self, condition):
+        pass
+
+
+class AsyncScheduler:
+    """The scheduler.Scheduler interface implemented with loop.call_at()."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.clock = _LoopClock(loop)
+
+    def call_at(self, deadline, callback, *args):
+        """Schedules callback(*args) at a deadline on the loop's clock; returns a handle with cancel()."""
+        return self.loop.call_at(deadline, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        """Schedules callback(*args) delay seconds from now."""
+        return self.loop.call_later(delay, callback, *args)
+
+
+class AgentRuntime:
+    def __init__(self, host=hostname, port=1883):
+        """
+        Initializes the AgentRuntime. Create it inside a running event loop.
+
+        Parameters:
+            host (str, optional): The MQTT broker host.
+            port (int, optional): The MQTT broker port.
+        """
+        self.host = host
+        self.port = port
+        self.loop = asyncio.get_running_loop()
+        self.scheduler = AsyncScheduler(self.loop)
+        self.clients = []
+        self.bridges = []
+        self.tasks = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def client(self, client_id=""):
+        """Creates and connects an MQTT client driven by the event loop."""
+        paho_client = mqtt.Client(
+            client_id=client_id,
+            protocol=mqtt.MQTTv311,
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+        )
+        client = AsyncMQTTClient(paho_client, self.loop)
+        client.connect(self.host, self.port)
+        self.clients.append(client)
+        return client
+
+    def add_coach(self, training_plan=None, session=None, client_id=""):
+        """Creates a Coach whose plan segments fire on the event loop."""
+        return Coach(self.client(client_id), training_plan, session=session, scheduler=self.scheduler)
+
+    def add_rider(self, session=None, client_id=""):
+        """Creates a Rider whose locally run plan fires on the event loop."""
+        return Rider(self.client(client_id), scheduler=self.scheduler, session=session)
+
+    def add_bridge(self, trainer_ids=None, client_id="", **options):
+        """Creates a WirelessBridge and starts its polling coroutine."""
+        options.setdefault("backend", SimulatedBackend(trainer_ids, scheduler=self.scheduler))
+        options.setdefault("scheduler", self.scheduler)
+        bridge = WirelessBridge(self.client(client_id), trainer_ids, **options)
+        self.bridges.append(bridge)
+        self.tasks.append(self.loop.create_task(bridge.run_async()))
+        return bridge
+
+    async def close(self):
+        """Stops the bridges, waits for the runtime's tasks and disconnects every client."""
+        for bridge in self.bridges:
+            bridge.stop_async()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        for client in self.clients:
+            client.disconnect()
+
+
+async def main(n_riders=10, duration=20):
+    """Hosts a coach, a bridge and n_riders simulated riders in one event loop."""
+    runtime = AgentRuntime()
+    coach = runtime.add_coach(client_id="coach")
+    bridge = runtime.add_bridge(client_id="wireless_bridge", batch_telemetry=True)
+    riders = [runtime.add_rider(client_id=f"rider_{i}") for i in range(n_riders)]
+    await asyncio.sleep(1)
+    for i, (rider, trainer_id) in enumerate(zip(riders, bridge.trainer_ids)):
+        rider.pair_device(trainer_id, f"rider_{i}")
+    coach.start_plan()
+    await asyncio.sleep(duration)
+    coach.stop_plan()
+    await runtime.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,257 @@
+'''
+Begin analytics.py
+
+Post-ride metrics for a recorded session: Normalized Power, Intensity Factor,
+Training Stress Score, compliance with each plan segment and mean-maximal
+power curves.
+
+A session is the training plan (the coach's list of (start_time_offset,
+target_power, target_cadence, description) tuples) plus, per trainer, arrays
+of sample time in seconds from the plan start, power and optionally cadence.
+The samples are resampled onto a common grid so the whole class is one
+riders x samples matrix, and every metric is computed for all riders at once
+with cumulative sums and reductions along the time axis; nothing loops over
+samples in Python.
+'''
+import numpy as np
+
+# Durations in seconds of the mean-maximal power curve.
+MMP_DURATIONS = (1, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# Longest gap in seconds between a trainer's samples that is not a dropout. A bridge
+# publishing on change must republish a steady trainer within it (see WirelessBridge heartbeat).
+MAX_GAP = 5.0
+
+
+def resample(times, values, duration, rate=1.0, max_gap=MAX_GAP):
+    """
+    Resamples irregular samples onto a regular grid by holding each value until the next sample.
+
+    Parameters:
+        times (array): Sample times in seconds from the session start, ascending.
+        values (array): Sample values.
+        duration (float): Session length in seconds.
+        rate (float, optional): Grid rate in Hz.
+        max_gap (float, optional): A value is held for at most this many seconds; grid points
+                                   further from any earlier sample (dropouts) are 0.
+
+    Returns:
+        np.ndarray: float64 values at times 0, 1/rate, 2/rate, ... < duration.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    grid = np.arange(int(duration * rate)) / rate
+    out = np.zeros(len(grid))
+    if not len(times):
+        return out
+    index = np.searchsorted(times, grid, side='right') - 1
+    valid = index >= 0
+    held = np.where(valid, index, 0)
+    valid &= grid - times[held] <= max_gap
+    out[valid] = values[held[valid]]
+    return out
+
+
+def session_matrix(series, duration, rate=1.0, column=1, max_gap=MAX_GAP):
+    """
+    Stacks the trainers of a session into one matrix.
+
+    Parameters:
+        series (dict): key: uuid_trainer, value: (times, power) or (times, power, cadence).
+        duration (float): Session length in seconds.
+        rate (float, optional): Grid rate in Hz.
+        column (int, optional): 1 for power, 2 for cadence.
+        max_gap (float, optional): See resample().
+
+    Returns:
+        tuple: (list of uuid_trainer, np.ndarray of shape (riders, samples)).
+    """
+    uuids = list(series)
+    matrix = np.zeros((len(uuids), int(duration * rate)))
+    for row, uuid_trainer in enumerate(uuids):
+        arrays = series[uuid_trainer]
+        if len(arrays) > column:
+            matrix[row] = resample(arrays[0], arrays[column], duration, rate, max_gap)
+    return uuids, matrix
+
+
+def rolling_mean(matrix, window):
+    """
+    Returns the trailing means over window samples along the last axis.
+    The result has window - 1 fewer columns than the input (only full windows).
+    """
+    csum = np.cumsum(matrix, axis=-1, dtype=np.float64)
+    csum = np.concatenate([np.zeros(csum.shape[:-1] + (1,)), csum], axis=-1)
+    return (csum[..., window:] - csum[..., :-window]) / window
+
+
+def normalized_power(matrix, rate=1.0):
+    """
+    Returns each rider's Normalized Power: the fourth root of the mean of the fourth
+    power of the 30 s rolling mean power. Rides shorter than 30 s fall back to mean power.
+    """
+    window = int(round(30 * rate))
+    if matrix.shape[-1] < window:
+        return matrix.mean(axis=-1)
+    return np.mean(rolling_mean(matrix, window) ** 4, axis=-1) ** 0.25
+
+
+def intensity_factor(normalized, ftp):
+    """Returns Normalized Power as a fraction of FTP."""
+    return np.asarray(normalized) / np.asarray(ftp, dtype=np.float64)
+
+
+def training_stress_score(normalized, ftp, duration):
+    """Returns TSS: 100 for an hour at FTP."""
+    ftp = np.asarray(ftp, dtype=np.float64)
+    return duration * np.asarray(normalized) * intensity_factor(normalized, ftp) / (ftp * 3600) * 100
+
+
+def mean_max_power(matrix, durations=MMP_DURATIONS, rate=1.0):
+    """
+    Returns the mean-maximal power curve of every rider.
+
+    Returns:
+        tuple: (durations that fit in the session, np.ndarray of shape (riders, durations)).
+    """
+    csum = np.cumsum(matrix, axis=-1, dtype=np.float64)
+    csum = np.concatenate([np.zeros(csum.shape[:-1] + (1,)), csum], axis=-1)
+    fitting = [d for d in durations if int(round(d * rate)) <= matrix.shape[-1]]
+    curve = np.empty(matrix.shape[:-1] + (len(fitting),))
+    for k, d in enumerate(fitting):
+        n = int(round(d * rate))
+        curve[..., k] = np.max(csum[..., n:] - csum[..., :-n], axis=-1) / n
+    return fitting, curve
+
+
+def segment_bounds(training_plan, duration, rate=1.0):
+    """
+    Returns the sample index of each plan segment's start and end.
+    A segment lasts until the next segment's offset; the last one until the end of the session.
+    """
+    offsets = np.array([segment[0] for segment in training_plan], dtype=np.float64)
+    starts = np.minimum((offsets * rate).astype(int), int(duration * rate))
+    ends = np.append(starts[1:], int(duration * rate))
+    return starts, ends
+
+
+def segment_compliance(power, training_plan, ftp, rate=1.0, tolerance=5, cadence=None):
+    """
+    Measures how well each rider followed each plan segment.
+
+    Parameters:
+        power (np.ndarray): Power matrix (riders, samples).
+        training_plan (list of tuples): The plan the session ran.
+        ftp (array): FTP of each rider in watts.
+        rate (float, optional): Grid rate in Hz.
+        tolerance (float, optional): Half-width of the target zone, in percent FTP.
+        cadence (np.ndarray, optional): Cadence matrix (riders, samples).
+
+    Returns:
+        dict of np.ndarray, each of shape (riders, segments); NaN for empty or zero-target segments:
+            mean_power: Mean power in the segment.
+            compliance: Mean power as percent of the target power.
+            time_in_zone: Fraction of the segment within the target +/- tolerance.
+            mean_cadence: Mean cadence (only if cadence is given).
+    """
+    ftp = np.asarray(ftp, dtype=np.float64)[:, None]
+    starts, ends = segment_bounds(training_plan, power.shape[-1] / rate, rate)
+    lengths = (ends - starts).astype(np.float64)
+    targets = np.array([segment[1] for segment in training_plan], dtype=np.float64)
+
+    # Target percent at every sample, then one reduceat per metric over the segment starts.
+    per_sample = np.concatenate([np.full(starts[0], np.nan), np.repeat(targets, ends - starts)])
+    percent = power / ftp * 100
+    in_zone = np.abs(percent - per_sample) <= tolerance
+
+    nonempty = lengths > 0
+    idx = starts[nonempty]
+
+    def segment_means(matrix):
+        out = np.full((power.shape[0], len(training_plan)), np.nan)
+        if len(idx):
+            out[:, nonempty] = np.add.reduceat(matrix, idx, axis=-1) / lengths[nonempty]
+        return out
+
+    mean_power = segment_means(power)
+    target_watts = targets * ftp / 100
+    with np.errstate(divide='ignore', invalid='ignore'):
+        compliance = np.where(targets > 0, mean_power / target_watts * 100, np.nan)
+    time_in_zone = np.where(targets > 0, segment_means(in_zone.astype(np.float64)), np.nan)
+    result = {
+        "mean_power": mean_power,
+        "compliance": compliance,
+        "time_in_zone": time_in_zone,
+    }
+    if cadence is not None:
+        result["mean_cadence"] = segment_means(cadence)
+    return result
+
+
+def analyze_session(training_plan, series, ftps, duration=None, rate=1.0, tolerance=5):
+    """
+    Computes the post-ride metrics of a whole class.
+
+    Parameters:
+        training_plan (list of tuples): The plan the session ran.
+        series (dict): key: uuid_trainer, value: (times, power) or (times, power, cadence),
+                       times in seconds from the plan start.
+        ftps (dict): key: uuid_trainer, value: FTP in watts. Missing trainers use 100 W,
+                     the default the bridge uses too.
+        duration (float, optional): Session length in seconds; defaults to the plan's last offset.
+        rate (float, optional): Analysis grid rate in Hz.
+        tolerance (float, optional): Half-width of the target zone, in percent FTP.
+
+    Returns:
+        dict: key: uuid_trainer, value: dict of normalized_power, intensity_factor, tss,
+              average_power, segments (list of per-segment dicts) and mmp ({duration: watts}).
+    """
+    if duration is None:
+        duration = training_plan[-1][0]
+    uuids, power = session_matrix(series, duration, rate)
+    _, cadence = session_matrix(series, duration, rate, column=2)
+    ftp = np.array([ftps.get(uuid_trainer, 100) for uuid_trainer in uuids], dtype=np.float64)
+
+    normalized = normalized_power(power, rate)
+    factor = intensity_factor(normalized, ftp)
+    tss = training_stress_score(normalized, ftp, duration)
+    segments = segment_compliance(power, training_plan, ftp, rate, tolerance, cadence)
+    durations, mmp = mean_max_power(power, rate=rate)
+
+    def value(x):
+        return None if np.isnan(x) else float(x)
+
+    report = {}
+    for row, uuid_trainer in enumerate(uuids):
+        report[uuid_trainer] = {
+            "normalized_power": value(normalized[row]),
+            "intensity_factor": value(factor[row]),
+            "tss": value(tss[row]),
+            "average_power": value(power[row].mean()) if power.shape[-1] else None,
+            "segments": [
+                {
+                    "description": segment[3],
+                    "target_power": segment[1],
+                    **{name: value(metric[row, k]) for name, metric in segments.items()},
+                }
+                for k, segment in enumerate(training_plan)
+            ],
+            "mmp": {d: float(mmp[row, k]) for k, d in enumerate(durations)},
+        }
+    return report
+
+
+def series_from_store(store, start):
+    """
+    Builds analyze_session() input from a telemetry.TelemetryStore.
+
+    Parameters:
+        store (telemetry.TelemetryStore): The coach's telemetry.
+        start (float): Plan start on the samples' wall clock (epoch seconds), e.g. the
+                       start_time of start_plan or coach.Coach.plan_start_time().
+    """
+    series = {}
+    for uuid_trainer in store.trainers():
+        times, power, cadence, _ = store.arrays(uuid_trainer)
+        series[uuid_trainer] = (times - start, power, cadence)
+    return series
@@ -0,0 +1,241 @@
+'''
+Begin clock.py
+
+Timestamps for the MQTT messaging layer.
+
+A Timestamp pairs the wall clock (seconds since the epoch, for correlating
+messages across agents) with the monotonic clock (for measuring intervals on
+one host, immune to wall clock steps).  Both come from the time module at
+sub-microsecond resolution, so stamping a message costs two cheap calls and
+needs no third-party imports.
+
+A poller that publishes many messages per tick should take one stamp with
+now() and pass it to every publish so that the whole tick shares a time.
+
+Agents that schedule work take a clock object (SystemClock, or VirtualClock in
+tests) instead of calling time.sleep() and time.monotonic() themselves.  Plan
+start times, which agents exchange as wall clock times, come from the clock
+object's wall() too, so that they move with virtual time in tests.
+
+The wall clock of a Timestamp is corrected: wall() is time.time() plus OFFSET,
+this host's estimated offset from the coach's clock, which a ClockSync (see
+timesync.py) keeps up to date.  Until one runs the offset is 0, so
+timestamps, traces and plan start times from different hosts agree as
+closely as the sync exchange allows instead of as closely as their clocks do.
+'''
+import math
+import statistics
+import threading
+import time
+from collections import deque, namedtuple
+
+Timestamp = namedtuple('Timestamp', ['wall', 'mono'])
+Timestamp.__doc__ = """A (wall, mono) pair of float seconds from wall() and time.monotonic()."""
+
+
+class ClockOffset:
+    """
+    This host's wall clock offset from a reference clock, filtered over the last few
+    NTP-style samples.
+
+    Each sample is an (offset, round-trip delay) pair.  A sample whose request or response
+    was queued has a long delay and an offset that is off by up to half of it, so the
+    estimate is the median offset of the samples with the shorter half of the delays.
+    """
+
+    def __init__(self, samples=8):
+        """
+        Parameters:
+            samples (int, optional): The number of recent samples filtered.
+        """
+        self._samples = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.offset = 0.0
+        self.delay = None
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, offset, delay):
+        """
+        Adds a sample and updates the estimate.
+
+        Parameters:
+            offset (float): Reference time minus local time, in seconds.
+            delay (float): Round-trip time of the exchange, in seconds.
+        """
+        with self._lock:
+            self._samples.append((offset, max(0.0, delay)))
+            best = sorted(self._samples, key=lambda sample: sample[1])[:(len(self._samples) + 1) // 2]
+            self.offset = statistics.median(sample[0] for sample in best)
+            self.delay = statistics.median(sample[1] for sample in self._samples)
+
+    def reset(self):
+        """Drops the samples and the estimate."""
+        with self._lock:
+            self._samples.clear()
+            self.offset = 0.0
+            self.delay = None
+
+
+# The offset wall() and now() correct the local clock by.
+OFFSET = ClockOffset()
+
+
+def wall():
+    """Returns the corrected wall clock: epoch seconds on the reference clock."""
+    return time.time() + OFFSET.offset
+
+
+def now():
+    """Returns the current Timestamp, its wall clock corrected (see wall())."""
+    return Timestamp(time.time() + OFFSET.offset, time.monotonic())
+
+
+def isoformat(wall, timespec='milliseconds'):
+    """Formats a wall clock time (epoch seconds) as a UTC ISO-8601 string, e.g. for logging."""
+    seconds = int(wall)
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))
+    if timespec == 'milliseconds':
+        return f"{text}.{int((wall - seconds) * 1e3):03d}"
+    if timespec == 'microseconds':
+        return f"{text}.{int((wall - seconds) * 1e6):06d}"
+    return text
+
+
+class SystemClock:
+    """
+    The clock agents schedule against: monotonic time plus a wait primitive.
+
+    Schedulers never call time.sleep() or time.monotonic() directly; they take a
+    clock object with this interface so tests and simulations can substitute a
+    virtual clock.
+    """
+
+    def monotonic(self):
+        """Returns monotonic seconds."""
+        return time.monotonic()
+
+    def wall(self):
+        """Returns the corrected wall clock (see the module function wall())."""
+        return wall()
+
+    def wait(self, condition, timeout=None):
+        """
+        Waits on a held threading.Condition until notified or until timeout seconds pass.
+
+        Parameters:
+            condition (threading.Condition): The condition, already acquired by the caller.
+            timeout (float, optional): Seconds to wait; None waits until notified.
+        """
+        return condition.wait(timeout)
+
+    def started(self, thread):
+        """Called by an agent right after starting a thread that waits on this clock."""
+
+    def notified(self, condition):
+        """
+        Called by an agent right after notifying a condition that threads wait on through
+        this clock, with the condition still held.
+        """
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+class VirtualClock:
+    """
+    A clock whose time only moves when advance() is called, for tests and simulations.
+
+    Threads that wait on it (a coach's plan thread, a bridge's poll loop, a scheduler)
+    block until advance() reaches their deadline or they are notified as usual.
+    advance() steps from deadline to deadline and, after waking the threads that are
+    due, lets them run until they wait again or exit before moving on. A 12-minute
+    plan therefore runs in exact virtual time, as fast as the threads can do the work.
+    """
+
+    def __init__(self, start=0.0, settle_timeout=5.0):
+        """
+        Parameters:
+            start (float, optional): Initial virtual monotonic time.
+            settle_timeout (float, optional): Real seconds advance() waits for woken threads
+                                              to block again before giving up.
+        """
+        self._now = start
+        # The virtual wall clock starts at the real one and then moves with virtual time.
+        self._wall_base = wall() - start
+        self.settle_timeout = settle_timeout
+        self._state = threading.Condition()
+        self._waiting = {}    # key: thread, value: (deadline, condition)
+        self._running = set()  # threads woken and not yet waiting again
+
+    def monotonic(self):
+        return self._now
+
+    def wall(self):
+        return self._wall_base + self._now
+
+    def wait(self, condition, timeout=None):
+        thread = threading.current_thread()
+        deadline = math.inf if timeout is None else self._now + timeout
+        with self._state:
+            self._waiting[thread] = (deadline, condition)
+            self._running.discard(thread)
+            self._state.notify_all()
+        try:
+            # Released only by a notify: from advance() at the deadline, or from the owner.
+            return condition.wait()
+        finally:
+            with self._state:
+                self._waiting.pop(thread, None)
+                self._running.add(thread)
+
+    def started(self, thread):
+        # Until it first waits, a new thread counts as running, so advance() waits for it.
+        with self._state:
+            if thread not in self._waiting:
+                self._running.add(thread)
+
+    def notified(self, condition):
+        # The woken threads count as running until they wait again, so advance() does not
+        # move time past a deadline they have yet to recompute.
+        with self._state:
+            self._running.update(thread for thread, (_, waited) in self._waiting.items()
+                                 if waited is condition)
+
+    def _settle(self):
+        """Waits until no woken thread is still running. Must be called with _state held."""
+        limit = time.monotonic() + self.settle_timeout
+        while True:
+            self._running = {thread for thread in self._running if thread.is_alive()}
+            if not self._running:
+                return
+            if time.monotonic() > limit:
+                raise RuntimeError(f"Threads did not settle: {[t.name for t in self._running]}")
+            self._state.wait(0.01)
+
+    def settle(self):
+        """Lets threads woken by anything other than advance() run until they wait again."""
+        with self._state:
+            self._settle()
+
+    def advance(self, seconds):
+        """Moves time forward by seconds, running every wait that falls due on the way."""
+        with self._state:
+            target = self._now + seconds
+        while True:
+            with self._state:
+                self._settle()
+                due = min((deadline for deadline, _ in self._waiting.values()), default=math.inf)
+                if due > target:
+                    self._now = target
+                    return
+                self._now = max(self._now, due)
+                conditions = {condition for deadline, condition in self._waiting.values()
+                              if deadline <= self._now}
+                # Every thread on a notified condition wakes, not only those that are due.
+                self._running.update(thread for thread, (_, condition) in self._waiting.items()
+                                     if condition in conditions)
+            for condition in conditions:
+                with condition:
+                    condition.notify_all()
@@ -6,9 +6,12 @@ This module implements a Coach interface for the indoor cycling training system.
 It generates the following messages:
     - ListDevices
     - PairDevice
-    - SendPlan
+    - SendPlan and PlanVersion (retained, so riders that join later get the plan at once)
     - SetFTP
-    - StartPlan
+    - StartPlan (the plan's start time and version, retained, so riders and bridges run it
+      locally, including those that join mid-plan)
+    - SetSegment (target power and cadence of a plan segment, in one message: an override, or
+      every segment with broadcast_segments)
     - SetTargetPower
     - SetTargetCadence
     - StopPlan
@@ -16,8 +19,14 @@ It generates the following messages:
 It also handles the following incoming messages:
     - DeviceList
     - GetPlan
+    - GetMetrics (rolling power metrics, answered with SendMetrics)
     - MeasuredPower
     - MeasuredCadence
+    - MeasuredTelemetry (batched power/cadence frame from a WirelessBridge)
+    - TimeRequest (clock sync; the coach's wall clock is the reference, see timesync.py)
+
+Measured telemetry is kept in a TelemetryStore (see telemetry.py), which answers rolling
+averages, max power and time in the target zone per trainer.
 
 The training plan consists of a list of tuples, where each tuple has four elements:
     (start_time_offset, target_power, target_cadence, description)
@@ -34,7 +43,6 @@ Example:
 """
 
 import time
-import json
 import logging
 import threading
 
@@ -45,14 +53,26 @@ from .messaging import (
     ListDevices,
     PairDevice,
     SendPlan,
+    PlanVersion,
     SetFTP,
     StartPlan,
+    SetSegment,
     SetTargetPower,
     SetTargetCadence,
     StopPlan,
     DeviceList,
     GetPlan,
+    SendMetrics,
+    subscribe_callbacks,
+    unsubscribe_callbacks,
 )
+from .clock import SYSTEM_CLOCK, now, wall
+from .codec import decode_payload
+from .telemetry import TelemetryStore
+from .plan import CompiledPlan, compile_plan, plan_version
+from .timesync import TimeServer
+from .tracing import TraceRecorder
+from . import logs
 from .constants import APP_ID, hostname
 
 # Configure logging.
@@ -61,33 +81,74 @@ logger = logging.getLogger("Coach")
 
 
 class Coach:
-    def __init__(self, mqtt_client, training_plan=None):
+    def __init__(self, mqtt_client, training_plan=None, clock=None, session=None, scheduler=None,
+                 subscribe_shared=True, trace=False, plan_coalesce=1.0, broadcast_segments=False):
         """
         Initializes the Coach.
 
         Parameters:
             mqtt_client (mqtt.Client): An instance of the MQTT client to use.
             training_plan (list of tuples, optional): A training plan consisting of a list
-                of tuples with the format (start_time_offset, target_power, target_cadence, description).
-                If not provided, a default training plan is used.
+                of tuples with the format (start_time_offset, target_power, target_cadence, description),
+                or a plan.CompiledPlan. If not provided, a default training plan is used.
+                The plan is validated (see plan.compile_plan), which raises plan.PlanError.
+            clock (clock.SystemClock, optional): The clock the plan is scheduled against.
+                Tests and simulations can pass a virtual clock.
+            session (str, optional): Run as one of several concurrent classes: plan topics
+                (send_plan, start_plan, set_target_*, stop_plan, get_plan) live under
+                APP_ID/session/<session>/. Device and telemetry topics stay shared.
+            scheduler (scheduler.Scheduler, optional): Shared timer scheduler that fires the
+                plan segments. If None, start_plan() runs the plan in its own thread.
+            subscribe_shared (bool, optional): If False, the shared device and telemetry topics
+                are not subscribed to; a SessionManager routes them to its sessions instead.
+            trace (bool, optional): If True, every set_segment and set_target_power sent carries a trace context, and
+                the latency of each hop until the telemetry reflecting it comes back is recorded
+                in self.traces (see tracing.py).
+            plan_coalesce (float, optional): GetPlan requests arriving within this many seconds
+                of the last plan broadcast are answered by that broadcast, which is retained,
+                instead of broadcasting again.
+            broadcast_segments (bool, optional): If True, every segment change is also broadcast
+                as set_segment, for clients that do not run the plan. By default riders and bridges
+                run the plan locally from start_plan's start time (see plan_runner.py), and the
+                coach only sends start_plan, stop_plan and overrides (set_segment, set_target_power).
         """
         self.client = mqtt_client
+        self.session = session
+        self.scheduler = scheduler
+        self.subscribe_shared = subscribe_shared
+        if clock is None:
+            clock = SYSTEM_CLOCK if scheduler is None else scheduler.clock
+        self.clock = clock
         self.logger = logging.getLogger(self.__class__.__name__)
 
         # Create messaging objects for outgoing commands.
         self.list_devices_msg = ListDevices(self.client)
         self.pair_device_msg = PairDevice(self.client)
-        self.send_plan_msg = SendPlan(self.client)
+        self.send_plan_msg = SendPlan(self.client, session=session, retain=True)
+        self.plan_version_msg = PlanVersion(self.client, session=session, retain=True)
         self.set_ftp_msg = SetFTP(self.client)
-        self.start_plan_msg = StartPlan(self.client)
+        self.start_plan_msg = StartPlan(self.client, session=session, retain=True)
         # New broadcast-style SetTargetPower message (only requires target_power).
-        self.set_target_power_msg = SetTargetPower(self.client)
-        self.set_target_cadence_msg = SetTargetCadence(self.client)
-        self.stop_plan_msg = StopPlan(self.client)
+        self.set_target_power_msg = SetTargetPower(self.client, session=session)
+        self.set_target_cadence_msg = SetTargetCadence(self.client, session=session)
+        self.set_segment_msg = SetSegment(self.client, session=session)
+        self.stop_plan_msg = StopPlan(self.client, session=session)
+        self.send_metrics_msg = SendMetrics(self.client, session=session)
+
+        # Per-trainer time series of the measured telemetry.
+        self.telemetry = TelemetryStore()
+
+        # Per-hop latency histograms of traced target power changes.
+        self.trace = trace
+        self.traces = TraceRecorder()
 
         # Register callbacks for incoming messages.
         self._register_response_callbacks()
 
+        # The coach's wall clock is the reference the other agents sync to (see timesync.py).
+        # A SessionManager answers for its sessions, whose coaches skip the shared topics.
+        self.time_server = TimeServer(self.client) if subscribe_shared else None
+
         # Maintain pairings: key: uuid_trainer, value: uuid_rider.
         self.pairings = {}
 
@@ -104,42 +165,79 @@ class Coach:
                 (60 * 10, 50, 85, "Cooldown"),
                 (60 * 12, 0, 85, "stop"),  # End of session.
             ]
+        elif isinstance(training_plan, CompiledPlan):
+            self.training_plan = training_plan.to_list()
         else:
             self.training_plan = training_plan
+        self.plan = compile_plan(self.training_plan)
+
+        # Plan distribution: the encoded send_plan payload of the last plan sent, by version,
+        # and when it was broadcast, on self.clock.
+        self.plan_coalesce = plan_coalesce
+        self.broadcast_segments = broadcast_segments
+        self._plan_cache = None  # (version, payload)
+        self._plan_sent_at = None
 
         self.plan_thread = None
         self._plan_running = False
+        # Plan timing, on the monotonic clock. Stop, pause and resume notify _plan_wakeup
+        # so a waiting plan reacts at once rather than at its next deadline.
+        self._plan_wakeup = threading.Condition()
+        self._plan_start = None
+        self._paused_at = None
+        # Scheduler mode: index of the next segment and the timer that will fire it.
+        self._next_segment = 0
+        self._plan_timer = None
+
+        # Publish the plan, retained, for the riders already listening and those joining later.
+        self.send_training_plan()
 
     def _register_response_callbacks(self):
         """
         Registers MQTT callbacks for incoming messages:
             - DeviceList: response for the ListDevices command.
             - GetPlan: a request for a training plan.
+            - GetMetrics: a request for the trainers' rolling metrics.
             - MeasuredPower: messages reporting measured power from trainers.
+            - MeasuredCadence: messages reporting measured cadence from trainers.
+            - MeasuredTelemetry: batched power/cadence frames from bridges.
+        Only these topics are subscribed to. GetPlan and GetMetrics are scoped to the coach's session;
+        the others are shared and skipped when subscribe_shared is False.
         """
-        subscribe_topic = f"{APP_ID}/#"
-        result, mid = self.client.subscribe(subscribe_topic)
-        if result != mqtt.MQTT_ERR_SUCCESS:
-            logger.error(f"Failed to subscribe to topic {subscribe_topic}: {mqtt.error_string(result)}")
-        else:
-            logger.info(f"Subscribed to topic {subscribe_topic}")
-        
-
-        topic_device_list = f"{APP_ID}/device_list"
-        self.client.message_callback_add(topic_device_list, self._handle_device_list)
-
-        topic_get_plan = f"{APP_ID}/get_plan"
-        self.client.message_callback_add(topic_get_plan, self._handle_get_plan)
-
-        topic_measured_power = f"{APP_ID}/set_measured_power"
-        topic_measured_cadence = f"{APP_ID}/set_measured_cadence"
-        self.client.message_callback_add(topic_measured_power, self._handle_measured_power)
-        self.client.message_callback_add(topic_measured_cadence, self._handle_measured_cadence)
+        self.callbacks = {
+            "device_list": self._handle_device_list,
+            "set_measured_power": self._handle_measured_power,
+            "set_measured_cadence": self._handle_measured_cadence,
+            "set_measured_telemetry": self._handle_measured_telemetry,
+        }
+        self.session_callbacks = {
+            "get_plan": self._handle_get_plan,
+            "get_metrics": self._handle_get_metrics,
+        }
+        if self.subscribe_shared:
+            subscribe_callbacks(self.client, self.callbacks, self.logger)
+        subscribe_callbacks(self.client, self.session_callbacks, self.logger, session=self.session)
         self.client.loop_start()
         self.logger.info(
-            "Coach registered response callbacks for device_list, get_plan, measured_power and measured_cadence."
+            f"Coach registered response callbacks for {', '.join(list(self.callbacks) + list(self.session_callbacks))}."
         )
-        
+
+    def close(self):
+        """Stops any running plan and removes the coach's subscriptions, e.g. when a session ends."""
+        with self._plan_wakeup:
+            running = self._plan_running
+        if running:
+            self.stop_plan()
+        if self.subscribe_shared:
+            unsubscribe_callbacks(self.client, self.callbacks, self.logger)
+        if self.time_server is not None:
+            self.time_server.close()
+        unsubscribe_callbacks(self.client, self.session_callbacks, self.logger, session=self.session)
+        # Withdraw the retained plan: an empty retained payload clears it on the broker.
+        self.send_plan_msg.publish_payload(b"")
+        self.plan_version_msg.publish_payload(b"")
+        self.start_plan_msg.publish_payload(b"")
+
     # ----- Methods to generate outgoing messages -----
     def request_device_list(self):
         """Generates a ListDevices message to request the list of devices."""
@@ -155,14 +253,42 @@ class Coach:
         self.pair_device_msg.publish(uuid_trainer=uuid_trainer, uuid_rider=uuid_rider)
         self.pairings[uuid_trainer] = uuid_rider
         
-    def send_training_plan(self, training_plan):
+    def send_training_plan(self, training_plan=None):
         """
-        Generates a SendPlan message with the provided training plan.
-        The training_plan should be a list of tuples:
+        Generates retained SendPlan and PlanVersion messages with the provided training plan,
+        or the coach's own plan. The training_plan should be a list of tuples:
             (start_time_offset, target_power, target_cadence, description)
+        The plan is serialized once per version; sending it again reuses the encoded payload.
+        """
+        if training_plan is None:
+            training_plan = self.training_plan
+        version = plan_version(training_plan)
+        cache = self._plan_cache
+        if cache is None or cache[0] != version:
+            payload = self.send_plan_msg.encode(training_plan=list(training_plan), version=version)
+            cache = self._plan_cache = (version, payload)
+        self.logger.info(f"Coach: Sending training plan version {version}.")
+        self.send_plan_msg.publish_payload(cache[1])
+        self.plan_version_msg.publish(version=version)
+        self._plan_sent_at = self.clock.monotonic()
+
+    def set_training_plan(self, training_plan):
         """
-        self.logger.info("Coach: Sending training plan.")
-        self.send_plan_msg.publish(training_plan=training_plan)
+        Replaces the coach's training plan, e.g. with one from a library.PlanLibrary, and sends it
+        to the riders. Ignored while a plan is running.
+
+        Parameters:
+            training_plan (list of tuples or plan.CompiledPlan): The new plan.
+        """
+        with self._plan_wakeup:
+            if self._plan_running:
+                self.logger.warning("Coach: Cannot change the training plan while it is running.")
+                return
+            plan = compile_plan(training_plan)
+            self.plan = plan
+            self.training_plan = plan.to_list()
+        self.logger.info(f"Coach: Training plan set to {plan.name or 'an unnamed plan'}.")
+        self.send_training_plan()
 
     def set_ftp(self, uuid_trainer, ftp):
         """Generates a SetFTP message for a given trainer."""
@@ -175,57 +301,206 @@ class Coach:
         for all paired devices (broadcast).
         """
         self.logger.info("Coach: Starting training plan.")
-        self.start_plan_msg.publish()
 
         if not self.pairings:
             self.logger.warning("No paired devices found. Training plan will be broadcast to all devices.")
 
-        self._plan_running = True
+        if self.scheduler is not None:
+            self._schedule_plan()
+            return
+
+        with self._plan_wakeup:
+            self._plan_running = True
+            self._paused_at = None
         if self.plan_thread is None or not self.plan_thread.is_alive():
             self.plan_thread = threading.Thread(target=self.run_training_plan, daemon=True)
             self.plan_thread.start()
+            self.clock.started(self.plan_thread)
 
     def run_training_plan(self):
         """
         Executes the training plan (broadcast to all paired devices).
-        For each segment in the plan, sends a SetTargetPower message at the correct time offset.
-        The loop checks periodically if a stop has been requested.
-        After the plan is complete, sends a StopPlan message.
+        Each segment fires at plan start + its offset on the monotonic clock, so time spent
+        publishing and logging does not accumulate into drift. Stop, pause and resume
+        wake the wait immediately. After the plan is complete, sends a StopPlan message.
         """
         self.logger.info("Coach: Executing training plan (broadcast to all paired devices).")
-        previous_offset = 0
+        with self._plan_wakeup:
+            self._plan_running = True
+            self._plan_start = self.clock.monotonic()
+        self._announce_start()
 
-        for segment in self.training_plan:
-            if not self._plan_running:
+        for index, segment in enumerate(self.training_plan):
+            offset, target_power, target_cadence, description = segment
+            if not self._wait_for_offset(offset):
                 self.logger.info("Coach: Training plan interrupted.")
                 return
 
-            offset, target_power, target_cadence, description = segment
-            delay = offset - previous_offset
-            if delay > 0:
-                slept = 0
-                while slept < delay and self._plan_running:
-                    time.sleep(1)
-                    slept += 1
-                if not self._plan_running:
-                    self.logger.info("Coach: Training plan interrupted during delay.")
-                    return
+            self.logger.debug(f"Coach: Segment '{description}' fired {self.plan_elapsed() - offset:.3f}s late.")
+            self._enter_segment(index)
 
-            self.logger.info(f"Coach: Segment '{description}': Broadcasting target power {target_power}%.")
-            self.set_target_power(target_power)
-            self.set_target_cadence(target_cadence)
-            previous_offset = offset
+        self.logger.info("Coach: Training plan complete. Sending stop plan command.")
+        self.stop_plan()
 
+    def _schedule_plan(self):
+        """Starts the plan on the shared scheduler: each fired segment schedules the next one."""
+        with self._plan_wakeup:
+            if self._plan_timer is not None:
+                self._plan_timer.cancel()
+                self._plan_timer = None
+            self._plan_running = True
+            self._paused_at = None
+            self._plan_start = self.clock.monotonic()
+            self._next_segment = 0
+        self._announce_start()
+        with self._plan_wakeup:
+            self._schedule_next_segment()
+
+    def _announce_start(self):
+        """
+        Publishes start_plan: the wall clock time of the plan's offset 0, shifted by any pauses,
+        and the plan's version, so riders holding the plan run it locally. While paused, the
+        running time at the pause is sent too.
+        """
+        stamp = now()
+        with self._plan_wakeup:
+            # The plan is timed on self.clock; start_time maps its start to the wall clock.
+            fields = {"start_time": self.clock.wall() - (self.clock.monotonic() - self._plan_start)}
+            if self._paused_at is not None:
+                fields["elapsed"] = self._paused_at - self._plan_start
+        if self._plan_cache is not None:
+            fields["version"] = self._plan_cache[0]
+        self.start_plan_msg.publish(stamp=stamp, **fields)
+
+    def _schedule_next_segment(self):
+        """Schedules the next segment at plan start + offset. Must be called with _plan_wakeup held."""
+        self._plan_timer = None
+        if self._next_segment < len(self.training_plan):
+            offset = self.training_plan[self._next_segment][0]
+            self._plan_timer = self.scheduler.call_at(
+                self._plan_start + offset, self._fire_segment, self._next_segment)
+
+    def _fire_segment(self, index):
+        """Scheduler callback: broadcasts one segment and schedules the following one."""
+        with self._plan_wakeup:
+            if not self._plan_running or self._paused_at is not None or index != self._next_segment:
+                return
+            self._next_segment = index + 1
+        self._enter_segment(index)
+        with self._plan_wakeup:
+            if not self._plan_running:
+                return
+            if self._next_segment < len(self.training_plan):
+                if self._paused_at is None:
+                    self._schedule_next_segment()
+                return
         self.logger.info("Coach: Training plan complete. Sending stop plan command.")
         self.stop_plan()
 
+    def _enter_segment(self, index):
+        """Moves the plan to a segment: broadcasts it, or only updates the target if riders run the plan."""
+        offset, target_power, target_cadence, description = self.training_plan[index]
+        if self.broadcast_segments:
+            self.logger.info(f"Coach: Segment '{description}': Broadcasting target power {target_power}%.")
+            self.set_segment(index, target_power, target_cadence)
+        else:
+            self.logger.info(f"Coach: Segment '{description}': target power {target_power}%.")
+            self.telemetry.set_target(target_power)
+
+    def _wait_for_offset(self, offset):
+        """
+        Blocks until the plan reaches the given offset (seconds of running time since start).
+        Returns False if the plan was stopped first.
+        """
+        with self._plan_wakeup:
+            while self._plan_running:
+                if self._paused_at is None:
+                    remaining = self._plan_start + offset - self.clock.monotonic()
+                    if remaining <= 0:
+                        return True
+                else:
+                    remaining = None
+                self.clock.wait(self._plan_wakeup, remaining)
+            return False
+
+    def plan_elapsed(self):
+        """Returns the running time of the current plan in seconds, excluding pauses."""
+        with self._plan_wakeup:
+            if self._plan_start is None:
+                return 0.0
+            now = self._paused_at if self._paused_at is not None else self.clock.monotonic()
+            return now - self._plan_start
+
+    def plan_start_time(self):
+        """
+        Returns the wall clock time (epoch seconds) of the plan's offset 0, shifted by any pauses,
+        as in start_plan, or None if no plan was started. Telemetry sample times are on this clock,
+        so it is the start analytics.series_from_store() takes.
+        """
+        with self._plan_wakeup:
+            if self._plan_start is None:
+                return None
+            return self.clock.wall() - (self.clock.monotonic() - self._plan_start)
+
+    def current_targets(self):
+        """Returns (target_power, target_cadence) at the plan's current running time."""
+        return self.plan.targets_at(self.plan_elapsed())
+
+    def pause_plan(self):
+        """
+        Pauses the running training plan; the next segment is held until resume_plan().
+        start_plan is sent again with the running time at the pause, so riders pause too.
+        """
+        with self._plan_wakeup:
+            if self._plan_running and self._paused_at is None:
+                self._paused_at = self.clock.monotonic()
+                if self._plan_timer is not None:
+                    self._plan_timer.cancel()
+                    self._plan_timer = None
+                self._plan_wakeup.notify_all()
+                self.clock.notified(self._plan_wakeup)
+                self.logger.info("Coach: Training plan paused.")
+            else:
+                return
+        self._announce_start()
+
+    def resume_plan(self):
+        """
+        Resumes a paused training plan, shifting the remaining segments by the pause length.
+        start_plan is sent again with the shifted start time.
+        """
+        with self._plan_wakeup:
+            if self._paused_at is not None:
+                self._plan_start += self.clock.monotonic() - self._paused_at
+                self._paused_at = None
+                if self.scheduler is not None:
+                    self._schedule_next_segment()
+                self._plan_wakeup.notify_all()
+                self.clock.notified(self._plan_wakeup)
+                self.logger.info("Coach: Training plan resumed.")
+            else:
+                return
+        self._announce_start()
+
+    def set_segment(self, index, target_power_percent, target_cadence):
+        """
+        Generates a SetSegment message (broadcast to all paired devices): the plan segment's
+        index, target power as a percentage of FTP and target cadence, in one message.
+        """
+        self.telemetry.set_target(target_power_percent)
+        trace = self.traces.start("coach.publish") if self.trace else None
+        self.set_segment_msg.publish(trace=trace, segment=index, target_power=target_power_percent,
+                                     target_cadence=target_cadence)
+
     def set_target_power(self, target_power_percent):
         """
         Generates a SetTargetPower message (broadcast to all paired devices).
         target_power_percent is interpreted as a percentage.
         """
         self.logger.info(f"Coach: Broadcasting target power: {target_power_percent}%.")
-        self.set_target_power_msg.publish(target_power=target_power_percent)
+        self.telemetry.set_target(target_power_percent)
+        trace = self.traces.start("coach.publish") if self.trace else None
+        self.set_target_power_msg.publish(trace=trace, target_power=target_power_percent)
 
     def set_target_cadence(self, target_cadence):
         """
@@ -242,8 +517,19 @@ class Coach:
         """
         self.logger.info("Coach: Stopping training plan.")
         self.stop_plan_msg.publish()
-        self._plan_running = False
-        if self.plan_thread and self.plan_thread.is_alive():
+        # Clear the retained start_plan, so a client joining later does not run the plan.
+        self.start_plan_msg.publish_payload(b"")
+        with self._plan_wakeup:
+            self._plan_running = False
+            self._paused_at = None
+            self.telemetry.set_target(None)
+            if self._plan_timer is not None:
+                self._plan_timer.cancel()
+                self._plan_timer = None
+            self._plan_wakeup.notify_all()
+            self.clock.notified(self._plan_wakeup)
+        if (self.plan_thread and self.plan_thread.is_alive()
+                and self.plan_thread is not threading.current_thread()):
             self.plan_thread.join(timeout=1)
             self.logger.info("Coach: Training plan thread has been stopped.")
 
@@ -251,7 +537,7 @@ class Coach:
     def _handle_device_list(self, client, userdata, msg):
         """Handles a DeviceList response message."""
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
             devices = payload.get("device_list", [])
             self.logger.info(f"Coach received device list: {devices}")
         except Exception as e:
@@ -260,35 +546,133 @@ class Coach:
     def _handle_get_plan(self, client, userdata, msg):
         """
         Handles a GetPlan request.
-        When a trainer requests a training plan, the coach responds by sending the training plan.
+        When a trainer requests a training plan, the coach responds by sending the training plan,
+        unless the requester already holds its version or the plan was broadcast just now.
         """
         self.logger.info("Coach received a GetPlan request.")
-        self.send_training_plan(self.training_plan)
+        try:
+            held = decode_payload(msg.payload).get("version") if msg.payload else None
+        except Exception as e:
+            self.logger.error(f"Error processing GetPlan request: {e}")
+            held = None
+        if held is not None and self._plan_cache is not None and held == self._plan_cache[0]:
+            self.logger.debug("Coach: The rider already holds the current plan.")
+            return
+        sent_at = self._plan_sent_at
+        if sent_at is not None and self.clock.monotonic() - sent_at < self.plan_coalesce:
+            # A rider joining in a storm: the plan it asks for was just broadcast, and retained.
+            self.logger.debug("Coach: GetPlan coalesced with the last plan broadcast.")
+            return
+        self.send_training_plan()
 
     def _handle_measured_power(self, client, userdata, msg):
         """
         Handles a MeasuredPower message (e.g., from a trainer).
-        Logs the measured power for a given trainer.
+        Records the measured power for a given trainer.
         """
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
+            trace = self.traces.receive(payload, "coach.receive")
             uuid_trainer = payload.get("uuid_trainer")
             measured_power = payload.get("measured_power")
-            self.logger.info(f"Coach received measured power from trainer {uuid_trainer}: {measured_power} watts")
+            self.telemetry.add_power(uuid_trainer, self._sample_time(payload), measured_power,
+                                     payload.get("percent_ftp"))
+            logs.hot(self.logger, msg.topic, "Coach received measured power from trainer %s: %s watts",
+                     uuid_trainer, measured_power)
+            self.traces.finish(trace, "coach.handled")
         except Exception as e:
             self.logger.error(f"Error processing measured power message: {e}")
 
     def _handle_measured_cadence(self, client, userdata, msg):
         """
-        Handles a MeasuredPower message (e.g., from a trainer).
-        Logs the measured power for a given trainer.
+        Handles a MeasuredCadence message (e.g., from a trainer).
+        Records the measured cadence for a given trainer.
         """
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
             uuid_trainer = payload.get("uuid_trainer")
             measured_cadence = payload.get("measured_cadence")
-            self.logger.info(f"Coach received measured power from trainer {uuid_trainer}: {measured_cadence} RPM")
+            self.telemetry.add_cadence(uuid_trainer, measured_cadence)
+            logs.hot(self.logger, msg.topic, "Coach received measured cadence from trainer %s: %s RPM",
+                     uuid_trainer, measured_cadence)
         except Exception as e:
             self.logger.error(f"Error processing measured cadence message: {e}")
 
+    def _handle_measured_telemetry(self, client, userdata, msg):
+        """
+        Handles a batched MeasuredTelemetry frame from a WirelessBridge.
+        The frame carries parallel lists of trainer ids, power, cadence and percent FTP.
+        """
+        try:
+            self.record_telemetry_frame(decode_payload(msg.payload), msg.topic)
+        except Exception as e:
+            self.logger.error(f"Error processing measured telemetry message: {e}")
+
+    def record_telemetry_frame(self, payload, topic):
+        """
+        Records a decoded MeasuredTelemetry frame. A SessionManager passes each session the
+        part of a frame that covers the trainers paired in it.
+
+        Parameters:
+            payload (dict): The decoded frame.
+            topic (str): The topic it arrived on, for logging.
+        """
+        trace = self.traces.receive(payload, "coach.receive")
+        frame = zip(
+            payload.get("uuid_trainer", []),
+            payload.get("measured_power", []),
+            payload.get("measured_cadence", []),
+            payload.get("percent_ftp", []),
+        )
+        t = self._sample_time(payload)
+        count = 0
+        for uuid_trainer, measured_power, measured_cadence, percent_ftp in frame:
+            count += 1
+            self.telemetry.add_power(uuid_trainer, t, measured_power, percent_ftp, measured_cadence)
+            self.logger.debug("Coach received telemetry from trainer %s: %s watts (%s%% FTP), %s RPM",
+                              uuid_trainer, measured_power, percent_ftp, measured_cadence)
+        logs.hot(self.logger, topic, "Coach received telemetry frame for %d trainers", count)
+        self.traces.finish(trace, "coach.handled")
+
+    def _handle_get_metrics(self, client, userdata, msg):
+        """
+        Handles a GetMetrics request.
+        Replies with the summary of the requested trainer, or of every trainer if none is given.
+        """
+        try:
+            payload = decode_payload(msg.payload)
+            self.send_metrics_msg.publish(metrics=self.trainer_metrics(payload.get("uuid_trainer")))
+        except Exception as e:
+            self.logger.error(f"Error processing get metrics request: {e}")
+
+    def _sample_time(self, payload):
+        """
+        Returns a telemetry sample's time on the corrected wall clock (see clock.wall()): the
+        sender's time stamp, else the time it was received. Senders' monotonic clocks do not
+        share an origin, so trainers reported by different bridges could not be aligned on them.
+        """
+        stamp = payload.get("time")
+        return wall() if stamp is None else stamp
+
+    # ----- Telemetry queries -----
+    def trainer_metrics(self, uuid_trainer=None):
+        """
+        Returns rolling metrics from the telemetry store.
+
+        Parameters:
+            uuid_trainer (str, optional): The trainer to report; all trainers if None.
+
+        Returns:
+            dict: key: uuid_trainer, value: TelemetryStore.summary() of that trainer.
+        """
+        if uuid_trainer is None:
+            return self.telemetry.summaries()
+        return {uuid_trainer: self.telemetry.summary(uuid_trainer)}
+
+    def trace_latencies(self):
+        """Returns the per-hop latency histograms of traced target power changes (see tracing.py)."""
+        return self.traces.export()
 
+    def average_power(self, uuid_trainer, window=30):
+        """Returns a trainer's mean power over the last window seconds, or None."""
+        return self.telemetry.average(uuid_trainer, window)
@@ -0,0 +1,222 @@
+'''
+Begin codec.py
+
+Payload codecs for the MQTT messaging layer.
+
+Every payload is either a plain JSON document (the original wire format, which
+always begins with '{') or a fixed-layout binary frame whose first byte is a
+format byte.  Binary frames are laid out as:
+
+    format byte (FORMAT_STRUCT_V1) | layout id (uint8) | fields in layout order
+
+Numeric fields are packed little-endian with the struct module, strings are
+utf-8 with a uint8 length prefix and list fields carry a uint16 item count
+(lists of strings are a single NUL separated block).
+decode_payload() looks at the first byte, so a handler can read any topic
+without knowing which codec its publisher picked.  JSON stays the default;
+binary codecs are opt-in per message type for high-rate telemetry topics,
+so dashboards that only understand JSON keep working on every other topic.
+'''
+import json
+import struct
+
+from . import metrics
+
+FORMAT_STRUCT_V1 = 0x01
+
+_HEADER = struct.Struct('<BB')
+_STR_LEN = struct.Struct('<B')
+_LIST_LEN = struct.Struct('<H')
+
+# Registry of binary layouts, keyed by layout id.
+_layouts = {}
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be encoded or decoded."""
+
+
+class JSONCodec:
+    """The original wire format: a JSON object encoded as utf-8 text."""
+    name = 'json'
+
+    def encode(self, kw):
+        return json.dumps(kw)
+
+    def decode(self, payload):
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode()
+        return json.loads(payload)
+
+
+def _encode_str(value):
+    data = str(value).encode()
+    if len(data) > 255:
+        raise CodecError(f"String field too long for binary layout: {len(data)} bytes")
+    return _STR_LEN.pack(len(data)) + data
+
+
+def _decode_str(buf, pos):
+    (length,) = _STR_LEN.unpack_from(buf, pos)
+    pos += _STR_LEN.size
+    return str(buf[pos:pos + length], 'utf-8'), pos + length
+
+
+def _encode_str_list(values):
+    # A list of strings is sent as one NUL separated block behind a uint16 byte count.
+    data = '\x00'.join(map(str, values)).encode()
+    return _LIST_LEN.pack(len(values)) + _LIST_LEN.pack(len(data)) + data
+
+
+def _decode_str_list(buf, pos):
+    count, length = struct.unpack_from('<HH', buf, pos)
+    pos += 2 * _LIST_LEN.size
+    items = str(buf[pos:pos + length], 'utf-8').split('\x00') if count else []
+    return items, pos + length
+
+
+def _scalar_list_codec(kind):
+    size = struct.calcsize('<' + kind)
+
+    def encode(values):
+        return _LIST_LEN.pack(len(values)) + struct.pack(f'<{len(values)}{kind}', *values)
+
+    def decode(buf, pos):
+        (count,) = _LIST_LEN.unpack_from(buf, pos)
+        pos += _LIST_LEN.size
+        return list(struct.unpack_from(f'<{count}{kind}', buf, pos)), pos + count * size
+    return encode, decode
+
+
+class StructCodec:
+    """
+    Fixed-layout binary codec.
+
+    Parameters:
+        layout_id (int): Identifier written after the format byte; must be unique per layout.
+        fields (tuple): (name, kind) pairs in wire order.  kind is a struct format
+                        character for a scalar ('h', 'H', 'i', 'd', ...), 's' for a string,
+                        or a scalar kind or 's' prefixed with '[' for a list of that kind.
+
+    Consecutive scalar fields are merged into a single struct.Struct when the layout
+    is built, so encoding and decoding cost one pack/unpack call per run of scalars.
+    """
+    name = 'struct'
+
+    def __init__(self, layout_id, fields):
+        self.layout_id = layout_id
+        self.fields = tuple(fields)
+        self.header = _HEADER.pack(FORMAT_STRUCT_V1, layout_id)
+        self._steps = self._compile(self.fields)
+        if _layouts.get(layout_id, self).fields != self.fields:
+            raise CodecError(f"Layout id {layout_id} is already registered with different fields")
+        _layouts[layout_id] = self
+
+    @staticmethod
+    def _compile(fields):
+        """Returns a list of (names, encode, decode) steps, one per scalar run or variable field."""
+        steps = []
+        run = []
+
+        def flush():
+            if run:
+                packer = struct.Struct('<' + ''.join(kind for _, kind in run))
+                names = tuple(name for name, _ in run)
+
+                def decode(buf, pos, packer=packer):
+                    return packer.unpack_from(buf, pos), pos + packer.size
+                steps.append((names, packer.pack, decode))
+                run.clear()
+
+        for name, kind in fields:
+            if kind == 's' or kind.startswith('['):
+                flush()
+                if kind == 's':
+                    encode, decode = _encode_str, _decode_str
+                elif kind == '[s':
+                    encode, decode = _encode_str_list, _decode_str_list
+                else:
+                    encode, decode = _scalar_list_codec(kind[1:])
+                steps.append((name, encode, decode))
+            else:
+                run.append((name, kind))
+        flush()
+        return steps
+
+    def encode(self, kw):
+        parts = [self.header]
+        try:
+            for names, encode, _ in self._steps:
+                if isinstance(names, tuple):
+                    parts.append(encode(*[kw[name] for name in names]))
+                else:
+                    parts.append(encode(kw[names]))
+        except KeyError as e:
+            raise CodecError(f"Missing field for binary layout {self.layout_id}: {e}") from None
+        except struct.error as e:
+            raise CodecError(f"Cannot pack field for binary layout {self.layout_id}: {e}") from None
+        return b''.join(parts)
+
+    def decode(self, payload):
+        buf = memoryview(payload)
+        pos = _HEADER.size
+        result = {}
+        try:
+            for names, _, decode in self._steps:
+                value, pos = decode(buf, pos)
+                if isinstance(names, tuple):
+                    result.update(zip(names, value))
+                else:
+                    result[names] = value
+        except struct.error as e:
+            raise CodecError(f"Truncated payload for binary layout {self.layout_id}: {e}") from None
+        return result
+
+
+JSON_CODEC = JSONCodec()
+
+# Binary layouts for the high-rate telemetry topics.
+MEASURED_POWER_STRUCT = StructCodec(1, (
+    ('uuid_trainer', 's'),
+    ('measured_power', 'h'),
+    ('percent_ftp', 'H'),
+    ('time', 'd'),
+    ('mono', 'd'),
+))
+MEASURED_CADENCE_STRUCT = StructCodec(2, (
+    ('uuid_trainer', 's'),
+    ('measured_cadence', 'H'),
+    ('time', 'd'),
+    ('mono', 'd'),
+))
+MEASURED_TELEMETRY_STRUCT = StructCodec(3, (
+    ('uuid_trainer', '[s'),
+    ('measured_power', '[h'),
+    ('measured_cadence', '[H'),
+    ('percent_ftp', '[H'),
+    ('time', 'd'),
+    ('mono', 'd'),
+))
+
+
+def decode_payload(payload):
+    """
+    Decodes a received payload into a dict, whichever codec produced it.
+
+    Parameters:
+        payload (bytes or str): The raw MQTT payload.
+
+    Returns:
+        dict: The decoded message fields.
+    """
+    try:
+        if payload and isinstance(payload, (bytes, bytearray)) and payload[0] == FORMAT_STRUCT_V1:
+            layout = _layouts.get(payload[1]) if len(payload) > 1 else None
+            if layout is None:
+                raise CodecError(f"Unknown binary layout in payload: {bytes(payload[:2])!r}")
+            return layout.decode(payload)
+        return JSON_CODEC.decode(payload)
+    except Exception:
+        if metrics.REGISTRY.enabled:
+            metrics.REGISTRY.inc("mqtt_decode_errors_total")
+        raise
@@ -1,4 +1,4 @@
-import numpy as np
+import math
 
 hostname = 'mqtt.eclipseprojects.io'
 device_uuid = 'uuid_12203815-12321415193'
@@ -6,4 +6,4 @@ device_uuid = 'uuid_12203815-12321415193'
 client_id = '123456789'
 APP_ID = 'UniqueAppID_for_training_sessions'
 
-DEG = np.pi / 180
+DEG = math.pi / 180
@@ -0,0 +1,154 @@
+'''
+Begin devices.py
+
+Trainer backends for the WirelessBridge.
+
+A backend hides how the bridge talks to the trainers.  Smart trainers push
+Cycling Power / FTMS notifications at their own rate, so a backend that
+supports notifications calls back with a Reading whenever a trainer reports;
+the bridge keeps them in a per-trainer ring buffer instead of blocking on
+reads.  Backends that can only be polled implement read() alone.
+
+SimulatedBackend produces plausible readings at a fixed notification rate, so
+the bridge runs on a machine with no Bluetooth/ANT+ hardware.
+'''
+import logging
+import random
+from collections import namedtuple
+
+from .clock import SYSTEM_CLOCK
+from .scheduler import Scheduler
+
+logger = logging.getLogger("Devices")
+
+# One trainer report; mono is the backend clock's monotonic time of the report.
+Reading = namedtuple('Reading', ['mono', 'power', 'cadence'])
+
+
+class TrainerBackend:
+    """
+    Interface of a trainer backend.
+
+    A backend with supports_notifications = True calls callback(trainer_id, reading)
+    for every notification of a subscribed trainer, between start() and stop(), on
+    whatever thread its transport delivers on.
+    """
+    supports_notifications = False
+    clock = SYSTEM_CLOCK
+
+    def discover(self):
+        """Returns the list of trainer UUIDs reachable through this backend."""
+        raise NotImplementedError
+
+    def read(self, trainer_id):
+        """Reads a trainer, blocking until it answers. Returns a Reading."""
+        raise NotImplementedError
+
+    def subscribe(self, trainer_id, callback):
+        """Requests notifications from a trainer."""
+        raise NotImplementedError
+
+    def unsubscribe(self, trainer_id):
+        """Stops notifications from a trainer."""
+        raise NotImplementedError
+
+    def set_target_power(self, trainer_id, watts):
+        """Puts a trainer in ERG mode at the given power."""
+
+    def start(self):
+        """Starts delivering notifications."""
+
+    def stop(self):
+        """Stops delivering notifications."""
+
+
+class SimulatedBackend(TrainerBackend):
+    supports_notifications = True
+
+    def __init__(self, trainer_ids=None, rate=4.0, seed=None, scheduler=None, clock=None):
+        """
+        Initializes the SimulatedBackend.
+
+        Parameters:
+            trainer_ids (list, optional): The simulated trainers' UUIDs.
+            rate (float, optional): Notifications per second of each trainer.
+            seed (int, optional): Seed of the random readings, for reproducible runs.
+            scheduler (scheduler.Scheduler, optional): Scheduler the notifications are fired on;
+                                          e.g. an aio.AsyncScheduler to deliver them on the
+                                          event loop. By default the backend runs its own.
+            clock (clock.SystemClock, optional): Clock of the backend's own scheduler.
+        """
+        if trainer_ids is None:
+            trainer_ids = ["trainer_123", "trainer_456", "trainer_789"]
+        self.trainer_ids = list(trainer_ids)
+        self.period = 1.0 / rate
+        self.random = random.Random(seed)
+        self._owns_scheduler = scheduler is None
+        self.scheduler = Scheduler(clock) if scheduler is None else scheduler
+        self.clock = self.scheduler.clock
+        self.targets = {}      # key: uuid_trainer, value: ERG target in watts
+        self._callbacks = {}   # key: uuid_trainer, value: notification callback
+        self._timers = {}      # key: uuid_trainer, value: timer of the next notification
+        self._running = False
+
+    def discover(self):
+        return list(self.trainer_ids)
+
+    def read(self, trainer_id):
+        if trainer_id not in self.trainer_ids:
+            raise KeyError(f"Unknown trainer: {trainer_id}")
+        return self._sample(trainer_id)
+
+    def subscribe(self, trainer_id, callback):
+        self._callbacks[trainer_id] = callback
+        if self._running:
+            self._schedule(trainer_id)
+
+    def unsubscribe(self, trainer_id):
+        self._callbacks.pop(trainer_id, None)
+        timer = self._timers.pop(trainer_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def set_target_power(self, trainer_id, watts):
+        self.targets[trainer_id] = watts
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for trainer_id in self._callbacks:
+            self._schedule(trainer_id)
+        if self._owns_scheduler:
+            self.scheduler.start()
+
+    def stop(self):
+        self._running = False
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._owns_scheduler:
+            self.scheduler.stop()
+
+    def _sample(self, trainer_id):
+        """Returns a reading scattered around the trainer's target power."""
+        target = self.targets.get(trainer_id, 100)
+        power = max(0, int(target) + self.random.randint(-10, 10))
+        return Reading(self.clock.monotonic(), power, self.random.randint(80, 95))
+
+    def _schedule(self, trainer_id):
+        # Trainers are not synchronised: each starts at a random phase of the period.
+        deadline = self.clock.monotonic() + self.random.uniform(0, self.period)
+        self._timers[trainer_id] = self.scheduler.call_at(deadline, self._notify, trainer_id, deadline)
+
+    def _notify(self, trainer_id, deadline):
+        callback = self._callbacks.get(trainer_id)
+        if callback is None or not self._running:
+            return
+        # Schedule from the previous deadline, not from now, so the rate does not drift.
+        deadline += self.period
+        self._timers[trainer_id] = self.scheduler.call_at(deadline, self._notify, trainer_id, deadline)
+        try:
+            callback(trainer_id, self._sample(trainer_id))
+        except Exception as e:
+            logger.error(f"Error in notification callback for {trainer_id}: {e}")
@@ -0,0 +1,182 @@
+'''
+Begin fake_broker.py
+
+An in-process MQTT broker and client for tests and simulations.
+
+FakeClient implements the part of the paho mqtt.Client surface the agents
+use (connect, subscribe, unsubscribe, message_callback_add/remove,
+on_message, publish, loop_start/loop_stop, disconnect).  publish() delivers
+synchronously to every matching subscription on the same FakeBroker, in the
+publishing thread, with topic matching and retained messages as a real
+broker does.  Deliveries are serialised by one broker lock, like paho runs
+each client's callbacks on its single network thread.
+
+No network, no broker process, no loop threads: a test wires several agents
+to one FakeBroker and drives time with clock.VirtualClock.
+'''
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger("FakeBroker")
+
+
+class _PublishResult:
+    """Stands in for paho's MQTTMessageInfo."""
+    __slots__ = ('rc', 'mid')
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return True
+
+
+class FakeBroker:
+    def __init__(self):
+        self.clients = []
+        self.retained = {}  # key: topic, value: (payload, qos)
+        self.published = 0
+        self._lock = threading.RLock()
+        self._mid = 0
+
+    def _next_mid(self):
+        self._mid += 1
+        return self._mid
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Delivers a message to every client with a matching subscription."""
+        with self._lock:
+            self.published += 1
+            if retain:
+                # As in MQTT, an empty retained payload clears the retained message.
+                if payload:
+                    self.retained[topic] = (payload, qos)
+                else:
+                    self.retained.pop(topic, None)
+            for client in list(self.clients):
+                client._deliver(topic, payload, qos, False)
+
+    def deliver_retained(self, client, sub):
+        """Sends the retained messages matching a new subscription to the subscriber."""
+        with self._lock:
+            for topic, (payload, qos) in list(self.retained.items()):
+                if mqtt.topic_matches_sub(sub, topic):
+                    client._deliver(topic, payload, qos, True, only=sub)
+
+
+class FakeClient:
+    def __init__(self, broker, client_id=""):
+        """
+        Parameters:
+            broker (FakeBroker): The broker this client publishes to and receives from.
+            client_id (str, optional): Client id, for logging only.
+        """
+        self.broker = broker
+        self.client_id = client_id
+        self.on_message = None
+        self.on_connect = None
+        self.subscriptions = {}  # key: topic filter, value: qos
+        self._callbacks = {}     # key: topic filter, value: callback
+        self._routes = {}        # cache, key: topic, value: callbacks it is dispatched to
+        self.connected = False
+        broker.clients.append(self)
+
+    # ----- Connection -----
+    def connect(self, host=None, port=1883, keepalive=60, *args, **kwargs):
+        self.connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0, None)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self, *args, **kwargs):
+        self.connected = False
+        if self in self.broker.clients:
+            self.broker.clients.remove(self)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self, *args, **kwargs):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    # ----- Subscriptions -----
+    def subscribe(self, topic, qos=0, *args, **kwargs):
+        """Accepts a topic filter or a list of (filter, qos) tuples, like paho."""
+        subs = topic if isinstance(topic, list) else [(topic, qos)]
+        with self.broker._lock:
+            for sub, sub_qos in subs:
+                self.subscriptions[sub] = sub_qos
+            self._routes.clear()
+            for sub, _ in subs:
+                self.broker.deliver_retained(self, sub)
+            return mqtt.MQTT_ERR_SUCCESS, self.broker._next_mid()
+
+    def unsubscribe(self, topic, *args, **kwargs):
+        topics = topic if isinstance(topic, list) else [topic]
+        with self.broker._lock:
+            for sub in topics:
+                self.subscriptions.pop(sub, None)
+            self._routes.clear()
+            return mqtt.MQTT_ERR_SUCCESS, self.broker._next_mid()
+
+    def message_callback_add(self, sub, callback):
+        self._callbacks[sub] = callback
+        self._routes.clear()
+
+    def message_callback_remove(self, sub):
+        self._callbacks.pop(sub, None)
+        self._routes.clear()
+
+    def _route(self, topic):
+        """Returns the callbacks a message on topic is dispatched to (None means on_message)."""
+        route = self._routes.get(topic)
+        if route is None:
+            if not any(mqtt.topic_matches_sub(sub, topic) for sub in self.subscriptions):
+                route = ()
+            else:
+                route = tuple(callback for sub, callback in self._callbacks.items()
+                              if mqtt.topic_matches_sub(sub, topic)) or (None,)
+            self._routes[topic] = route
+        return route
+
+    # ----- Messages -----
+    def publish(self, topic, payload=None, qos=0, retain=False, *args, **kwargs):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif payload is None:
+            payload = b""
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode()
+        self.broker.publish(topic, payload, qos, retain)
+        return _PublishResult(mqtt.MQTT_ERR_SUCCESS, self.broker._next_mid())
+
+    def _deliver(self, topic, payload, qos, retain, only=None):
+        """Dispatches a message like paho: matching message callbacks first, else on_message."""
+        if only is not None and not mqtt.topic_matches_sub(only, topic):
+            return
+        route = self._route(topic)
+        if not route:
+            return
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.payload = payload
+        msg.qos = qos
+        msg.retain = retain
+        for callback in route:
+            if callback is None:
+                callback = self.on_message
+                if callback is None:
+                    return
+            self._call(callback, msg)
+
+    def _call(self, callback, msg):
+        try:
+            callback(self, None, msg)
+        except Exception as e:
+            logger.error(f"Error in callback of {self.client_id or 'client'} for {msg.topic}: {e}")
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+library.py
+
+This module implements a PlanLibrary over a directory of workout plan files, and a
+PlanLibraryService that answers plan searches over MQTT.
+
+A plan file is JSON, holding either one plan or the dashboard's collection format
+(see coach_dashboard/example_workout_plans.json):
+    {"name": ..., "duration": ..., "segments": [[offset, power, cadence, description], ...]}
+    {"workout_plans": [<plan>, <plan>, ...]}
+
+The library keeps an index of every plan's name, duration and intensity (time-weighted
+mean target power, in percent of FTP), and nothing else; plans without segments are
+logged and left out. A plan is validated and compiled (see plan.compile_plan) when it is
+first asked for, and kept in an LRU cache; an invalid plan raises plan.PlanError then.
+The index is saved in the user's cache directory (see PlanLibrary) and only files whose
+size or modification time changed are read again, so a library of thousands of plans
+starts without parsing them.
+
+The service handles the following MQTT messages:
+    - search_plans: replied with plan_list (index entries, no segments)
+    - select_plan: loads a plan into the service's Coach, which distributes it to the riders
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .codec import decode_payload
+from .messaging import PlanList, subscribe_callbacks, unsubscribe_callbacks
+from .plan import PlanError, plan_from_dict
+
+logger = logging.getLogger("PlanLibrary")
+
+INDEX_FILE = ".plan_index.json"
+INDEX_FORMAT = 2
+
+# One index entry; position is the plan's index in a collection file, None for a single plan.
+PlanEntry = namedtuple('PlanEntry', ['name', 'duration', 'intensity', 'max_power', 'n_segments',
+                                     'path', 'position'])
+
+
+def summarize_plan(plan):
+    """
+    Returns the index fields of a plan dict: (duration, intensity, max_power, segment count).
+    Intensity is the time-weighted mean target power over the plan, in percent of FTP.
+    """
+    segments = plan["segments"]
+    duration = plan.get("duration") or segments[-1][0]
+    energy = 0.0
+    for (start, power, _, _), following in zip(segments, segments[1:] + [[duration]]):
+        energy += power * max(0, min(following[0], duration) - start)
+    max_power = max(segment[1] for segment in segments)
+    return duration, energy / duration if duration else 0.0, max_power, len(segments)
+
+
+def _plans_in(data):
+    """Returns the plan dicts of a parsed plan file, with their positions."""
+    if isinstance(data, dict) and "workout_plans" in data:
+        return list(enumerate(data["workout_plans"]))
+    return [(None, data)]
+
+
+class PlanLibrary:
+    def __init__(self, directory, cache_size=64, save_index=True, index_dir=None):
+        """
+        Initializes the PlanLibrary and indexes its directory.
+
+        Parameters:
+            directory (str): Directory of *.json plan files, searched recursively.
+            cache_size (int, optional): Compiled plans kept in the LRU cache.
+            save_index (bool, optional): Save the index, so the next start only reads the files
+                                         that changed.
+            index_dir (str, optional): Directory the index is saved in. Defaults to
+                                       $XDG_CACHE_HOME/mqtt_services (~/.cache/mqtt_services),
+                                       so nothing is written next to the plans; pass the plan
+                                       directory to keep the index there as INDEX_FILE.
+        """
+        self.directory = directory
+        self.cache_size = cache_size
+        self.save_index = save_index
+        if index_dir is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            index_dir = os.path.join(cache_home, "mqtt_services")
+        self.index_dir = index_dir
+        self.entries = []    # PlanEntry, sorted by name
+        self._by_name = {}   # key: plan name, value: PlanEntry
+        self._cache = OrderedDict()  # key: plan name, value: CompiledPlan, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    # ----- Index -----
+    def _index_path(self):
+        if os.path.abspath(self.index_dir) == os.path.abspath(self.directory):
+            return os.path.join(self.directory, INDEX_FILE)
+        # One index per plan directory in a shared cache directory.
+        key = hashlib.sha256(os.path.abspath(self.directory).encode()).hexdigest()[:16]
+        return os.path.join(self.index_dir, f"plan_index_{key}.json")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return index.get("files", {}) if index.get("format") == INDEX_FORMAT else {}
+
+    def _scan(self):
+        """Yields (relative path, size, mtime) of every plan file in the directory."""
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".json") and name != INDEX_FILE:
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield os.path.relpath(path, self.directory), stat.st_size, stat.st_mtime
+
+    def _index_file(self, relpath):
+        """Reads one plan file and returns the index entries of its plans, not validated."""
+        with open(os.path.join(self.directory, relpath)) as f:
+            data = json.load(f)
+        entries = []
+        for position, plan in _plans_in(data):
+            try:
+                duration, intensity, max_power, count = summarize_plan(plan)
+                entries.append([plan["name"], duration, intensity, max_power, count, position])
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping plan {plan.get('name') if isinstance(plan, dict) else None!r} "
+                               f"in {relpath}: {e}")
+        return entries
+
+    def refresh(self):
+        """Re-indexes the files added, changed or removed since the last index."""
+        previous = self._load_index()
+        files = {}
+        read = 0
+        for relpath, size, mtime in self._scan():
+            known = previous.get(relpath)
+            if known is not None and known["size"] == size and known["mtime"] == mtime:
+                files[relpath] = known
+                continue
+            try:
+                files[relpath] = {"size": size, "mtime": mtime, "plans": self._index_file(relpath)}
+                read += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping plan file {relpath}: {e}")
+        entries = {}
+        for relpath, info in files.items():
+            for name, duration, intensity, max_power, count, position in info["plans"]:
+                if name in entries:
+                    logger.warning(f"Duplicate plan name {name!r} in {relpath}; keeping {entries[name].path}")
+                    continue
+                entries[name] = PlanEntry(name, duration, intensity, max_power, count, relpath, position)
+        with self._lock:
+            self.entries = sorted(entries.values())
+            self._by_name = entries
+            self._names = [entry.name.lower() for entry in self.entries]
+            self._durations = np.array([entry.duration for entry in self.entries], dtype=np.float64)
+            self._intensities = np.array([entry.intensity for entry in self.entries], dtype=np.float64)
+            # Cached plans may come from files that changed.
+            self._cache.clear()
+        if self.save_index and (read or files.keys() != previous.keys()):
+            try:
+                path = self._index_path()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump({"format": INDEX_FORMAT, "files": files}, f)
+            except OSError as e:
+                logger.debug(f"Could not save the plan index: {e}")
+        logger.info(f"Indexed {len(self.entries)} plans in {self.directory} ({read} files read).")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def entry(self, name):
+        """Returns the index entry of a plan. Raises KeyError for an unknown plan."""
+        return self._by_name[name]
+
+    # ----- Queries -----
+    def search(self, query=None, min_duration=None, max_duration=None, min_intensity=None,
+               max_intensity=None, limit=None):
+        """
+        Returns the index entries matching every given filter, sorted by name.
+
+        Parameters:
+            query (str, optional): Case-insensitive substring of the plan name.
+            min_duration, max_duration (float, optional): Duration range in seconds.
+            min_intensity, max_intensity (float, optional): Intensity range in percent of FTP.
+            limit (int, optional): Most entries returned.
+        """
+        with self._lock:
+            entries, names = self.entries, self._names
+            mask = np.ones(len(entries), dtype=bool)
+            for values, low, high in ((self._durations, min_duration, max_duration),
+                                      (self._intensities, min_intensity, max_intensity)):
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+        indices = np.flatnonzero(mask)
+        if query:
+            query = query.lower()
+            indices = [i for i in indices if query in names[i]]
+        if limit is not None:
+            indices = indices[:limit]
+        return [entries[i] for i in indices]
+
+    def get(self, name):
+        """
+        Returns a plan, compiled. The first request parses, validates and compiles it;
+        later ones are served from the LRU cache until it is evicted.
+
+        Raises:
+            KeyError: For an unknown plan.
+            plan.PlanError: If the plan does not compile.
+        """
+        with self._lock:
+            plan = self._cache.get(name)
+            if plan is not None:
+                self._cache.move_to_end(name)
+                self.hits += 1
+                return plan
+            entry = self._by_name[name]
+            self.misses += 1
+        with open(os.path.join(self.directory, entry.path)) as f:
+            data = json.load(f)
+        plan = data["workout_plans"][entry.position] if entry.position is not None else data
+        if plan.get("name") != name:
+            raise PlanError(f"Plan {name!r} moved in {entry.path}; refresh() the library")
+        try:
+            plan = plan_from_dict(plan)
+        except PlanError as e:
+            raise PlanError(f"Plan {name!r} in {entry.path}: {e}") from e
+        with self._lock:
+            self._cache[name] = plan
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return plan
+
+
+class PlanLibraryService:
+    def __init__(self, mqtt_client, library, coach=None, session=None):
+        """
+        Initializes the PlanLibraryService and subscribes to its request topics.
+
+        Parameters:
+            mqtt_client (mqtt.Client): The MQTT client to use.
+            library (PlanLibrary): The library searched.
+            coach (coach.Coach, optional): The coach select_plan loads plans into.
+            session (str, optional): Session namespace of the topics (see messaging.topic_name).
+        """
+        self.client = mqtt_client
+        self.library = library
+        self.coach = coach
+        self.session = session
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.plan_list_msg = PlanList(self.client, session=session)
+        self.callbacks = {
+            "search_plans": self._handle_search_plans,
+            "select_plan": self._handle_select_plan,
+        }
+        subscribe_callbacks(self.client, self.callbacks, self.logger, session=session)
+        self.client.loop_start()
+
+    def close(self):
+        unsubscribe_callbacks(self.client, self.callbacks, self.logger, session=self.session)
+
+    def _handle_search_plans(self, client, userdata, msg):
+        """
+        Handles a SearchPlans request.
+        Replies with the index entries matching the request's filters; no plan is loaded.
+        """
+        try:
+            payload = decode_payload(msg.payload)
+            entries = self.library.search(
+                payload.get("query"), payload.get("min_duration"), payload.get("max_duration"),
+                payload.get("min_intensity"), payload.get("max_intensity"), payload.get("limit"))
+            plans = [{"name": e.name, "duration": e.duration, "intensity": round(e.intensity, 1),
+                      "max_power": e.max_power, "n_segments": e.n_segments} for e in entries]
+            self.plan_list_msg.publish(plans=plans, request_id=payload.get("request_id"))
+            self.logger.info(f"Plan library answered a search with {len(plans)} plans.")
+        except Exception as e:
+            self.logger.error(f"Error handling search_plans request: {e}")
+
+    def _handle_select_plan(self, client, userdata, msg):
+        """
+        Handles a SelectPlan request.
+        Loads the named plan from the library into the coach, which distributes it.
+        A plan that fails validation is reported and the coach keeps its plan.
+        """
+        try:
+            payload = decode_payload(msg.payload)
+            name = payload.get("name")
+            if self.coach is None:
+                self.logger.error(f"select_plan {name!r}: the plan library service has no coach.")
+                return
+            try:
+                plan = self.library.get(name)
+            except KeyError:
+                self.logger.error(f"select_plan: no plan named {name!r} in the library.")
+                return
+            self.coach.set_training_plan(plan)
+            self.logger.info(f"Plan library loaded plan {name!r} into the coach.")
+        except PlanError as e:
+            self.logger.error(f"select_plan: invalid plan: {e}")
+        except Exception as e:
+            self.logger.error(f"Error handling select_plan request: {e}")
@@ -0,0 +1,154 @@
+'''
+Begin logs.py
+
+Log-volume control for the hot paths.
+
+Every telemetry message is published, and handled by the coach and each
+rider, once per trainer per second.  Logging each one at INFO means tens of
+formatted lines per second per agent.  hot() logs such messages instead:
+
+  - lazily: the message is %-formatted by the logging module, and only if the
+    record is emitted; nothing is formatted when the level is disabled;
+  - rate limited per key (usually the topic): at most per_second records of
+    a key are emitted each second, the rest are only counted;
+  - summarised: every interval seconds one line reports how many messages of
+    each key were seen and how many were logged.
+
+configure() sets the limits and can move log output off the hot path onto a
+QueueHandler, whose QueueListener thread does the formatting and the I/O.
+'''
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+logger = logging.getLogger("MessageLog")
+
+
+class RateLimiter:
+    def __init__(self, per_second=1.0, interval=10.0):
+        """
+        Initializes the RateLimiter.
+
+        Parameters:
+            per_second (float, optional): Records emitted per key per second; None for no limit.
+            interval (float, optional): Seconds between summary lines; None for no summary.
+        """
+        self.per_second = per_second
+        self.interval = interval
+        self._window = {}        # key: log key, value: [window start, records emitted in it]
+        self._seen = {}          # key: log key, value: messages since the last summary
+        self._logged = {}        # key: log key, value: records emitted since the last summary
+        self._summary_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Counts a message of key. Returns True if it should be logged."""
+        now = time.monotonic()
+        summary = None
+        with self._lock:
+            self._seen[key] = self._seen.get(key, 0) + 1
+            if self.per_second is None:
+                allowed = True
+            else:
+                window = self._window.get(key)
+                if window is None or now - window[0] >= 1.0:
+                    window = self._window[key] = [now, 0]
+                allowed = window[1] < self.per_second
+                if allowed:
+                    window[1] += 1
+            if allowed:
+                self._logged[key] = self._logged.get(key, 0) + 1
+            if self.interval is not None and now - self._summary_at >= self.interval:
+                summary = self._take_summary(now)
+        if summary:
+            logger.info(summary)
+        return allowed
+
+    def _take_summary(self, now):
+        elapsed = now - self._summary_at
+        self._summary_at = now
+        seen, logged = self._seen, self._logged
+        self._seen, self._logged = {}, {}
+        if not seen:
+            return None
+        counts = ", ".join(f"{key} {n} ({logged.get(key, 0)} logged)" for key, n in sorted(seen.items()))
+        return f"Last {elapsed:.0f} s: {counts}"
+
+    def summary(self):
+        """Returns the pending summary line and starts a new interval."""
+        with self._lock:
+            return self._take_summary(time.monotonic())
+
+
+LIMITER = RateLimiter()
+
+
+def hot(log, key, msg, *args, level=logging.INFO):
+    """
+    Logs a per-message record, lazily and subject to the rate limit of its key.
+
+    Parameters:
+        log (logging.Logger): The agent's logger.
+        key (str): Rate-limit and summary key, usually the message's topic.
+        msg (str): %-style format string, formatted only if the record is emitted.
+        *args: The format arguments.
+        level (int, optional): The record's level.
+    """
+    if log.isEnabledFor(level) and LIMITER.allow(key):
+        log.log(level, msg, *args)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records unformatted: the queue stays in-process, so the listener formats them."""
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def configure(per_second=1.0, interval=10.0, use_queue=False):
+    """
+    Sets the hot-path log limits and, optionally, makes logging non-blocking.
+
+    Parameters:
+        per_second (float, optional): Records emitted per key per second; None for no limit.
+        interval (float, optional): Seconds between summary lines; None for no summary.
+        use_queue (bool, optional): If True, the root logger's handlers are moved behind a
+                                    QueueHandler and run on a QueueListener thread, so
+                                    agents never block on formatting or I/O.
+    """
+    global _listener
+    LIMITER.per_second = per_second
+    LIMITER.interval = interval
+    root = logging.getLogger()
+    if use_queue and _listener is None:
+        handlers = root.handlers[:]
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(_QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_queue)
+    elif not use_queue:
+        stop_queue()
+
+
+def stop_queue():
+    """Flushes the queued records and puts the original handlers back on the root logger."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
@@ -4,106 +4,415 @@ Begin messaging.py
 Create messaging service for controlling a power based cycle trainer
 '''
 import time
-import json
-import numpy as np
 import paho.mqtt.client as mqtt
 import logging
 
 from .constants import hostname, APP_ID
+from . import clock
+from . import logs
+from . import metrics
+from .codec import (
+    JSON_CODEC,
+    decode_payload,
+    MEASURED_POWER_STRUCT,
+    MEASURED_CADENCE_STRUCT,
+    MEASURED_TELEMETRY_STRUCT,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logging.info(f'hostname:{hostname}, APP_ID:{APP_ID}')
 
+Number = (int, float)
+NoneType = type(None)
+
+
+class Field:
+    """
+    Declares one argument of a message type.
+
+    Parameters:
+        name (str): The argument name, used as the payload key.
+        type (type or tuple of types): Accepted Python type(s); object accepts anything.
+        unit (str, optional): Unit of the value, for documentation (e.g. 'W', 'rpm', '%').
+        required (bool, optional): Whether publish() requires the argument. Defaults to True.
+    """
+    __slots__ = ('name', 'type', 'unit', 'required')
+
+    def __init__(self, name, type=object, unit=None, required=True):
+        self.name = name
+        self.type = type
+        self.unit = unit
+        self.required = required
+
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.type!r}, unit={self.unit!r}, required={self.required})"
+
+
+def compile_validator(fields):
+    """
+    Compiles a schema into a validator function, called once when a message type is built.
+
+    Parameters:
+        fields (tuple of Field): The message schema.
+
+    Returns:
+        callable: validate(kw) raising ValueError on a missing, unexpected or mistyped argument.
+    """
+    required = frozenset(f.name for f in fields if f.required)
+    allowed = frozenset(f.name for f in fields)
+    typed = tuple((f.name, f.type) for f in fields if f.type is not object)
+
+    def validate(kw):
+        keys = kw.keys()
+        if not required <= keys:
+            raise ValueError(f"Missing required argument: {', '.join(sorted(required - keys))}")
+        if not keys <= allowed:
+            raise ValueError(f"Unexpected argument: {', '.join(sorted(keys - allowed))}")
+        for name, types in typed:
+            if name in kw and not isinstance(kw[name], types):
+                raise ValueError(f"Argument {name} must be of type {types}, got {type(kw[name]).__name__}")
+    return validate
+
+
 class MQTT_MessageType:
-    def __init__(self, client, topic, arg_names=()):
+    def __init__(self, client, topic, fields=(), codec=None, validate=True, arg_names=None, session=None,
+                 retain=False):
         """
         Initializes the MQTT message type.
 
         Parameters:
             client (mqtt.Client): An instance of the MQTT client that will be used for publishing.
             topic (str): The base topic name.
-            arg_names (tuple or str): A tuple of argument names required for the message.
-                                      If a single string is provided, it is converted to a tuple.
+            fields (tuple of Field): The message schema. It is compiled into a validator here,
+                                     once, rather than interpreted on every publish.
+            codec (optional): The payload codec (see codec.py). Defaults to JSON.
+            validate (bool, optional): If False, publish() skips argument validation.
+                                       Use only in trusted hot loops such as the bridge poller.
+            arg_names (tuple or str, optional): Legacy form of fields: names of required
+                                      arguments of any type. A single string is one name.
+            session (str, optional): Publish under the topics of this coaching session.
+            retain (bool, optional): Publish as retained messages, so the broker hands the last
+                                     value to every new subscriber.
         """
         self.client = client
-        if isinstance(arg_names, str):
-            arg_names = (arg_names,)
+        self.codec = JSON_CODEC if codec is None else codec
+        if arg_names is not None:
+            if isinstance(arg_names, str):
+                arg_names = (arg_names,)
+            fields = tuple(fields) + tuple(Field(name) for name in arg_names)
         # Use hierarchical topic naming with slashes.
-        self.topic = f'{APP_ID}/{topic}'
-        self.arg_names = arg_names
-
-    def publish(self, **kw):
-        # Validate that all required arguments are provided.
-        for name in self.arg_names:
-            if name not in kw:
-                raise ValueError(f"Missing required argument: {name}")
-        # Optionally validate that no unexpected arguments are provided.
-        for key in kw:
-            if key not in self.arg_names:
-                raise ValueError(f"Unexpected argument: {key}")
-        
-        # Add a timestamp to the message.
-        kw['time'] = np.datetime64('now', 's').astype(str)
+        self.topic = topic_name(topic, session)
+        self.fields = tuple(fields)
+        self.arg_names = tuple(f.name for f in self.fields)
+        self.validate = validate
+        self.retain = retain
+        self._validator = compile_validator(self.fields)
+        codec_fields = getattr(self.codec, 'fields', None)
+        if codec_fields is not None:
+            missing = set(self.arg_names) - {name for name, _ in codec_fields}
+            if missing:
+                raise ValueError(f"Codec for {self.topic} has no layout for: {', '.join(sorted(missing))}")
+
+    def publish(self, stamp=None, trace=None, **kw):
+        """
+        Validates and publishes the message. Takes the arguments of encode().
+        """
+        self.publish_payload(self.encode(stamp, trace, **kw))
+
+    def encode(self, stamp=None, trace=None, **kw):
+        """
+        Validates and serializes the message, without publishing it.
+
+        Parameters:
+            stamp (clock.Timestamp, optional): A precomputed timestamp, so that every message
+                published in one poll tick carries the same time. Defaults to clock.now().
+            trace (tracing.TraceContext, optional): Trace carried in the payload's "trace" key.
+                A traced message is always JSON encoded, as the binary codec has no room for it.
+            **kw: The message arguments.
+
+        Returns:
+            str or bytes: The payload, for publish_payload().
+        """
+        if self.validate:
+            self._validator(kw)
+
+        # Add a timestamp to the message: wall clock and monotonic seconds.
+        if stamp is None:
+            stamp = clock.now()
+        kw['time'] = stamp.wall
+        kw['mono'] = stamp.mono
         
         # Serialize the payload.
-        payload = json.dumps(kw)
-        
-        # Publish using the stored MQTT client.
-        result = self.client.publish(self.topic, payload)
+        if trace is None:
+            payload = self.codec.encode(kw)
+        else:
+            kw['trace'] = trace.as_dict()
+            payload = JSON_CODEC.encode(kw)
+        return payload
+
+    def publish_payload(self, payload):
+        """
+        Publishes an encoded payload on the message's topic, e.g. one cached by the caller
+        so that an unchanged message is not serialized again.
+        """
+        result = self.client.publish(self.topic, payload, retain=self.retain)
+        if metrics.REGISTRY.enabled:
+            metrics.REGISTRY.record_publish(self.topic, payload, result.rc)
         if result.rc != mqtt.MQTT_ERR_SUCCESS:
             logging.error(f"Failed to publish message to {self.topic}: {mqtt.error_string(result.rc)}")
         else:
-            logging.info(f"Published message to {self.topic}: {payload}")
+            # The length only: binary topics carry struct bytes, which do not read as text.
+            logs.hot(logging.root, self.topic, "Published %d-byte message to %s", len(payload), self.topic)
 
 # Message type definitions now require the client instance.
-def RequestFTP(client):
-    return MQTT_MessageType(client, 'uuid_trainer')
+# Each factory declares its schema; extra keyword options (codec, validate, session) are
+# passed through to MQTT_MessageType.
+def RequestFTP(client, **options):
+    return MQTT_MessageType(client, 'uuid_trainer', (
+        Field('uuid_trainer', str),
+    ), **options)
 
-def SendFTP(client):
-    return MQTT_MessageType(client, 'uuid_trainer', 'ftp')
+def SendFTP(client, **options):
+    return MQTT_MessageType(client, 'uuid_trainer', (
+        Field('uuid_trainer', str),
+        Field('ftp', Number, 'W'),
+    ), **options)
 
-def ListDevices(client):
-    return MQTT_MessageType(client, 'list_devices')
+def ListDevices(client, **options):
+    return MQTT_MessageType(client, 'list_devices', **options)
 
-def DeviceList(client):
-    return MQTT_MessageType(client, 'device_list', arg_names='device_list')
+def DeviceList(client, **options):
+    return MQTT_MessageType(client, 'device_list', (
+        Field('device_list', list),
+    ), **options)
 
-def PairDevice(client):
+def PairDevice(client, **options):
     """Pair a trainer with a rider dashboard.
        If uuid_rider_dashboard is None, it unpairs the trainer.
     """
-    return MQTT_MessageType(client, 'pair_trainer_rider', arg_names=('uuid_trainer', 'uuid_rider'))
+    return MQTT_MessageType(client, 'pair_trainer_rider', (
+        Field('uuid_trainer', str),
+        Field('uuid_rider', (str, NoneType)),
+    ), **options)
 
-def GetPlan(client):
-    return MQTT_MessageType(client, 'get_plan')
+def GetPlan(client, **options):
+    """Ask the coach for its plan; version is the one the rider already holds, if any."""
+    return MQTT_MessageType(client, 'get_plan', (
+        Field('version', (str, NoneType), required=False),
+    ), **options)
 
-def SendPlan(client):
-    return MQTT_MessageType(client, 'send_plan', arg_names='training_plan')
+def SendPlan(client, **options):
+    return MQTT_MessageType(client, 'send_plan', (
+        Field('training_plan', list),
+        Field('version', str, required=False),
+    ), **options)
 
-def SetFTP(client):
-    return MQTT_MessageType(client, 'set_ftp', arg_names=('uuid_trainer', 'ftp'))
+def PlanVersion(client, **options):
+    """Announces the version (content hash, see plan.plan_version) of the coach's current plan."""
+    return MQTT_MessageType(client, 'plan_version', (
+        Field('version', str),
+    ), **options)
 
-def StartPlan(client):
-    return MQTT_MessageType(client, 'start_plan')
+def SetFTP(client, **options):
+    return MQTT_MessageType(client, 'set_ftp', (
+        Field('uuid_trainer', str),
+        Field('ftp', Number, 'W'),
+    ), **options)
 
-def StopPlan(client):
-    return MQTT_MessageType(client, 'stop_plan')
+def StartPlan(client, **options):
+    """
+    Starts the plan. start_time is the wall clock time (epoch seconds) of the plan's
+    offset 0 and version the plan started (see plan.plan_version), so a rider holding
+    that plan runs it locally; elapsed is only sent while the plan is paused.
+    """
+    return MQTT_MessageType(client, 'start_plan', (
+        Field('start_time', Number, 's', required=False),
+        Field('version', (str, NoneType), required=False),
+        Field('elapsed', Number, 's', required=False),
+    ), **options)
 
-def SetTargetPower(client):
-    return MQTT_MessageType(client, 'set_target_power', arg_names=('target_power'))
+def StopPlan(client, **options):
+    return MQTT_MessageType(client, 'stop_plan', **options)
+
+def SetTargetPower(client, **options):
+    return MQTT_MessageType(client, 'set_target_power', (
+        Field('target_power', Number, '%'),
+    ), **options)
     
-def SetMeasuredPower(client):
-    return MQTT_MessageType(client, 'set_measured_power', arg_names=('uuid_trainer', 'measured_power', 'percent_ftp'))
+def SetMeasuredPower(client, binary=False, **options):
+    codec = MEASURED_POWER_STRUCT if binary else None
+    return MQTT_MessageType(client, 'set_measured_power', (
+        Field('uuid_trainer', str),
+        Field('measured_power', Number, 'W'),
+        Field('percent_ftp', Number, '%'),
+    ), codec=codec, **options)
 
-def SetTargetCadence(client):
-    return MQTT_MessageType(client, 'set_target_cadence', arg_names=('target_cadence'))
+def SetSegment(client, **options):
+    """
+    One training plan segment: target power and cadence in a single message, so a
+    bridge applies both at once instead of seeing a half-applied segment.
+    """
+    return MQTT_MessageType(client, 'set_segment', (
+        Field('segment', int),
+        Field('target_power', Number, '%'),
+        Field('target_cadence', Number, 'rpm'),
+    ), **options)
+
+def SetTargetCadence(client, **options):
+    return MQTT_MessageType(client, 'set_target_cadence', (
+        Field('target_cadence', Number, 'rpm'),
+    ), **options)
     
-def SetMeasuredCadence(client):
-    return MQTT_MessageType(client, 'set_measured_cadence', arg_names=('uuid_trainer', 'measured_cadence'))
+def SetMeasuredCadence(client, binary=False, **options):
+    codec = MEASURED_CADENCE_STRUCT if binary else None
+    return MQTT_MessageType(client, 'set_measured_cadence', (
+        Field('uuid_trainer', str),
+        Field('measured_cadence', Number, 'rpm'),
+    ), codec=codec, **options)
+
+def SetMeasuredTelemetry(client, binary=False, **options):
+    """Batched telemetry frame: one publish per bridge poll tick.
+       Each argument is a list with one entry per trainer, aligned by index.
+    """
+    codec = MEASURED_TELEMETRY_STRUCT if binary else None
+    return MQTT_MessageType(client, 'set_measured_telemetry', (
+        Field('uuid_trainer', list),
+        Field('measured_power', list, 'W'),
+        Field('measured_cadence', list, 'rpm'),
+        Field('percent_ftp', list, '%'),
+    ), codec=codec, **options)
+
+def GetMetrics(client, **options):
+    """Ask the coach for rolling telemetry metrics; without uuid_trainer, for every trainer."""
+    return MQTT_MessageType(client, 'get_metrics', (
+        Field('uuid_trainer', (str, NoneType), required=False),
+    ), **options)
+
+def SendMetrics(client, **options):
+    """The coach's reply to get_metrics: key: uuid_trainer, value: TelemetryStore.summary()."""
+    return MQTT_MessageType(client, 'send_metrics', (
+        Field('metrics', dict),
+    ), **options)
+
+def SearchPlans(client, **options):
+    """Query the plan library (see library.py); every filter is optional, none lists every plan."""
+    return MQTT_MessageType(client, 'search_plans', (
+        Field('query', (str, NoneType), required=False),
+        Field('min_duration', (int, float, NoneType), 's', required=False),
+        Field('max_duration', (int, float, NoneType), 's', required=False),
+        Field('min_intensity', (int, float, NoneType), '%', required=False),
+        Field('max_intensity', (int, float, NoneType), '%', required=False),
+        Field('limit', (int, NoneType), required=False),
+        Field('request_id', (str, NoneType), required=False),
+    ), **options)
+
+def PlanList(client, **options):
+    """The plan library's reply to search_plans: name, duration and intensity of each plan found."""
+    return MQTT_MessageType(client, 'plan_list', (
+        Field('plans', list),
+        Field('request_id', (str, NoneType), required=False),
+    ), **options)
+
+def SelectPlan(client, **options):
+    """Load a plan of the plan library into the coach."""
+    return MQTT_MessageType(client, 'select_plan', (
+        Field('name', str),
+    ), **options)
+
+def TrainerPower(client, uuid_trainer, **options):
+    """Per-trainer power topic (APP_ID/trainer/<uuid>/power), so a dashboard can follow one trainer."""
+    return MQTT_MessageType(client, f'trainer/{uuid_trainer}/power', (
+        Field('measured_power', Number, 'W'),
+        Field('percent_ftp', Number, '%'),
+    ), **options)
+
+def TrainerCadence(client, uuid_trainer, **options):
+    """Per-trainer cadence topic (APP_ID/trainer/<uuid>/cadence)."""
+    return MQTT_MessageType(client, f'trainer/{uuid_trainer}/cadence', (
+        Field('measured_cadence', Number, 'rpm'),
+    ), **options)
+
+def TimeRequest(client, **options):
+    """
+    NTP-style clock sync request to the coach (see timesync.py): t0 is the requester's
+    uncorrected wall clock when sending; the response goes to time/<client_id>/response.
+    """
+    return MQTT_MessageType(client, 'time_request', (
+        Field('client_id', str),
+        Field('seq', int),
+        Field('t0', Number, 's'),
+    ), **options)
+
+def TimeResponse(client, client_id, **options):
+    """
+    Clock sync response (APP_ID/time/<client_id>/response): the request's t0, and the
+    coach's wall clock when it received the request (t1) and sent the response (t2).
+    """
+    return MQTT_MessageType(client, f'time/{client_id}/response', (
+        Field('seq', int),
+        Field('t0', Number, 's'),
+        Field('t1', Number, 's'),
+        Field('t2', Number, 's'),
+    ), **options)
+
+def topic_name(topic, session=None):
+    """
+    Returns the full hierarchical topic for a topic suffix.
+    Topics of a coaching session live under APP_ID/session/<session>/, so several
+    classes can share one broker without seeing each other's plans and targets.
+    """
+    if topic.startswith(f'{APP_ID}/'):
+        return topic
+    if session is not None:
+        return f'{APP_ID}/session/{session}/{topic}'
+    return f'{APP_ID}/{topic}'
+
+def trainer_topic(uuid_trainer, leaf):
+    """Returns the per-trainer topic, e.g. APP_ID/trainer/<uuid>/power."""
+    return f'{APP_ID}/trainer/{uuid_trainer}/{leaf}'
+
+def subscribe_callbacks(client, callbacks, logger, qos=0, session=None):
+    """
+    Subscribes to exactly the topics in a callback table and registers their handlers,
+    so an agent only receives the messages it handles instead of everything under APP_ID/#.
+
+    Parameters:
+        client (mqtt.Client): The MQTT client.
+        callbacks (dict): Maps a topic suffix (or a full topic filter starting with APP_ID)
+                          to its handler.
+        logger (logging.Logger): Logger of the registering agent.
+        qos (int, optional): The subscription QoS.
+        session (str, optional): Session namespace for the topic suffixes (see topic_name).
+
+    When metrics are enabled (see metrics.py), each handler is wrapped to count and time its messages.
+    """
+    if not callbacks:
+        return
+    topics = [topic_name(topic, session) for topic in callbacks]
+    # Handlers go in before the subscription, so retained messages sent on subscribing find them.
+    for topic, callback in zip(topics, callbacks.values()):
+        if metrics.REGISTRY.enabled:
+            callback = metrics.REGISTRY.instrument(callback)
+        client.message_callback_add(topic, callback)
+    result, mid = client.subscribe([(topic, qos) for topic in topics])
+    if result != mqtt.MQTT_ERR_SUCCESS:
+        logger.error(f"Failed to subscribe to topics {topics}: {mqtt.error_string(result)}")
+    else:
+        logger.info(f"Subscribed to topics {topics}")
+
+def unsubscribe_callbacks(client, topics, logger, session=None):
+    """Reverses subscribe_callbacks for the given topic filters."""
+    topics = [topic_name(topic, session) for topic in topics]
+    if not topics:
+        return
+    client.unsubscribe(topics)
+    for topic in topics:
+        client.message_callback_remove(topic)
+    logger.info(f"Unsubscribed from topics {topics}")
 
 # Callback function for received messages.
 def on_message(client, userdata, msg):
-    logging.info(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
+    logging.info(f"Received message on topic {msg.topic}: {decode_payload(msg.payload)}")
 
 def main():
     # Set up logging for the module.
@@ -0,0 +1,220 @@
+'''
+Begin metrics.py
+
+Process-wide counters and latency histograms for the agents, exported in the
+Prometheus text format.
+
+The registry is disabled by default, and every hot path checks
+REGISTRY.enabled before doing anything, so an uninstrumented run pays one
+attribute lookup per message.  Call enable() before creating the agents:
+subscribe_callbacks() only wraps handlers with timing when metrics are on.
+
+What is recorded:
+    mqtt_messages_out_total{topic}       messages published by MQTT_MessageType.publish
+    mqtt_bytes_out_total{topic}          their payload bytes
+    mqtt_publish_failures_total{topic}   publishes whose result.rc was not MQTT_ERR_SUCCESS
+    mqtt_messages_in_total{topic}        messages delivered to a registered handler
+    mqtt_bytes_in_total{topic}           their payload bytes
+    mqtt_handler_errors_total{topic}     exceptions escaping a handler
+    log_errors_total{logger}             ERROR log records, per agent; the handlers catch
+                                         and log their own exceptions, so this counts them
+    mqtt_handler_latency_milliseconds    handler run time histogram, per topic
+    mqtt_decode_errors_total             payloads decode_payload() could not decode
+    bridge_poll_overruns_total           poll ticks skipped because a bridge fell behind
+
+serve() exposes them on http://<host>:<port>/metrics for a local scraper.
+'''
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .tracing import Histogram
+
+logger = logging.getLogger("Metrics")
+
+_HELP = {
+    "mqtt_messages_out_total": "Messages published.",
+    "mqtt_bytes_out_total": "Payload bytes published.",
+    "mqtt_publish_failures_total": "Publishes the client did not accept.",
+    "mqtt_messages_in_total": "Messages delivered to a handler.",
+    "mqtt_bytes_in_total": "Payload bytes delivered to a handler.",
+    "mqtt_handler_errors_total": "Exceptions raised by a handler.",
+    "mqtt_handler_latency_milliseconds": "Handler run time in milliseconds.",
+    "mqtt_decode_errors_total": "Payloads that could not be decoded.",
+    "bridge_poll_overruns_total": "Poll ticks skipped because the poll loop fell behind.",
+    "log_errors_total": "Log records at ERROR level or above.",
+}
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    text = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + text + "}"
+
+
+class _ErrorCounter(logging.Handler):
+    """Counts the ERROR records of every logger into a registry."""
+
+    def __init__(self, registry):
+        super().__init__(logging.ERROR)
+        self.registry = registry
+
+    def emit(self, record):
+        self.registry.inc("log_errors_total", logger=record.name)
+
+
+class MetricsRegistry:
+    enabled = False
+
+    def __init__(self):
+        self.counters = {}    # key: (name, labels), value: number
+        self.histograms = {}  # key: (name, labels), value: tracing.Histogram
+        self._lock = threading.Lock()
+        self._error_counter = _ErrorCounter(self)
+
+    def enable(self):
+        self.enabled = True
+        logging.getLogger().addHandler(self._error_counter)
+
+    def disable(self):
+        self.enabled = False
+        logging.getLogger().removeHandler(self._error_counter)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # ----- Recording -----
+    def inc(self, name, value=1, **labels):
+        """Adds value to a counter."""
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Records a value in a histogram."""
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_publish(self, topic, payload, rc):
+        """Records one MQTT_MessageType.publish()."""
+        key = (("topic", topic),)
+        with self._lock:
+            counters = self.counters
+            counters[("mqtt_messages_out_total", key)] = counters.get(("mqtt_messages_out_total", key), 0) + 1
+            counters[("mqtt_bytes_out_total", key)] = counters.get(("mqtt_bytes_out_total", key), 0) + len(payload)
+            if rc:
+                counters[("mqtt_publish_failures_total", key)] = \
+                    counters.get(("mqtt_publish_failures_total", key), 0) + 1
+
+    def instrument(self, callback):
+        """
+        Wraps an MQTT message callback to count its messages, bytes and errors and time it.
+
+        Parameters:
+            callback (callable): A callback(client, userdata, msg).
+
+        Returns:
+            callable: The instrumented callback.
+        """
+        def instrumented(client, userdata, msg):
+            if not self.enabled:
+                return callback(client, userdata, msg)
+            start = time.perf_counter()
+            try:
+                return callback(client, userdata, msg)
+            except Exception:
+                self.inc("mqtt_handler_errors_total", topic=msg.topic)
+                raise
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                key = (("topic", msg.topic),)
+                with self._lock:
+                    counters = self.counters
+                    counters[("mqtt_messages_in_total", key)] = counters.get(("mqtt_messages_in_total", key), 0) + 1
+                    counters[("mqtt_bytes_in_total", key)] = \
+                        counters.get(("mqtt_bytes_in_total", key), 0) + len(msg.payload)
+                    histogram = self.histograms.get(("mqtt_handler_latency_milliseconds", key))
+                    if histogram is None:
+                        histogram = self.histograms[("mqtt_handler_latency_milliseconds", key)] = Histogram()
+                    histogram.observe(elapsed)
+        instrumented.__wrapped__ = callback
+        return instrumented
+
+    # ----- Export -----
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, histogram.as_dict(), histogram.sum) for key, histogram in histograms]
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), summary, total in histograms:
+            describe(name, "histogram")
+            for bound, count in summary["buckets"].items():
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {summary['count']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="127.0.0.1"):
+        """
+        Serves render() on http://host:port/metrics from a daemon thread.
+
+        Returns:
+            ThreadingHTTPServer: Call shutdown() on it to stop serving.
+        """
+        registry = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+
+# The process-wide registry the agents record to.
+REGISTRY = MetricsRegistry()
+
+
+def enable():
+    """Turns on metrics collection. Call before creating the agents."""
+    REGISTRY.enable()
+
+
+def serve(port=9100, host="127.0.0.1"):
+    """Turns on metrics collection and serves it in the Prometheus text format."""
+    REGISTRY.enable()
+    return REGISTRY.serve(port, host)
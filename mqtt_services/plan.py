@@ -0,0 +1,254 @@
+'''
+Begin plan.py
+
+Compiled training plans.
+
+A training plan is a list of (start_time_offset, target_power, target_cadence,
+description) tuples, target_power in percent of FTP.  compile_plan() checks
+it once and returns a CompiledPlan that keeps the offsets in a sorted array,
+so the target at any time is a bisection instead of a walk through the plan:
+
+    plan = compile_plan(coach.training_plan)
+    plan.targets_at(437)              # (power, cadence) at t = 437 s
+    plan.targets_at_times(times)      # vectorized, for analytics
+    plan.seek(437)                    # the rest of the plan, for a rider joining late
+
+A valid plan starts at offset 0, has strictly increasing offsets and ends
+with a terminating segment of target power 0, whose offset is the plan's
+duration.  Plans in the dashboard's JSON format (see
+coach_dashboard/example_workout_plans.json) give a duration instead of a
+terminating segment; one is appended when they are compiled.
+
+CompiledPlan is immutable: seek(), skip() and extend() return new plans.
+'''
+import hashlib
+import json
+import logging
+import os
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger("Plan")
+
+Segment = namedtuple('Segment', ['offset', 'power', 'cadence', 'description'])
+
+EXAMPLE_PLANS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "coach_dashboard", "example_workout_plans.json")
+
+
+class PlanError(ValueError):
+    """Raised for a training plan that cannot be compiled."""
+
+
+class CompiledPlan:
+    def __init__(self, segments, name=None):
+        """
+        Initializes the CompiledPlan from validated segments; use compile_plan().
+
+        Parameters:
+            segments (list of Segment): The plan, terminating segment included.
+            name (str, optional): The plan's name.
+        """
+        self.name = name
+        self.segments = tuple(segments)
+        self._offsets = [segment.offset for segment in self.segments]
+        self.offsets = np.array(self._offsets, dtype=np.float64)
+        self.powers = np.array([segment.power for segment in self.segments], dtype=np.float64)
+        self.cadences = np.array([segment.cadence for segment in self.segments], dtype=np.float64)
+        self.offsets.flags.writeable = self.powers.flags.writeable = self.cadences.flags.writeable = False
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __getitem__(self, index):
+        return self.segments[index]
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledPlan) and self.segments == other.segments
+
+    def __repr__(self):
+        return f"CompiledPlan({self.name!r}, {len(self)} segments, {self.duration:g} s)"
+
+    @property
+    def duration(self):
+        """Seconds from the start to the terminating segment."""
+        return self._offsets[-1]
+
+    def to_list(self):
+        """Returns the plan as the coach's list of tuples."""
+        return [tuple(segment) for segment in self.segments]
+
+    # ----- Lookup -----
+    def index_at(self, t):
+        """Returns the index of the segment in force at t seconds, or -1 before the start."""
+        return bisect_right(self._offsets, t) - 1
+
+    def segment_at(self, t):
+        """Returns the Segment in force at t seconds; the terminating segment after the end."""
+        index = self.index_at(t)
+        return self.segments[index] if index >= 0 else None
+
+    def targets_at(self, t):
+        """Returns (target_power, target_cadence) at t seconds, or None before the start."""
+        segment = self.segment_at(t)
+        return None if segment is None else (segment.power, segment.cadence)
+
+    def segment_end(self, index):
+        """Returns the offset at which a segment ends: the next segment's offset."""
+        return self._offsets[index + 1] if index + 1 < len(self._offsets) else self.duration
+
+    def time_remaining(self, t):
+        """Returns the seconds left in the segment in force at t."""
+        index = self.index_at(t)
+        return max(0.0, self.segment_end(max(index, 0)) - t) if index < len(self) - 1 else 0.0
+
+    def indices_at(self, times):
+        """Vectorized index_at: the segment index at each time, -1 before the start."""
+        return np.searchsorted(self.offsets, np.asarray(times, dtype=np.float64), side="right") - 1
+
+    def targets_at_times(self, times):
+        """
+        Returns the target power and cadence at each of an array of times.
+
+        Returns:
+            tuple: (powers, cadences), float64 arrays shaped like times; NaN before the start.
+        """
+        indices = self.indices_at(times)
+        before = indices < 0
+        indices = np.maximum(indices, 0)
+        powers = self.powers[indices]
+        cadences = self.cadences[indices]
+        if before.any():
+            powers = np.where(before, np.nan, powers)
+            cadences = np.where(before, np.nan, cadences)
+        return powers, cadences
+
+    # ----- Editing -----
+    def seek(self, t):
+        """
+        Returns the rest of the plan from t seconds, re-based so that t is offset 0:
+        the segment in force at t is cut short and the later ones move up.
+        """
+        if t <= 0:
+            return self
+        index = min(max(self.index_at(t), 0), len(self) - 1)
+        first = self.segments[index]._replace(offset=0)
+        rest = [segment._replace(offset=segment.offset - t) for segment in self.segments[index + 1:]]
+        return CompiledPlan([first] + rest, self.name)
+
+    def skip(self, index):
+        """Returns the plan without segment index; the later segments move up by its length."""
+        if not 0 <= index < len(self) - 1:
+            raise PlanError(f"Cannot skip segment {index} of a {len(self)}-segment plan")
+        length = self.segment_end(index) - self._offsets[index]
+        segments = list(self.segments[:index])
+        for segment in self.segments[index + 1:]:
+            segments.append(segment._replace(offset=segment.offset - length))
+        if index == 0:
+            segments[0] = segments[0]._replace(offset=0)
+        return CompiledPlan(segments, self.name)
+
+    def extend(self, index, seconds):
+        """Returns the plan with segment index lengthened by seconds (shortened if negative)."""
+        if not 0 <= index < len(self) - 1:
+            raise PlanError(f"Cannot extend segment {index} of a {len(self)}-segment plan")
+        if self.segment_end(index) - self._offsets[index] + seconds <= 0:
+            raise PlanError(f"Segment {index} cannot be shortened by {-seconds} s")
+        segments = list(self.segments[:index + 1])
+        for segment in self.segments[index + 1:]:
+            segments.append(segment._replace(offset=segment.offset + seconds))
+        return CompiledPlan(segments, self.name)
+
+
+def compile_plan(training_plan, name=None, duration=None):
+    """
+    Validates a training plan and compiles it.
+
+    Parameters:
+        training_plan (list or CompiledPlan): (start_time_offset, target_power, target_cadence,
+                                             description) tuples or lists.
+        name (str, optional): The plan's name.
+        duration (float, optional): Plan length in seconds. A plan without a terminating
+                                    segment gets one at this offset.
+
+    Returns:
+        CompiledPlan: The compiled plan.
+
+    Raises:
+        PlanError: If the plan is empty, malformed, out of order or not terminated.
+    """
+    if isinstance(training_plan, CompiledPlan):
+        return training_plan
+    segments = []
+    for i, segment in enumerate(training_plan):
+        try:
+            offset, power, cadence, description = segment
+        except (TypeError, ValueError):
+            raise PlanError(f"Segment {i} is not (offset, power, cadence, description): {segment!r}")
+        for field, value in (("offset", offset), ("power", power), ("cadence", cadence)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise PlanError(f"Segment {i} has an invalid {field}: {value!r}")
+        segments.append(Segment(offset, power, cadence, str(description)))
+    if not segments:
+        raise PlanError("The plan has no segments")
+    if segments[0].offset != 0:
+        raise PlanError(f"The plan must start at offset 0, not {segments[0].offset}")
+    for i in range(1, len(segments)):
+        if segments[i].offset <= segments[i - 1].offset:
+            raise PlanError(f"Segment {i} starts at {segments[i].offset}, not after segment {i - 1} "
+                            f"at {segments[i - 1].offset}")
+    last = segments[-1]
+    terminated = last.power == 0 and len(segments) > 1
+    if duration is not None and terminated and duration != last.offset:
+        raise PlanError(f"The plan's duration {duration} does not match its last segment at {last.offset}")
+    if not terminated:
+        if duration is None:
+            raise PlanError("The plan must end with a segment of target power 0, or have a duration")
+        if duration <= last.offset:
+            raise PlanError(f"The plan's duration {duration} is not after its last segment at {last.offset}")
+        segments.append(Segment(duration, 0, last.cadence, "end"))
+    return CompiledPlan(segments, name)
+
+
+def plan_version(training_plan):
+    """
+    Returns the version of a plan: a hash of its content, the same for equal plans in
+    any process, so a rider can tell whether it already holds the coach's plan.
+    """
+    text = json.dumps([list(segment) for segment in training_plan], separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def plan_from_dict(plan):
+    """Compiles one plan of the dashboard's JSON format: {"name", "duration", "segments"}."""
+    return compile_plan(plan["segments"], plan.get("name"), plan.get("duration"))
+
+
+def load_plans(path=EXAMPLE_PLANS, strict=False):
+    """
+    Loads and compiles the plans of a dashboard JSON file.
+
+    Parameters:
+        path (str, optional): The JSON file; defaults to the dashboard's example plans.
+        strict (bool, optional): If True, an invalid plan raises PlanError; otherwise it is
+                                 logged and left out.
+
+    Returns:
+        dict: key: plan name, value: CompiledPlan.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    plans = {}
+    for plan in data.get("workout_plans", []):
+        try:
+            plans[plan["name"]] = plan_from_dict(plan)
+        except (KeyError, PlanError) as e:
+            if strict:
+                raise PlanError(f"Plan {plan.get('name')!r} in {path}: {e}") from e
+            logger.warning(f"Skipping plan {plan.get('name')!r} in {path}: {e}")
+    return plans
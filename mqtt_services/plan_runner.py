@@ -0,0 +1,176 @@
+'''
+Begin plan_runner.py
+
+Local execution of a training plan from the coach's start_plan.
+
+The coach publishes start_plan, retained, with the wall clock time of the
+plan's offset 0 (see Coach._announce_start).  An agent holding the plan runs
+it on its own clock instead of waiting for a broadcast per segment: a
+PlanRunner enters the segment in force at once, so an agent joining late
+starts mid-plan, then fires each following segment at start + offset on a
+Scheduler and hands it to the agent's on_segment callback:
+
+    runner = PlanRunner(on_segment, clock=clock)
+    runner.start(training_plan, start_time)       # from start_plan
+    runner.countdown()                            # seconds left in the segment
+    runner.stop()                                 # from stop_plan
+    runner.close()                                # when the agent shuts down
+
+Both the Rider and the WirelessBridge run the coach's plan this way.
+'''
+import logging
+import threading
+
+from .clock import SYSTEM_CLOCK
+from .plan import compile_plan
+from .scheduler import Scheduler
+
+logger = logging.getLogger("PlanRunner")
+
+
+class PlanRunner:
+    def __init__(self, on_segment, clock=None, scheduler=None):
+        """
+        Initializes the PlanRunner.
+
+        Parameters:
+            on_segment (callable): Called as on_segment(index, segment, remaining) when the plan
+                enters a segment, remaining being the seconds left in it. It is called with the
+                runner's lock held, so it must not call back into the runner.
+            clock (clock.SystemClock, optional): The clock the plan is timed on.
+                Tests and simulations can pass a virtual clock.
+            scheduler (scheduler.Scheduler, optional): Timer scheduler that fires the segments.
+                If None, one is started with the first plan and stopped by close().
+        """
+        self.on_segment = on_segment
+        self.scheduler = scheduler
+        self._owns_scheduler = False
+        if clock is None:
+            clock = SYSTEM_CLOCK if scheduler is None else scheduler.clock
+        self.clock = clock
+
+        # The compiled plan, its start on self.clock, the running time while paused, the
+        # segment in force and the timer firing the next one. _run counts starts and stops,
+        # so a timer from an earlier run does nothing.
+        self._lock = threading.Lock()
+        self.plan = None
+        self._start = None
+        self._paused = None
+        self.index = -1
+        self._timer = None
+        self._run = 0
+
+    def start(self, training_plan, start_time, elapsed=None):
+        """
+        Runs a plan from the coach's start time. Starting the plan already running again,
+        e.g. on a pause or resume, keeps its segment unless the running time moved it.
+
+        Parameters:
+            training_plan (list of tuples or plan.CompiledPlan): The plan.
+            start_time (float): Wall clock time (epoch seconds) of the plan's offset 0.
+            elapsed (float, optional): The running time the plan is paused at, if it is paused.
+
+        Raises:
+            plan.PlanError: If the plan does not compile.
+        """
+        compiled = compile_plan(training_plan)
+        with self._lock:
+            self._cancel_timer()
+            self._run += 1
+            if compiled != self.plan:
+                self.index = -1
+            self.plan = compiled
+            # The segments are timed on self.clock; map the wall clock start time to it.
+            self._start = self.clock.monotonic() - (self.clock.wall() - start_time)
+            self._paused = elapsed
+            self._advance()
+
+    def stop(self, finish=False):
+        """
+        Stops the plan.
+
+        Parameters:
+            finish (bool, optional): First enter the plan's terminating segment, unless it is in
+                force already. The coach's stop_plan as the plan ends may arrive just before the
+                terminating segment is due here.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._run += 1
+            if finish and self.plan is not None and self.index != len(self.plan) - 1:
+                self._enter(len(self.plan) - 1, 0.0)
+            self.plan = None
+            self._start = None
+            self._paused = None
+            self.index = -1
+
+    def close(self):
+        """Stops the plan and the scheduler the runner started, if any."""
+        self.stop()
+        with self._lock:
+            scheduler = self.scheduler if self._owns_scheduler else None
+            if scheduler is not None:
+                self.scheduler = None
+                self._owns_scheduler = False
+        if scheduler is not None:
+            scheduler.stop()
+
+    def elapsed(self):
+        """Returns the plan's running time in seconds, or None if no plan is running."""
+        with self._lock:
+            return self._elapsed()
+
+    def countdown(self):
+        """Returns the seconds left in the current segment, or None if no plan is running."""
+        with self._lock:
+            elapsed = self._elapsed()
+            if elapsed is None:
+                return None
+            return self.plan.time_remaining(elapsed)
+
+    def _elapsed(self):
+        """Must be called with _lock held."""
+        if self.plan is None:
+            return None
+        if self._paused is not None:
+            return self._paused
+        return self.clock.monotonic() - self._start
+
+    def _cancel_timer(self):
+        """Must be called with _lock held."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _advance(self):
+        """
+        Enters the segment in force, if it changed, and schedules the next one.
+        Must be called with _lock held.
+        """
+        self._timer = None
+        plan = self.plan
+        elapsed = self._elapsed()
+        index = plan.index_at(elapsed)
+        if index >= 0 and index != self.index:
+            self._enter(index, plan.time_remaining(elapsed))
+        if self._paused is not None or index + 1 >= len(plan):
+            return
+        if self.scheduler is None:
+            self.scheduler = Scheduler(self.clock)
+            self.scheduler.start()
+            self._owns_scheduler = True
+        self._timer = self.scheduler.call_at(self._start + plan[index + 1].offset, self._fire, self._run)
+
+    def _enter(self, index, remaining):
+        """Enters a segment: hands it to on_segment. Must be called with _lock held."""
+        self.index = index
+        try:
+            self.on_segment(index, self.plan[index], remaining)
+        except Exception as e:
+            logger.error(f"Error entering segment {index}: {e}")
+
+    def _fire(self, run):
+        """Scheduler callback: enters the next segment."""
+        with self._lock:
+            if run == self._run and self.plan is not None:
+                self._advance()
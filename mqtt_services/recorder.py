@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+recorder.py
+
+This module implements a Recorder agent that streams every message on the APP_ID
+topics into an append-only columnar recording, and a replay tool that republishes a
+recording at its original pace or N times faster.
+
+A recording is a directory holding one file per column, each a flat little-endian
+array that only ever grows, so it can be read back with numpy.memmap without loading
+it into memory:
+    time         float64  message time (the payload's wall-clock stamp; arrival for a
+                          retained message or one without a stamp)
+    seq          uint32   message number; the rows of one message share it
+    topic        uint16   index into index.json "topics"
+    trainer      uint16   index into index.json "trainers", NO_TRAINER if none
+    power        float32  measured_power or target_power, NaN if absent
+    cadence      float32  measured_cadence or target_cadence, NaN if absent
+    percent_ftp  float32  NaN if absent
+    payload      int64    offset in payloads.bin of the message's raw payload
+
+A telemetry frame becomes one row per trainer; a frame without trainers, and any
+message without values, is one row with NO_TRAINER and NaN values, so every message
+has at least one row. Every message's raw payload is kept in payloads.bin, which is
+what the replay republishes, so no field is lost (segment indices, traces, plan
+versions...); the value columns are for analysis. index.json maps topic and trainer
+ids to names and remembers which payload key each value column came from. A recorder
+that dies mid-write leaves columns of unequal length; readers use the shortest.
+
+A retained message is delivered when the recorder subscribes, possibly long after it
+was stamped, and a recording appended to spans the gap between its sessions, so the
+replay never waits longer than MAX_REPLAY_GAP between two messages.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from . import clock
+from .codec import JSON_CODEC, decode_payload
+from .constants import APP_ID, hostname
+
+# Configure logging.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("Recorder")
+
+COLUMNS = (
+    ("time", np.float64),
+    ("seq", np.uint32),
+    ("topic", np.uint16),
+    ("trainer", np.uint16),
+    ("power", np.float32),
+    ("cadence", np.float32),
+    ("percent_ftp", np.float32),
+    ("payload", np.int64),
+)
+NO_TRAINER = 0xFFFF
+
+# Longest wait in seconds between two replayed messages, before dividing by the speed.
+MAX_REPLAY_GAP = 10.0
+
+# Payload keys stored in each value column.
+VALUE_KEYS = {
+    "power": ("measured_power", "target_power"),
+    "cadence": ("measured_cadence", "target_cadence"),
+    "percent_ftp": ("percent_ftp",),
+}
+
+
+class Recorder:
+    def __init__(self, mqtt_client, directory, flush_rows=1024, flush_interval=1.0):
+        """
+        Initializes the Recorder and starts recording.
+
+        Parameters:
+            mqtt_client (mqtt.Client): The MQTT client to record from.
+            directory (str): The recording directory; created if needed, appended to if it exists.
+            flush_rows (int, optional): Buffered rows that trigger a write to the column files.
+            flush_interval (float, optional): Longest time in seconds rows stay buffered.
+        """
+        self.client = mqtt_client
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(self.__class__.__name__)
+        os.makedirs(directory, exist_ok=True)
+
+        self.index = _load_index(directory)
+        self._topic_ids = {topic["name"]: i for i, topic in enumerate(self.index["topics"])}
+        self._trainer_ids = {name: i for i, name in enumerate(self.index["trainers"])}
+        # Appending to an existing recording continues its message numbering.
+        existing = open_recording(directory)
+        self._seq = int(existing.seq[-1]) + 1 if len(existing) else 0
+        self._rows = {name: [] for name, _ in COLUMNS}
+        self._files = {name: open(os.path.join(directory, f"{name}.bin"), "ab") for name, _ in COLUMNS}
+        self._payloads = open(os.path.join(directory, "payloads.bin"), "ab")
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        self.subscription = f"{APP_ID}/#"
+        self.client.message_callback_add(self.subscription, self._handle_message)
+        self.client.subscribe(self.subscription)
+        self.client.loop_start()
+        self.logger.info(f"Recording {self.subscription} to {directory}.")
+
+    def close(self):
+        """Stops recording and flushes everything to disk."""
+        self.client.message_callback_remove(self.subscription)
+        self.client.unsubscribe(self.subscription)
+        with self._lock:
+            self._flush()
+            for f in self._files.values():
+                f.close()
+            self._payloads.close()
+        self.logger.info(f"Closed recording {self.directory}.")
+
+    def _handle_message(self, client, userdata, msg):
+        """Appends one message to the recording."""
+        try:
+            # An empty payload clears a retained message; it is recorded too.
+            payload = decode_payload(msg.payload) if msg.payload else {}
+            with self._lock:
+                self._record(msg.topic, payload, msg.payload, msg.retain)
+                if (len(self._rows["seq"]) >= self.flush_rows
+                        or time.monotonic() - self._last_flush >= self.flush_interval):
+                    self._flush()
+        except Exception as e:
+            self.logger.error(f"Error recording message on {msg.topic}: {e}")
+
+    def _record(self, topic, payload, raw, retain=False):
+        """
+        Turns a message into rows. Must be called with the lock held. A retained message
+        carries the stamp of its original publication, so it is timed on arrival.
+        """
+        name = topic[len(APP_ID) + 1:] if topic.startswith(APP_ID + "/") else topic
+        keys = {column: next((k for k in candidates if k in payload), None)
+                for column, candidates in VALUE_KEYS.items()}
+        topic_id = self._topic_id(name, keys, payload)
+        spec = self.index["topics"][topic_id]
+        stamp = payload.get("time")
+        t = stamp if isinstance(stamp, (int, float)) and not retain else clock.now().wall
+        seq = self._seq
+        self._seq += 1
+
+        values = {column: payload.get(spec["keys"].get(column)) for column in VALUE_KEYS}
+        uuid_trainer = payload.get("uuid_trainer")
+        if spec["trainer_in_topic"]:
+            uuid_trainer = name.split("/")[1]
+        if spec["frame"]:
+            trainers = uuid_trainer or []
+            columns = [values[column] or [] for column in ("power", "cadence", "percent_ftp")]
+        else:
+            trainers = [uuid_trainer]
+            columns = [[values["power"]], [values["cadence"]], [values["percent_ftp"]]]
+        if not trainers:
+            trainers = [None]
+
+        offset = self._payloads.tell()
+        self._payloads.write(len(raw).to_bytes(4, "little") + raw)
+
+        rows = self._rows
+        for i, trainer in enumerate(trainers):
+            rows["time"].append(t)
+            rows["seq"].append(seq)
+            rows["topic"].append(topic_id)
+            rows["trainer"].append(NO_TRAINER if not isinstance(trainer, str) else self._trainer_id(trainer))
+            for column, values_ in zip(("power", "cadence", "percent_ftp"), columns):
+                value = values_[i] if i < len(values_) else None
+                rows[column].append(np.nan if value is None else value)
+            rows["payload"].append(offset)
+
+    def _topic_id(self, name, keys, payload):
+        topic_id = self._topic_ids.get(name)
+        if topic_id is None:
+            parts = name.split("/")
+            topic_id = self._topic_ids[name] = len(self.index["topics"])
+            self.index["topics"].append({
+                "name": name,
+                "keys": {column: key for column, key in keys.items() if key is not None},
+                "frame": isinstance(payload.get("uuid_trainer"), list),
+                "trainer_in_topic": len(parts) == 3 and parts[0] == "trainer",
+            })
+            self._save_index()
+        return topic_id
+
+    def _trainer_id(self, uuid_trainer):
+        trainer_id = self._trainer_ids.get(uuid_trainer)
+        if trainer_id is None:
+            trainer_id = self._trainer_ids[uuid_trainer] = len(self.index["trainers"])
+            self.index["trainers"].append(uuid_trainer)
+            self._save_index()
+        return trainer_id
+
+    def _save_index(self):
+        # Write-then-rename, so a reader never sees a half-written index.
+        path = os.path.join(self.directory, "index.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(path + ".tmp", path)
+
+    def _flush(self):
+        """Appends the buffered rows to the column files. Must be called with the lock held."""
+        self._payloads.flush()
+        for name, dtype in COLUMNS:
+            column = self._rows[name]
+            if column:
+                self._files[name].write(np.asarray(column, dtype=dtype).tobytes())
+                self._files[name].flush()
+                column.clear()
+        self._last_flush = time.monotonic()
+
+
+def _load_index(directory):
+    path = os.path.join(directory, "index.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"columns": {name: np.dtype(dtype).str for name, dtype in COLUMNS}, "topics": [], "trainers": []}
+
+
+def _row_count(directory):
+    sizes = []
+    for name, dtype in COLUMNS:
+        path = os.path.join(directory, f"{name}.bin")
+        sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+    return min(sizes)
+
+
+class Recording:
+    """
+    A recording opened for reading. Each column is a numpy.memmap attribute
+    (time, seq, topic, ...), so only the pages that are touched are read from disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = _load_index(directory)
+        self.topics = [topic["name"] for topic in self.index["topics"]]
+        self.trainers = list(self.index["trainers"])
+        self.rows = _row_count(directory)
+        for name, dtype in COLUMNS:
+            if self.rows:
+                column = np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r",
+                                   shape=(self.rows,))
+            else:
+                column = np.empty(0, dtype=dtype)
+            setattr(self, name, column)
+
+    def __len__(self):
+        return self.rows
+
+    def topic_rows(self, topic):
+        """Returns a boolean mask of the rows recorded on a topic (name relative to APP_ID)."""
+        return self.topic == self.topics.index(topic)
+
+    def trainer_series(self, topic="set_measured_power", start=None):
+        """
+        Returns the power and cadence recorded on a topic, per trainer.
+
+        Parameters:
+            topic (str, optional): Topic name relative to APP_ID.
+            start (float, optional): Subtracted from the times, e.g. the plan's start time.
+
+        Returns:
+            dict: key: uuid_trainer, value: (times, power, cadence); the input of
+                  analytics.analyze_session().
+        """
+        if topic not in self.topics:
+            return {}
+        mask = self.topic_rows(topic)
+        times = np.asarray(self.time[mask])
+        if start is not None:
+            times = times - start
+        trainer = np.asarray(self.trainer[mask])
+        power = np.asarray(self.power[mask])
+        cadence = np.asarray(self.cadence[mask])
+        series = {}
+        for trainer_id in np.unique(trainer):
+            if trainer_id == NO_TRAINER:
+                continue
+            rows = trainer == trainer_id
+            series[self.trainers[trainer_id]] = (times[rows], power[rows], cadence[rows])
+        return series
+
+    def raw_payload(self, offset):
+        """Returns the raw payload stored at an offset of payloads.bin."""
+        with open(os.path.join(self.directory, "payloads.bin"), "rb") as f:
+            f.seek(offset)
+            size = int.from_bytes(f.read(4), "little")
+            return f.read(size)
+
+    def messages(self):
+        """
+        Yields the recorded messages in order as (time, topic, payload dict), the payload
+        decoded from the raw payload (stamps excluded), or None for an empty payload.
+        """
+        # A message starts at the rows where seq changes.
+        starts = np.flatnonzero(np.diff(np.asarray(self.seq), prepend=np.int64(-1)) != 0) if self.rows else []
+        specs = self.index["topics"]
+        for start in starts:
+            spec = specs[self.topic[start]]
+            raw = self.raw_payload(int(self.payload[start]))
+            payload = decode_payload(raw) if raw else None
+            if payload is not None:
+                payload.pop("time", None)
+                payload.pop("mono", None)
+            yield float(self.time[start]), spec["name"], payload
+
+
+def open_recording(directory):
+    """Opens a recording directory for reading."""
+    return Recording(directory)
+
+
+def replay(recording, client, speed=1.0, clock_=None, stop_event=None):
+    """
+    Republishes a recording with the original gaps between messages divided by speed.
+
+    Messages are re-stamped with the current time and published as JSON on the same
+    topics; an empty payload is republished empty. Each gap is clamped to between 0 and
+    MAX_REPLAY_GAP, so out-of-order stamps and idle stretches (a retained message's age,
+    the time between appended sessions) are not waited out. Send times are deadlines
+    from the replay start, so publish cost does not accumulate as drift.
+
+    Parameters:
+        recording (Recording or str): The recording or its directory.
+        client (mqtt.Client): The client to publish with.
+        speed (float, optional): Replay speed; 0 publishes as fast as possible.
+        clock_ (clock.SystemClock, optional): Clock the deadlines refer to.
+        stop_event (threading.Event, optional): Set to end the replay early.
+
+    Returns:
+        int: The number of messages published.
+    """
+    if isinstance(recording, str):
+        recording = open_recording(recording)
+    clock_ = clock.SYSTEM_CLOCK if clock_ is None else clock_
+    stop_event = threading.Event() if stop_event is None else stop_event
+    condition = threading.Condition()
+    start = clock_.monotonic()
+    previous = None
+    offset = 0.0
+    count = 0
+    for t, topic, payload in recording.messages():
+        if previous is not None:
+            offset += min(max(t - previous, 0.0), MAX_REPLAY_GAP)
+        previous = t
+        if speed > 0:
+            deadline = start + offset / speed
+            with condition:
+                while not stop_event.is_set():
+                    remaining = deadline - clock_.monotonic()
+                    if remaining <= 0:
+                        break
+                    clock_.wait(condition, min(remaining, 0.1))
+        if stop_event.is_set():
+            break
+        if payload is None:
+            data = b""
+        else:
+            stamp = clock.now()
+            payload["time"] = stamp.wall
+            payload["mono"] = stamp.mono
+            data = JSON_CODEC.encode(payload)
+        result = client.publish(f"{APP_ID}/{topic}", data)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error(f"Failed to replay message to {topic}: {mqtt.error_string(result.rc)}")
+        count += 1
+    logger.info(f"Replayed {count} messages from {recording.directory}.")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay the APP_ID topics.")
+    parser.add_argument("command", choices=("record", "replay"))
+    parser.add_argument("directory", help="Recording directory.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed; 0 for as fast as possible.")
+    parser.add_argument("--host", default=hostname, help="MQTT broker host.")
+    args = parser.parse_args()
+
+    client = mqtt.Client(
+        client_id="",
+        protocol=mqtt.MQTTv311,
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2
+    )
+    client.connect(args.host)
+    client.loop_start()
+    try:
+        if args.command == "record":
+            recorder = Recorder(client, args.directory)
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                recorder.close()
+        else:
+            replay(args.directory, client, args.speed)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
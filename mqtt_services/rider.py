@@ -12,14 +12,22 @@ The Rider class generates the following MQTT messages:
 It handles the following incoming MQTT messages:
     - device_list
     - send_plan
+    - plan_version (a rider only asks for the plan when the announced version is not the one it holds)
     - start_plan
     - stop_plan
+    - set_segment
     - set_target_power
     - measured_power
+    - measured_telemetry
+
+A start_plan carrying the plan's start time runs the held plan locally (see plan_runner.py):
+the rider works out the segment in force and its countdown on its own clock, so segment changes
+need no broadcast and are not delayed by the broker. start_plan is retained, so a rider joining
+mid-plan starts at the segment in force. set_segment and set_target_power from the coach override
+the targets until the next segment; stop_plan ends the plan.
 """
 
 import time
-import json
 import logging
 
 import paho.mqtt.client as mqtt
@@ -37,7 +45,16 @@ from .messaging import (
     StopPlan,
     SetTargetPower,
     SetMeasuredPower,
+    subscribe_callbacks,
+    unsubscribe_callbacks,
+    trainer_topic,
 )
+from .clock import SYSTEM_CLOCK
+from .codec import decode_payload
+from .plan_runner import PlanRunner
+from .timesync import ClockSync
+from .tracing import TraceRecorder
+from . import logs
 from .constants import APP_ID, hostname
 
 # Configure logging.
@@ -46,78 +63,174 @@ logger = logging.getLogger("Rider")
 
 
 class Rider:
-    def __init__(self, mqtt_client):
+    def __init__(self, mqtt_client, clock=None, scheduler=None, clock_sync=False, session=None):
         """
         Initializes the Rider.
 
         Parameters:
             mqtt_client (mqtt.Client): An instance of the MQTT client to use.
+            clock (clock.SystemClock, optional): The clock a locally run plan is timed on.
+                Tests and simulations can pass a virtual clock.
+            scheduler (scheduler.Scheduler, optional): Timer scheduler that fires the segments of a
+                locally run plan. If None, one is started with the first plan.
+            clock_sync (bool, optional): Sync this process's wall clock to the coach's (see
+                timesync.py), so a locally run plan starts when the coach's does.
+            session (str, optional): Join the class of a coach run with this session (see
+                Coach): plan topics are under APP_ID/session/<session>/. Device and telemetry
+                topics stay shared.
         """
         self.client = mqtt_client
+        self.session = session
+        if clock is None:
+            clock = SYSTEM_CLOCK if scheduler is None else scheduler.clock
+        self.clock = clock
         self.logger = logging.getLogger(self.__class__.__name__)
 
         # Create messaging objects for outgoing commands.
         self.list_devices_msg = ListDevices(self.client)
         self.pair_device_msg = PairDevice(self.client)
-        self.get_plan_msg = GetPlan(self.client)
+        self.get_plan_msg = GetPlan(self.client, session=session)
         self.set_ftp_msg = SetFTP(self.client)
 
+        # The training plan and its version (see plan.plan_version), once received.
+        self.plan = None
+        self.plan_version = None
+
+        # The segment in force and its (target_power, target_cadence), from the locally run plan
+        # or the coach's overrides; None when no plan is running.
+        self.segment = None
+        self.targets = None
+        # Runs the plan locally, timed on self.clock.
+        self.runner = PlanRunner(self._enter_local_segment, clock=self.clock, scheduler=scheduler)
+        # A start_plan received before its plan: run once the plan arrives.
+        self._pending_start = None
+
+        # Trainer followed on its per-trainer topics, if any.
+        self.followed_trainer = None
+        self._trainer_callbacks = {}
+
+        # Per-hop latency histograms of traced target power changes, from the coach's command
+        # to this dashboard receiving the telemetry that reflects it.
+        self.traces = TraceRecorder()
+
         # Register callbacks for incoming responses.
         self._register_response_callbacks()
 
+        self.clock_sync = None
+        if clock_sync:
+            self.clock_sync = ClockSync(self.client)
+            self.clock_sync.start()
+
+    def close(self):
+        """Stops any locally run plan and the clock sync, and removes the rider's subscriptions."""
+        self.stop_local_plan()
+        self.runner.close()
+        if self.clock_sync is not None:
+            self.clock_sync.close()
+            self.clock_sync = None
+        if self.followed_trainer is not None:
+            unsubscribe_callbacks(self.client, self._trainer_callbacks, self.logger)
+            self.followed_trainer = None
+            self._trainer_callbacks = {}
+        else:
+            unsubscribe_callbacks(self.client, self.telemetry_callbacks, self.logger)
+        unsubscribe_callbacks(self.client, self.callbacks, self.logger)
+        unsubscribe_callbacks(self.client, self.session_callbacks, self.logger, session=self.session)
+
     def _register_response_callbacks(self):
         """
         Registers MQTT callbacks for incoming messages:
             - device_list: Response to list_devices.
-            - send_plan: The training plan sent by the coach.
-            - start_plan: Notification that the training plan has started.
+            - send_plan: The training plan sent by the coach (retained).
+            - plan_version: The version of the coach's current plan (retained).
+            - start_plan: The training plan's start time (retained); the rider runs the plan locally.
             - stop_plan: Notification that the training plan has stopped.
-            - set_target_power: Broadcast target power from the coach.
+            - set_segment: Target power and cadence of a plan segment, overriding the local plan.
+            - set_target_power: Broadcast target power from the coach, overriding the local plan.
             - measured_power: Measured power reports from a trainer.
+            - measured_telemetry: Batched power/cadence frames from a bridge.
+        Only these topics are subscribed to. The plan topics are scoped to the rider's session;
+        the device and telemetry topics are shared. The shared telemetry topics are dropped
+        while a trainer is followed on its own topics (see follow_trainer).
         """
-        subscribe_topic = f"{APP_ID}/#"
-        result, mid = self.client.subscribe(subscribe_topic)
-        if result != mqtt.MQTT_ERR_SUCCESS:
-            logger.error(f"Failed to subscribe to topic {subscribe_topic}: {mqtt.error_string(result)}")
-        else:
-            logger.info(f"Subscribed to topic {subscribe_topic}")
-        
-        topics = {
+        self.callbacks = {
             "device_list": self._handle_device_list,
+        }
+        self.telemetry_callbacks = {
+            "set_measured_power": self._handle_measured_power,
+            "set_measured_telemetry": self._handle_measured_telemetry,
+        }
+        self.session_callbacks = {
+            # send_plan comes before plan_version, so a broker delivers the retained plan first
+            # and the version announcement that follows finds it up to date.
             "send_plan": self._handle_send_plan,
+            "plan_version": self._handle_plan_version,
             "start_plan": self._handle_start_plan,
             "stop_plan": self._handle_stop_plan,
+            "set_segment": self._handle_set_segment,
             "set_target_power": self._handle_set_target_power,
-            "set_measured_power": self._handle_measured_power,
         }
-
-        for topic_suffix, callback in topics.items():
-            topic = f"{APP_ID}/{topic_suffix}"
-            self.client.message_callback_add(topic, callback)
-            self.logger.info(f"Rider registered callback for topic: {topic}")
+        subscribe_callbacks(self.client, self.callbacks, self.logger)
+        subscribe_callbacks(self.client, self.telemetry_callbacks, self.logger)
+        subscribe_callbacks(self.client, self.session_callbacks, self.logger, session=self.session)
+        topics = list(self.callbacks) + list(self.telemetry_callbacks) + list(self.session_callbacks)
+        self.logger.info(f"Rider registered callbacks for topics: {', '.join(topics)}")
         self.client.loop_start()
 
+    def follow_trainer(self, uuid_trainer):
+        """
+        Subscribes to the per-trainer topics (APP_ID/trainer/<uuid>/...) of one trainer,
+        replacing any trainer followed before. Needs a bridge started with per_trainer_topics=True.
+        While a trainer is followed, the shared set_measured_power and set_measured_telemetry
+        topics, which carry every trainer, are unsubscribed; they are subscribed again when
+        following stops.
+
+        Parameters:
+            uuid_trainer (str): The trainer's unique identifier, or None to stop following.
+        """
+        following = self.followed_trainer is not None
+        if following:
+            unsubscribe_callbacks(self.client, self._trainer_callbacks, self.logger)
+        self.followed_trainer = uuid_trainer
+        self._trainer_callbacks = {}
+        if uuid_trainer is not None:
+            self._trainer_callbacks = {
+                trainer_topic(uuid_trainer, "power"): self._handle_trainer_power,
+                trainer_topic(uuid_trainer, "cadence"): self._handle_trainer_cadence,
+            }
+            subscribe_callbacks(self.client, self._trainer_callbacks, self.logger)
+            if not following:
+                unsubscribe_callbacks(self.client, self.telemetry_callbacks, self.logger)
+        elif following:
+            subscribe_callbacks(self.client, self.telemetry_callbacks, self.logger)
+
     # ----- Methods to generate outgoing messages -----
     def request_device_list(self):
         """Sends a ListDevices message to request the list of available devices."""
         self.logger.info("Rider: Requesting device list.")
         self.list_devices_msg.publish()
 
-    def pair_device(self, uuid_trainer, uuid_rider):
+    def pair_device(self, uuid_trainer, uuid_rider, follow=False):
         """
         Sends a PairDevice message to request pairing between a trainer and a rider.
         
         Parameters:
             uuid_trainer (str): The trainer's unique identifier.
             uuid_rider (str): The rider's unique identifier.
+            follow (bool, optional): Also follow the trainer on its per-trainer topics.
         """
         self.logger.info(f"Rider: Requesting pairing of trainer {uuid_trainer} with rider {uuid_rider}.")
         self.pair_device_msg.publish(uuid_trainer=uuid_trainer, uuid_rider=uuid_rider)
+        if follow:
+            self.follow_trainer(uuid_trainer)
 
     def request_training_plan(self):
-        """Sends a GetPlan message to request a training plan."""
+        """
+        Sends a GetPlan message to request a training plan, with the version already held,
+        so the coach does not send a plan the rider has.
+        """
         self.logger.info("Rider: Requesting training plan.")
-        self.get_plan_msg.publish()
+        self.get_plan_msg.publish(version=self.plan_version)
 
     def set_ftp(self, uuid_trainer, ftp):
         """
@@ -130,11 +243,50 @@ class Rider:
         self.logger.info(f"Rider: Setting FTP for trainer {uuid_trainer} to {ftp}.")
         self.set_ftp_msg.publish(uuid_trainer=uuid_trainer, ftp=ftp)
 
+    # ----- Local plan execution -----
+    def start_local_plan(self, start_time, elapsed=None):
+        """
+        Runs the held plan locally from the coach's start time (see plan_runner.PlanRunner).
+        The segment in force is entered at once, so a rider joining late starts mid-plan.
+
+        Parameters:
+            start_time (float): Wall clock time (epoch seconds) of the plan's offset 0.
+            elapsed (float, optional): The running time the plan is paused at, if it is paused.
+
+        Raises:
+            plan.PlanError: If the held plan does not compile.
+        """
+        self.runner.start(self.plan, start_time, elapsed)
+        state = "paused at" if elapsed is not None else "at"
+        self.logger.info(f"Rider: Running training plan version {self.plan_version} locally, "
+                         f"{state} {self.plan_elapsed():.1f}s.")
+
+    def stop_local_plan(self):
+        """Stops the locally run plan and clears the targets."""
+        self.runner.stop()
+        self.segment = None
+        self.targets = None
+
+    def plan_elapsed(self):
+        """Returns the running time of the locally run plan in seconds, or None if none is running."""
+        return self.runner.elapsed()
+
+    def countdown(self):
+        """Returns the seconds left in the current segment of the locally run plan, or None."""
+        return self.runner.countdown()
+
+    def _enter_local_segment(self, index, segment, remaining):
+        """PlanRunner callback: the locally run plan entered a segment."""
+        self.segment = index
+        self.targets = (segment.power, segment.cadence)
+        self.logger.info(f"Rider: Segment {index} '{segment.description}': target power {segment.power}%, "
+                         f"cadence {segment.cadence} RPM for {remaining:.0f}s.")
+
     # ----- Callback Handlers for incoming messages -----
     def _handle_device_list(self, client, userdata, msg):
         """Handles an incoming DeviceList message."""
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
             devices = payload.get("device_list", [])
             self.logger.info(f"Rider received device list: {devices}")
         except Exception as e:
@@ -142,26 +294,90 @@ class Rider:
 
     def _handle_send_plan(self, client, userdata, msg):
         """Handles an incoming SendPlan message containing the training plan."""
+        if not msg.payload:
+            return  # The coach withdrew its retained plan.
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
+            version = payload.get("version")
+            if version is not None and version == self.plan_version:
+                self.logger.debug(f"Rider already holds training plan version {version}.")
+                return
             self.plan = payload.get("training_plan", [])
-            self.logger.info(f"Rider received training plan: {self.plan}")
+            self.plan_version = version
+            self.logger.info(f"Rider received training plan version {version}: {self.plan}")
+            pending, self._pending_start = self._pending_start, None
+            if pending is not None and pending.get("version") in (None, version):
+                self.start_local_plan(pending["start_time"], pending.get("elapsed"))
         except Exception as e:
             self.logger.error(f"Error processing training plan: {e}\n    msg:{msg}\n    userdata:{userdata}")
 
+    def _handle_plan_version(self, client, userdata, msg):
+        """Handles a PlanVersion announcement: requests the plan if it is not the one held."""
+        if not msg.payload:
+            return
+        try:
+            version = decode_payload(msg.payload).get("version")
+            if version != self.plan_version:
+                self.logger.info(f"Rider holds plan version {self.plan_version}, coach announced {version}.")
+                self.request_training_plan()
+        except Exception as e:
+            self.logger.error(f"Error processing plan version: {e}")
+
     def _handle_start_plan(self, client, userdata, msg):
-        """Handles an incoming StartPlan message indicating the training plan has started."""
-        self.logger.info("Rider received start_plan message.")
+        """
+        Handles an incoming StartPlan message indicating the training plan has started (or was
+        paused or resumed). With a start time, the plan is run locally; a plan the rider does
+        not hold yet is requested, and run when it arrives.
+        """
+        if not msg.payload:
+            return  # The coach cleared its retained start_plan.
+        try:
+            payload = decode_payload(msg.payload)
+            start_time = payload.get("start_time")
+            if start_time is None:
+                self.logger.info("Rider received start_plan message.")
+                return
+            version = payload.get("version")
+            if self.plan is None or (version is not None and version != self.plan_version):
+                self.logger.info(f"Rider received start_plan for plan version {version}, which it does not hold.")
+                self._pending_start = payload
+                self.request_training_plan()
+                return
+            self._pending_start = None
+            self.start_local_plan(start_time, payload.get("elapsed"))
+        except Exception as e:
+            self.logger.error(f"Error processing start_plan message: {e}")
 
     def _handle_stop_plan(self, client, userdata, msg):
         """Handles an incoming StopPlan message indicating the training plan has stopped."""
         self.logger.info("Rider received stop_plan message.")
+        self._pending_start = None
+        self.stop_local_plan()
+
+    def _handle_set_segment(self, client, userdata, msg):
+        """
+        Handles an incoming SetSegment message broadcasting a plan segment's targets.
+        They are in force until the locally run plan enters its next segment.
+        """
+        try:
+            payload = decode_payload(msg.payload)
+            self.segment = payload.get("segment")
+            self.targets = (payload.get("target_power"), payload.get("target_cadence"))
+            self.logger.info(f"Rider received segment {payload.get('segment')}: target power "
+                             f"{payload.get('target_power')}%, cadence {payload.get('target_cadence')} RPM")
+        except Exception as e:
+            self.logger.error(f"Error processing set_segment message: {e}")
 
     def _handle_set_target_power(self, client, userdata, msg):
-        """Handles an incoming SetTargetPower message broadcasting target power."""
+        """
+        Handles an incoming SetTargetPower message broadcasting target power.
+        It overrides the target power until the locally run plan enters its next segment.
+        """
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
             target_power = payload.get("target_power")
+            targets = self.targets
+            self.targets = (target_power, targets[1] if targets is not None else None)
             self.logger.info(f"Rider received broadcast target power: {target_power}%")
         except Exception as e:
             self.logger.error(f"Error processing set_target_power message: {e}")
@@ -169,11 +385,49 @@ class Rider:
     def _handle_measured_power(self, client, userdata, msg):
         """Handles an incoming MeasuredPower message with measured power information."""
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = decode_payload(msg.payload)
+            trace = self.traces.receive(payload, "rider.receive")
             uuid_trainer = payload.get("uuid_trainer")
             measured_power = payload.get("measured_power")
-            self.logger.info(f"Rider received measured power from trainer {uuid_trainer}: {measured_power} watts")
+            logs.hot(self.logger, msg.topic, "Rider received measured power from trainer %s: %s watts",
+                     uuid_trainer, measured_power)
+            self.traces.finish(trace, "rider.handled")
         except Exception as e:
             self.logger.error(f"Error processing measured power message: {e}")
 
+    def _handle_measured_telemetry(self, client, userdata, msg):
+        """Handles an incoming MeasuredTelemetry frame holding readings for every trainer on a bridge."""
+        try:
+            payload = decode_payload(msg.payload)
+            trace = self.traces.receive(payload, "rider.receive")
+            frame = zip(
+                payload.get("uuid_trainer", []),
+                payload.get("measured_power", []),
+                payload.get("measured_cadence", []),
+            )
+            for uuid_trainer, measured_power, measured_cadence in frame:
+                self.logger.debug("Rider received telemetry from trainer %s: %s watts, %s RPM",
+                                  uuid_trainer, measured_power, measured_cadence)
+            self.traces.finish(trace, "rider.handled")
+        except Exception as e:
+            self.logger.error(f"Error processing measured telemetry message: {e}")
 
+    def _handle_trainer_power(self, client, userdata, msg):
+        """Handles a per-trainer power message from the followed trainer."""
+        try:
+            payload = decode_payload(msg.payload)
+            measured_power = payload.get("measured_power")
+            logs.hot(self.logger, msg.topic, "Rider received power from followed trainer %s: %s watts",
+                     self.followed_trainer, measured_power)
+        except Exception as e:
+            self.logger.error(f"Error processing trainer power message: {e}")
+
+    def _handle_trainer_cadence(self, client, userdata, msg):
+        """Handles a per-trainer cadence message from the followed trainer."""
+        try:
+            payload = decode_payload(msg.payload)
+            measured_cadence = payload.get("measured_cadence")
+            logs.hot(self.logger, msg.topic, "Rider received cadence from followed trainer %s: %s RPM",
+                     self.followed_trainer, measured_cadence)
+        except Exception as e:
+            self.logger.error(f"Error processing trainer cadence message: {e}")
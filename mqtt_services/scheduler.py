@@ -0,0 +1,144 @@
+'''
+Begin scheduler.py
+
+A heap-based timer scheduler shared by many coaching sessions.
+
+Instead of one thread per running plan, every session schedules its segment
+deadlines on one Scheduler.  A single thread sleeps until the earliest
+deadline, runs whatever is due and goes back to sleep, so the cost of a class
+is a few heap entries rather than a thread.  Deadlines are absolute times on
+the scheduler's clock (see clock.SystemClock), which keeps them drift free.
+'''
+import heapq
+import itertools
+import logging
+import threading
+
+from .clock import SYSTEM_CLOCK
+
+logger = logging.getLogger("Scheduler")
+
+
+class Timer:
+    """A scheduled callback. Returned by Scheduler.call_at(); cancel() removes it."""
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancels the timer. Cancelled timers are dropped lazily when they reach the top of the heap."""
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self, clock=None):
+        """
+        Initializes the Scheduler.
+
+        Parameters:
+            clock (clock.SystemClock, optional): The clock deadlines refer to.
+        """
+        self.clock = SYSTEM_CLOCK if clock is None else clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Schedules callback(*args) at an absolute deadline on the scheduler's monotonic clock.
+
+        Returns:
+            Timer: A handle whose cancel() method unschedules the call.
+        """
+        timer = Timer(deadline, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._seq), timer))
+            # Only the earliest deadline can change how long the loop should sleep.
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+                self.clock.notified(self._cond)
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Schedules callback(*args) delay seconds from now."""
+        return self.call_at(self.clock.monotonic() + delay, callback, *args)
+
+    def _pop_due(self):
+        """Pops the timers that are due. Must be called with the lock held."""
+        now = self.clock.monotonic()
+        due = []
+        heap = self._heap
+        while heap and (heap[0][2].cancelled or heap[0][0] <= now):
+            timer = heapq.heappop(heap)[2]
+            if not timer.cancelled:
+                due.append(timer)
+        return due
+
+    def _next_deadline(self):
+        """Returns the earliest live deadline, or None. Must be called with the lock held."""
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def run_pending(self):
+        """
+        Runs every timer that is due, in deadline order, in the calling thread.
+
+        Returns:
+            float or None: The next deadline still pending, or None if nothing is scheduled.
+        """
+        with self._cond:
+            due = self._pop_due()
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Error in scheduled callback {timer.callback}: {e}")
+        with self._cond:
+            return self._next_deadline()
+
+    def start(self):
+        """Starts the scheduler thread."""
+        with self._cond:
+            if self._running:
+                logger.warning("Scheduler is already running.")
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="Scheduler", daemon=True)
+        self._thread.start()
+        self.clock.started(self._thread)
+
+    def stop(self):
+        """Stops the scheduler thread; pending timers stay scheduled."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            self.clock.notified(self._cond)
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                deadline = self._next_deadline()
+                if deadline is None:
+                    self.clock.wait(self._cond, None)
+                    continue
+                remaining = deadline - self.clock.monotonic()
+                if remaining > 0:
+                    self.clock.wait(self._cond, remaining)
+                    continue
+            self.run_pending()
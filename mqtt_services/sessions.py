@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+sessions.py
+
+This module implements a SessionManager that runs many concurrent classes from one
+MQTT client. Each session is a Coach with its own training plan, pairings and start
+time, whose plan topics live under APP_ID/session/<session_id>/.
+
+All sessions share:
+    - one MQTT client (one broker connection),
+    - one Scheduler thread that fires every session's plan segments,
+    - one subscription per shared device/telemetry topic. Incoming measured power and
+      cadence are routed to the session the trainer is paired in, and a batched telemetry
+      frame is split so each session gets the entries of its trainers; device lists go to
+      every session,
+    - one TimeServer answering clock sync requests (see timesync.py).
+"""
+
+import logging
+import threading
+
+from .coach import Coach
+from .codec import decode_payload
+from .messaging import subscribe_callbacks, unsubscribe_callbacks
+from .scheduler import Scheduler
+from .timesync import TimeServer
+
+# Configure logging.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("SessionManager")
+
+# The per-trainer lists of a MeasuredTelemetry frame, aligned by index.
+_FRAME_FIELDS = ("uuid_trainer", "measured_power", "measured_cadence", "percent_ftp")
+
+
+class SessionManager:
+    def __init__(self, mqtt_client, clock=None):
+        """
+        Initializes the SessionManager.
+
+        Parameters:
+            mqtt_client (mqtt.Client): The MQTT client shared by every session.
+            clock (clock.SystemClock, optional): The clock the shared scheduler runs on.
+        """
+        self.client = mqtt_client
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.scheduler = Scheduler(clock)
+        self.sessions = {}  # key: session_id, value: Coach
+        self._trainer_sessions = {}  # routing cache, key: uuid_trainer, value: Coach
+        self._lock = threading.Lock()
+
+        self.callbacks = {
+            "device_list": self._route_to_all,
+            "set_measured_power": self._route_by_trainer,
+            "set_measured_cadence": self._route_by_trainer,
+            "set_measured_telemetry": self._route_frame,
+        }
+        subscribe_callbacks(self.client, self.callbacks, self.logger)
+        self.client.loop_start()
+        self.time_server = TimeServer(self.client)
+
+    def start(self):
+        """Starts the shared scheduler thread."""
+        self.scheduler.start()
+
+    def stop(self):
+        """Stops every running plan and the scheduler thread."""
+        for session_id in list(self.sessions):
+            self.close_session(session_id)
+        self.scheduler.stop()
+        unsubscribe_callbacks(self.client, self.callbacks, self.logger)
+        self.time_server.close()
+
+    # ----- Session lifecycle -----
+    def create_session(self, session_id, training_plan=None):
+        """
+        Creates a session.
+
+        Parameters:
+            session_id (str): Unique identifier, used in the session's topic namespace.
+            training_plan (list of tuples, optional): The session's plan; defaults to Coach's plan.
+
+        Returns:
+            Coach: The session's coach, for pairing devices, setting FTPs and so on.
+        """
+        with self._lock:
+            if session_id in self.sessions:
+                raise ValueError(f"Session already exists: {session_id}")
+            coach = Coach(self.client, training_plan, session=session_id,
+                          scheduler=self.scheduler, subscribe_shared=False)
+            self.sessions[session_id] = coach
+        self.logger.info(f"Created session {session_id}.")
+        return coach
+
+    def get_session(self, session_id):
+        """Returns the Coach of a session."""
+        return self.sessions[session_id]
+
+    def start_session(self, session_id):
+        """Starts the training plan of a session."""
+        self.sessions[session_id].start_plan()
+
+    def stop_session(self, session_id):
+        """Stops the training plan of a session; the session stays open."""
+        self.sessions[session_id].stop_plan()
+
+    def close_session(self, session_id):
+        """Stops a session's plan and removes the session."""
+        with self._lock:
+            coach = self.sessions.pop(session_id, None)
+            self._trainer_sessions = {trainer: owner for trainer, owner in self._trainer_sessions.items()
+                                      if owner is not coach}
+        if coach is not None:
+            coach.close()
+            self.logger.info(f"Closed session {session_id}.")
+
+    def pair_device(self, session_id, uuid_trainer, uuid_rider):
+        """Pairs a trainer with a rider in a session, moving it out of any other session."""
+        with self._lock:
+            for coach in self.sessions.values():
+                coach.pairings.pop(uuid_trainer, None)
+            coach = self.sessions[session_id]
+            self._trainer_sessions[uuid_trainer] = coach
+        coach.pair_device(uuid_trainer, uuid_rider)
+
+    # ----- Routing of shared topics -----
+    def _session_for_trainer(self, uuid_trainer):
+        """Returns the session the trainer is paired in, or None."""
+        coach = self._trainer_sessions.get(uuid_trainer)
+        if coach is not None and uuid_trainer in coach.pairings:
+            return coach
+        # Pairing changed behind our back (e.g. through Coach.pair_device): rescan.
+        with self._lock:
+            for coach in self.sessions.values():
+                if uuid_trainer in coach.pairings:
+                    self._trainer_sessions[uuid_trainer] = coach
+                    return coach
+            self._trainer_sessions.pop(uuid_trainer, None)
+        return None
+
+    def _route_by_trainer(self, client, userdata, msg):
+        """Forwards a per-trainer telemetry message to the session the trainer is paired in."""
+        try:
+            uuid_trainer = decode_payload(msg.payload).get("uuid_trainer")
+        except Exception as e:
+            self.logger.error(f"Error routing message on {msg.topic}: {e}")
+            return
+        coach = self._session_for_trainer(uuid_trainer)
+        if coach is not None:
+            coach.callbacks[msg.topic.rsplit('/', 1)[-1]](client, userdata, msg)
+
+    def _route_frame(self, client, userdata, msg):
+        """
+        Splits a batched telemetry frame by session: each session records the entries of the
+        trainers paired in it. Entries of unpaired trainers are dropped.
+        """
+        try:
+            payload = decode_payload(msg.payload)
+        except Exception as e:
+            self.logger.error(f"Error routing message on {msg.topic}: {e}")
+            return
+        rows = {}  # key: Coach, value: indices of its trainers' entries in the frame
+        for index, uuid_trainer in enumerate(payload.get("uuid_trainer", [])):
+            coach = self._session_for_trainer(uuid_trainer)
+            if coach is not None:
+                rows.setdefault(coach, []).append(index)
+        for coach, indices in rows.items():
+            frame = dict(payload)
+            for field in _FRAME_FIELDS:
+                if field in payload:
+                    frame[field] = [payload[field][index] for index in indices]
+            try:
+                coach.record_telemetry_frame(frame, msg.topic)
+            except Exception as e:
+                self.logger.error(f"Error recording telemetry frame in session {coach.session}: {e}")
+
+    def _route_to_all(self, client, userdata, msg):
+        """Forwards a shared message to every session."""
+        suffix = msg.topic.rsplit('/', 1)[-1]
+        for coach in list(self.sessions.values()):
+            coach.callbacks[suffix](client, userdata, msg)
@@ -0,0 +1,268 @@
+'''
+Begin telemetry.py
+
+A bounded, array-backed store of the telemetry a coach receives.
+
+Each trainer gets a TrainerSeries: preallocated NumPy ring buffers of sample
+time, power, cadence and percent FTP.  Once a buffer is full the oldest
+samples are overwritten, so memory is fixed when the trainer is first seen
+(20 bytes a sample; the default 8192 samples cover over two hours at 1 Hz,
+about 16 MB for 100 trainers).
+
+Rolling averages over the configured windows (3 s, 30 s and 5 min by
+default) are kept as running sums with a start index per window.  Every
+sample enters and leaves each sum once, so appending is amortised O(1) and
+reading an average is O(1).  Averages are sample means over the samples whose
+time lies within the window of the trainer's latest sample.
+
+Time in zone accumulates the time between consecutive samples by where the
+earlier sample was relative to the target power at that moment: below, in or
+above the target +/- a tolerance, in percent FTP.
+'''
+import math
+import threading
+
+import numpy as np
+
+DEFAULT_WINDOWS = (3, 30, 300)
+ZONES = ('below', 'in', 'above')
+
+
+class TrainerSeries:
+    """The ring-buffered time series of one trainer. Not thread safe; TelemetryStore locks around it."""
+
+    def __init__(self, capacity, windows):
+        self.capacity = capacity
+        self.windows = tuple(windows)
+        self.time = np.zeros(capacity, dtype=np.float64)
+        self.power = np.zeros(capacity, dtype=np.float32)
+        self.cadence = np.full(capacity, np.nan, dtype=np.float32)
+        self.percent_ftp = np.full(capacity, np.nan, dtype=np.float32)
+        self.count = 0                       # samples appended since creation
+        self.max_power = 0.0
+        self.last_cadence = math.nan
+        self.zone_time = [0.0, 0.0, 0.0]     # seconds below, in and above the target zone
+        self._zone = None                    # zone index of the latest sample, or None
+        self._starts = [0] * len(self.windows)
+        self._sums = [0.0] * len(self.windows)  # Python floats: float32 sums would drift
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, power, cadence, percent_ftp, zone, max_gap):
+        """
+        Appends one sample.
+
+        Parameters:
+            t (float): Sample time in seconds.
+            power (float): Measured power in watts.
+            cadence (float): Measured cadence in rpm, or NaN.
+            percent_ftp (float): Power as percent of FTP, or NaN.
+            zone (int or None): Index into ZONES of this sample, or None if unknown.
+            max_gap (float): Longest interval credited to time in zone, so gaps in the
+                             data (dropouts, a paused bridge) are not counted.
+        """
+        cap = self.capacity
+        i = self.count
+        if i:
+            dt = t - float(self.time[(i - 1) % cap])
+            if self._zone is not None and dt > 0:
+                self.zone_time[self._zone] += min(dt, max_gap)
+        if i >= cap:
+            # The slot is about to be overwritten: drop its sample from any sum still holding it.
+            evicted = i - cap
+            old_power = float(self.power[evicted % cap])
+            for k, start in enumerate(self._starts):
+                if start == evicted:
+                    self._sums[k] -= old_power
+                    self._starts[k] = start + 1
+        slot = i % cap
+        self.time[slot] = t
+        self.power[slot] = power
+        self.cadence[slot] = cadence
+        self.percent_ftp[slot] = percent_ftp
+        self.count = i + 1
+        self._zone = zone
+        if power > self.max_power:
+            self.max_power = float(power)
+
+        time_ = self.time
+        power_ = self.power
+        for k, window in enumerate(self.windows):
+            total = self._sums[k] + power
+            start = self._starts[k]
+            cutoff = t - window
+            while start < i and time_[start % cap] <= cutoff:
+                total -= float(power_[start % cap])
+                start += 1
+            self._sums[k] = total
+            self._starts[k] = start
+
+    def set_cadence(self, cadence):
+        """Records a cadence reported on its own; it is attached to the latest sample and the next ones."""
+        self.last_cadence = cadence
+        if self.count:
+            self.cadence[(self.count - 1) % self.capacity] = cadence
+
+    def average(self, window):
+        """
+        Returns the mean power over the last window seconds, or None without samples.
+        Configured windows are answered in O(1); others with one vectorised pass.
+        """
+        if not self.count:
+            return None
+        try:
+            k = self.windows.index(window)
+        except ValueError:
+            times, powers = self.arrays()[:2]
+            return float(powers[times > times[-1] - window].mean())
+        return float(self._sums[k] / (self.count - self._starts[k]))
+
+    def arrays(self):
+        """
+        Returns the buffered samples in time order.
+
+        Returns:
+            tuple of np.ndarray: (time, power, cadence, percent_ftp). Views of the ring
+            buffers while they have not wrapped, copies after.
+        """
+        n = len(self)
+        if self.count <= self.capacity:
+            return self.time[:n], self.power[:n], self.cadence[:n], self.percent_ftp[:n]
+        head = self.count % self.capacity
+        order = np.r_[head:self.capacity, 0:head]
+        return self.time[order], self.power[order], self.cadence[order], self.percent_ftp[order]
+
+    def latest(self):
+        """Returns (time, power, cadence, percent_ftp) of the latest sample, or None."""
+        if not self.count:
+            return None
+        slot = (self.count - 1) % self.capacity
+        return (float(self.time[slot]), float(self.power[slot]), float(self.cadence[slot]),
+                float(self.percent_ftp[slot]))
+
+
+class TelemetryStore:
+    def __init__(self, capacity=8192, windows=DEFAULT_WINDOWS, zone_tolerance=5, max_gap=5.0):
+        """
+        Initializes the TelemetryStore.
+
+        Parameters:
+            capacity (int, optional): Samples kept per trainer.
+            windows (tuple, optional): Rolling-average windows in seconds answered in O(1).
+            zone_tolerance (float, optional): Half-width of the target zone, in percent FTP.
+            max_gap (float, optional): Longest interval between two samples credited to time in zone.
+        """
+        self.capacity = capacity
+        self.windows = tuple(windows)
+        self.zone_tolerance = zone_tolerance
+        self.max_gap = max_gap
+        self.target_percent = None
+        self.series = {}  # key: uuid_trainer, value: TrainerSeries
+        self._lock = threading.Lock()
+
+    def set_target(self, target_percent):
+        """Sets the current target power in percent FTP; None (or 0, e.g. at the stop segment) clears it."""
+        self.target_percent = target_percent or None
+
+    def _zone(self, percent_ftp):
+        target = self.target_percent
+        if target is None or math.isnan(percent_ftp):
+            return None
+        if percent_ftp < target - self.zone_tolerance:
+            return 0
+        if percent_ftp > target + self.zone_tolerance:
+            return 2
+        return 1
+
+    def _series(self, uuid_trainer):
+        series = self.series.get(uuid_trainer)
+        if series is None:
+            series = self.series[uuid_trainer] = TrainerSeries(self.capacity, self.windows)
+        return series
+
+    def add_power(self, uuid_trainer, t, measured_power, percent_ftp=None, measured_cadence=None):
+        """
+        Records a power sample.
+
+        Parameters:
+            uuid_trainer (str): The unique identifier of the trainer.
+            t (float): Sample time in seconds on the corrected wall clock (see clock.wall()).
+            measured_power (float): Measured power in watts.
+            percent_ftp (float, optional): Power as percent of FTP.
+            measured_cadence (float, optional): Cadence in rpm; defaults to the last one reported.
+        """
+        percent_ftp = math.nan if percent_ftp is None else percent_ftp
+        with self._lock:
+            series = self._series(uuid_trainer)
+            if measured_cadence is None:
+                measured_cadence = series.last_cadence
+            else:
+                series.last_cadence = measured_cadence
+            series.append(t, measured_power, measured_cadence, percent_ftp, self._zone(percent_ftp),
+                          self.max_gap)
+
+    def add_cadence(self, uuid_trainer, measured_cadence):
+        """Records a cadence reported without power."""
+        with self._lock:
+            self._series(uuid_trainer).set_cadence(measured_cadence)
+
+    def trainers(self):
+        """Returns the UUIDs of the trainers with samples."""
+        with self._lock:
+            return list(self.series)
+
+    def average(self, uuid_trainer, window):
+        """Returns a trainer's mean power over the last window seconds, or None."""
+        with self._lock:
+            series = self.series.get(uuid_trainer)
+            return None if series is None else series.average(window)
+
+    def max_power(self, uuid_trainer):
+        """Returns a trainer's highest power sample, or None."""
+        with self._lock:
+            series = self.series.get(uuid_trainer)
+            return None if series is None else series.max_power
+
+    def time_in_zone(self, uuid_trainer):
+        """Returns the seconds a trainer spent below, in and above the target zone."""
+        with self._lock:
+            series = self.series.get(uuid_trainer)
+            return None if series is None else dict(zip(ZONES, series.zone_time))
+
+    def arrays(self, uuid_trainer):
+        """Returns a copy of a trainer's buffered (time, power, cadence, percent_ftp) arrays, in time order."""
+        with self._lock:
+            series = self.series.get(uuid_trainer)
+            if series is None:
+                return None
+            return tuple(np.array(a) for a in series.arrays())
+
+    def summary(self, uuid_trainer):
+        """
+        Returns a JSON-serialisable summary of a trainer, or None if it has no samples.
+
+        Returns:
+            dict: latest power, cadence and percent FTP, one average_<window>s entry per
+                  configured window, max_power, time_in_zone and samples.
+        """
+        with self._lock:
+            series = self.series.get(uuid_trainer)
+            if series is None or not series.count:
+                return None
+            t, power, cadence, percent_ftp = series.latest()
+            summary = {
+                "measured_power": power,
+                "measured_cadence": None if math.isnan(cadence) else cadence,
+                "percent_ftp": None if math.isnan(percent_ftp) else percent_ftp,
+            }
+            for window in self.windows:
+                summary[f"average_{window}s"] = series.average(window)
+            summary["max_power"] = series.max_power
+            summary["time_in_zone"] = dict(zip(ZONES, series.zone_time))
+            summary["samples"] = series.count
+            return summary
+
+    def summaries(self):
+        """Returns the summary of every trainer, keyed by UUID."""
+        return {uuid_trainer: self.summary(uuid_trainer) for uuid_trainer in self.trainers()}
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+timesync.py
+
+This module implements NTP-style clock synchronization against the coach, so the wall
+clock every agent stamps messages with (clock.now()) is the coach's.
+
+A ClockSync sends time_request messages with its local send time t0. The coach's
+TimeServer answers on time/<client_id>/response with its receive time t1 and send time t2,
+and the ClockSync notes the local receive time t3. As in NTP:
+    offset = ((t1 - t0) + (t2 - t3)) / 2    (coach clock minus local clock)
+    delay  = (t3 - t0) - (t2 - t1)          (round trip through the broker)
+Each exchange is one sample of a ClockOffset (see clock.py), which filters out samples
+delayed by queueing. By default the samples go to clock.OFFSET, which corrects clock.wall()
+and clock.now(), and therefore every timestamp, trace and plan start time of the process.
+
+The TimeServer handles:
+    - time_request: answered with time_response
+The ClockSync handles:
+    - time/<client_id>/response
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from . import clock
+from .clock import SYSTEM_CLOCK
+from .codec import decode_payload
+from .messaging import TimeRequest, TimeResponse, subscribe_callbacks, topic_name, unsubscribe_callbacks
+from .scheduler import Scheduler
+
+_client_ids = itertools.count()
+
+
+class TimeServer:
+    def __init__(self, mqtt_client):
+        """
+        Initializes the TimeServer, the reference clock the other agents sync to, and
+        subscribes to time_request.
+
+        Parameters:
+            mqtt_client (mqtt.Client): The MQTT client to use.
+        """
+        self.client = mqtt_client
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._responses = {}  # key: client_id, value: TimeResponse message type
+        self.callbacks = {"time_request": self._handle_time_request}
+        subscribe_callbacks(self.client, self.callbacks, self.logger)
+        self.client.loop_start()
+
+    def close(self):
+        unsubscribe_callbacks(self.client, self.callbacks, self.logger)
+
+    def _handle_time_request(self, client, userdata, msg):
+        """Handles a TimeRequest: replies with the request's t0 and this clock's receive and send times."""
+        t1 = clock.wall()
+        try:
+            payload = decode_payload(msg.payload)
+            client_id = payload["client_id"]
+            response = self._responses.get(client_id)
+            if response is None:
+                response = self._responses[client_id] = TimeResponse(self.client, client_id)
+            stamp = clock.now()
+            response.publish(stamp=stamp, seq=payload["seq"], t0=payload["t0"], t1=t1, t2=stamp.wall)
+        except Exception as e:
+            self.logger.error(f"Error handling time_request: {e}")
+
+
+class ClockSync:
+    def __init__(self, mqtt_client, client_id=None, offset=None, scheduler=None, interval=60.0,
+                 burst=4, spacing=1.0, wall=time.time):
+        """
+        Initializes the ClockSync and subscribes to its response topic. start() begins syncing.
+
+        Parameters:
+            mqtt_client (mqtt.Client): The MQTT client to use.
+            client_id (str, optional): Names the response topic; unique per process by default.
+            offset (clock.ClockOffset, optional): The estimate the samples update. Defaults to
+                clock.OFFSET, which corrects the timestamps of the whole process. Do not sync
+                clock.OFFSET in the process that runs the TimeServer.
+            scheduler (scheduler.Scheduler, optional): Timer scheduler the requests are sent from.
+                If None, one is started on the system clock and stopped by close().
+            interval (float, optional): Seconds between requests once synced.
+            burst (int, optional): Requests sent at start, spacing seconds apart, for a quick
+                first estimate.
+            spacing (float, optional): Seconds between the requests of the burst.
+            wall (callable, optional): The uncorrected local wall clock; tests can pass a skewed one.
+        """
+        self.client = mqtt_client
+        self.client_id = client_id or f"{os.getpid()}-{os.urandom(2).hex()}-{next(_client_ids)}"
+        self.offset = clock.OFFSET if offset is None else offset
+        self.scheduler = scheduler
+        self._owns_scheduler = False
+        self.interval = interval
+        self.burst = burst
+        self.spacing = spacing
+        self.wall = wall
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.request_msg = TimeRequest(self.client)
+        self._seq = 0
+        self._sent = {}  # key: seq, value: t0 of a request not answered yet
+        self._lock = threading.Lock()
+        self._timer = None
+        self.callbacks = {topic_name(f"time/{self.client_id}/response"): self._handle_time_response}
+        subscribe_callbacks(self.client, self.callbacks, self.logger)
+        self.client.loop_start()
+
+    def start(self):
+        """Sends the burst of requests, then one every interval seconds, until stop()."""
+        if self.scheduler is None:
+            self.scheduler = Scheduler(SYSTEM_CLOCK)
+            self.scheduler.start()
+            self._owns_scheduler = True
+        self._schedule(0, self.burst)
+
+    def stop(self):
+        """Stops sending requests."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def close(self):
+        """Stops sending requests, removes the subscription and stops the scheduler start() started."""
+        self.stop()
+        unsubscribe_callbacks(self.client, self.callbacks, self.logger)
+        if self._owns_scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+            self._owns_scheduler = False
+
+    def _schedule(self, delay, remaining):
+        self._timer = self.scheduler.call_later(delay, self._fire, remaining)
+
+    def _fire(self, remaining):
+        """Scheduler callback: sends a request and schedules the next one."""
+        self.request()
+        if remaining > 1:
+            self._schedule(self.spacing, remaining - 1)
+        else:
+            self._schedule(self.interval, 0)
+
+    def request(self):
+        """Sends one TimeRequest. Requests left unanswered for long are forgotten."""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            for old in [old for old in self._sent if old < seq - 16]:
+                del self._sent[old]
+            t0 = self._sent[seq] = self.wall()
+        self.request_msg.publish(client_id=self.client_id, seq=seq, t0=t0)
+
+    def _handle_time_response(self, client, userdata, msg):
+        """Handles a TimeResponse: adds the exchange's offset and delay to the estimate."""
+        t3 = self.wall()
+        try:
+            payload = decode_payload(msg.payload)
+            with self._lock:
+                t0 = self._sent.pop(payload.get("seq"), None)
+            if t0 is None:
+                return  # A duplicate, or a response to a forgotten request.
+            t1, t2 = payload["t1"], payload["t2"]
+            offset = ((t1 - t0) + (t2 - t3)) / 2
+            delay = (t3 - t0) - (t2 - t1)
+            self.offset.add(offset, delay)
+            self.logger.debug(f"Clock sync sample: offset {offset * 1e3:.3f} ms, delay {delay * 1e3:.3f} ms; "
+                              f"estimate {self.offset.offset * 1e3:.3f} ms.")
+        except Exception as e:
+            self.logger.error(f"Error handling time response: {e}")
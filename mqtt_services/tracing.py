@@ -0,0 +1,183 @@
+'''
+Begin tracing.py
+
+End-to-end latency tracing across coach, bridge and rider.
+
+A TraceContext is a message id plus the list of hops the message has been
+through, each stamped with the corrected wall clock (clock.wall()): for a
+target power change
+
+    coach.publish -> bridge.receive -> bridge.applied -> bridge.publish
+                  -> rider.receive -> rider.handled
+
+It travels in the optional "trace" key of a payload (see
+MQTT_MessageType.publish).  The bridge carries the trace of a set_segment or
+set_target_power command into the next telemetry it publishes, so one trace covers the whole
+loop from the coach's command to the dashboard showing its effect.
+
+The agent at the end of the chain hands the trace to its TraceRecorder, which
+keeps a latency Histogram per hop (broker: publish -> receive, handler:
+receive -> handled/applied, poll interval: applied -> publish) and for the
+whole trace; export() returns them on demand.
+'''
+import itertools
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import deque
+
+from . import clock
+
+# Histogram bucket upper bounds in milliseconds.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_ids = itertools.count()
+_id_prefix = os.urandom(4).hex()
+
+
+class TraceContext:
+    __slots__ = ('id', 'hops')
+
+    def __init__(self, id, hops):
+        """
+        Parameters:
+            id (str): Unique trace id.
+            hops (list): [name, wall clock seconds] pairs, oldest first; the first is the origin.
+        """
+        self.id = id
+        self.hops = hops
+
+    @classmethod
+    def new(cls, origin, wall=None):
+        """Starts a trace at the named origin hop."""
+        return cls(f"{_id_prefix}-{next(_ids)}", [[origin, clock.wall() if wall is None else wall]])
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Returns the trace carried by a decoded payload, or None."""
+        trace = payload.get("trace")
+        if not isinstance(trace, dict):
+            return None
+        return cls(trace.get("id"), [list(hop) for hop in trace.get("hops", [])])
+
+    @property
+    def origin(self):
+        """Wall clock time of the first hop."""
+        return self.hops[0][1]
+
+    def hop(self, name, wall=None):
+        """Stamps the trace with a hop."""
+        self.hops.append([name, clock.wall() if wall is None else wall])
+
+    def as_dict(self):
+        return {"id": self.id, "hops": self.hops}
+
+
+class Histogram:
+    """A fixed-bucket latency histogram, in milliseconds."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Returns the upper bound of the bucket holding the q-th percentile (max for the +Inf bucket)."""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def as_dict(self):
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": {str(bound): n for bound, n in zip(self.bounds + ("+Inf",), cumulative)},
+        }
+
+
+class TraceRecorder:
+    def __init__(self, remember=1024):
+        """
+        Initializes the TraceRecorder.
+
+        Parameters:
+            remember (int, optional): Recent trace ids kept, so a trace delivered several
+                                      times (e.g. on every telemetry message of a tick)
+                                      is only recorded once.
+        """
+        self.histograms = {}  # key: "hop->hop" or "total", value: Histogram
+        self._seen = set()
+        self._seen_order = deque()
+        self._remember = remember
+        self._lock = threading.Lock()
+
+    def start(self, origin):
+        """Starts a new trace at an origin hop, e.g. 'coach.publish'."""
+        return TraceContext.new(origin)
+
+    def receive(self, payload, hop):
+        """
+        Picks up the trace of a received payload and stamps it with a hop.
+
+        Returns:
+            TraceContext or None: None if the payload carries no trace or it was seen already.
+        """
+        trace = TraceContext.from_payload(payload)
+        if trace is None or not trace.hops:
+            return None
+        with self._lock:
+            if trace.id in self._seen:
+                return None
+            self._seen.add(trace.id)
+            self._seen_order.append(trace.id)
+            if len(self._seen_order) > self._remember:
+                self._seen.discard(self._seen_order.popleft())
+        trace.hop(hop)
+        return trace
+
+    def finish(self, trace, hop):
+        """Stamps the last hop of a trace and records its per-hop latencies."""
+        if trace is None:
+            return
+        trace.hop(hop)
+        with self._lock:
+            for (name0, t0), (name1, t1) in zip(trace.hops, trace.hops[1:]):
+                self._observe(f"{name0}->{name1}", (t1 - t0) * 1000)
+            self._observe("total", (trace.hops[-1][1] - trace.origin) * 1000)
+
+    def _observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def export(self):
+        """Returns every histogram as a JSON-serialisable dict, keyed by hop."""
+        with self._lock:
+            return {key: histogram.as_dict() for key, histogram in self.histograms.items()}
+
+    def export_json(self, path):
+        """Writes export() to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.export(), f, indent=2)
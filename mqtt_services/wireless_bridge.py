@@ -1,28 +1,86 @@
+import math
 import time
+import asyncio
+import concurrent.futures
 import threading
-import random  # For simulating power readings
-import json
 import logging
+from collections import deque
 import paho.mqtt.client as mqtt
 
 # Import the messaging functions from the mqtt_service sub-package.
 from .messaging import (
     SetMeasuredPower,
     SetMeasuredCadence,
+    SetMeasuredTelemetry,
     DeviceList,
-    SendFTP
+    SendFTP,
+    TrainerPower,
+    TrainerCadence,
+    subscribe_callbacks,
 )
 # Import APP_ID from the constants module.
+from . import clock
+from . import metrics
+from .analytics import MAX_GAP
+from .clock import SYSTEM_CLOCK
+from .codec import decode_payload
+from .devices import SimulatedBackend
+from .plan_runner import PlanRunner
+from .timesync import ClockSync
+from .tracing import TraceRecorder
 from .constants import APP_ID
 
+
+class DeviceReadStats:
+    """Read statistics of one trainer, kept by WirelessBridge._resolve_reading()."""
+    __slots__ = ('reads', 'total_latency', 'max_latency', 'last_latency', 'timeouts', 'errors', 'stale')
+
+    def __init__(self):
+        self.reads = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = None
+        self.timeouts = 0
+        self.errors = 0
+        self.stale = 0
+
+    def record(self, latency):
+        """Records a successful read that took latency seconds."""
+        self.reads += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def as_dict(self):
+        return {
+            "reads": self.reads,
+            "mean_latency": self.total_latency / self.reads if self.reads else None,
+            "max_latency": self.max_latency,
+            "last_latency": self.last_latency,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "stale": self.stale,
+        }
+
+
 class WirelessBridge:
     """
-    The WirelessBridge class polls all connected trainers via Bluetooth/ANT+ (stubbed out)
-    once per second and publishes the current output power levels to the MQTT backbone.
-    It also responds to MQTT commands: list_devices, pair_device, set_ftp, and set_target_power.
+    The WirelessBridge class collects the readings of all connected trainers through a
+    device backend (see devices.py) and publishes the current output power levels to the
+    MQTT backbone, at a fixed rate or whenever a reading changes. Trainers that push
+    notifications are buffered as they report; trainers that can only be polled are read
+    concurrently once per poll period.
+    It also responds to MQTT commands: list_devices, pair_device, set_ftp, set_segment and
+    set_target_power, and runs the coach's training plan locally from send_plan and start_plan
+    (see plan_runner.py), putting the trainers at each segment's target power.
     """
 
-    def __init__(self, mqtt_client, trainer_ids=None):
+    def __init__(self, mqtt_client, trainer_ids=None, batch_telemetry=False, binary_telemetry=False,
+                 per_trainer_topics=False, poll_period=1.0, read_timeout=0.5, max_stale=3.0,
+                 poll_workers=8, backend=None, publish_on_change=False, buffer_size=64, clock=None,
+                 power_deadband=None, cadence_deadband=None, heartbeat=4.0, retain_telemetry=False,
+                 clock_sync=False, scheduler=None, session=None):
         """
         Initializes the WirelessBridge.
 
@@ -30,85 +88,206 @@ class WirelessBridge:
             mqtt_client (mqtt.Client): The MQTT client instance to use for publishing and subscribing.
             trainer_ids (list, optional): A list of trainer UUIDs that are connected to the bridge.
                                           If None, the bridge will attempt to discover trainers.
+            batch_telemetry (bool, optional): If True, each poll publishes a single
+                                          set_measured_telemetry frame covering every trainer
+                                          instead of one set_measured_power message per trainer.
+            binary_telemetry (bool, optional): If True, telemetry topics use the compact binary
+                                          codec instead of JSON (see codec.py).
+            per_trainer_topics (bool, optional): If True, each reading is also published on
+                                          APP_ID/trainer/<uuid>/power and .../cadence, so a rider
+                                          dashboard can subscribe to its paired trainer only.
+                                          Not with batch_telemetry, whose point is one message
+                                          per tick.
+            poll_period (float, optional): Seconds between poll ticks.
+            read_timeout (float, optional): Deadline in seconds for each trainer's read within a tick.
+            max_stale (float, optional): A trainer that misses its deadline is published with its
+                                          last good reading if that is at most this many seconds
+                                          old; otherwise it is left out of the tick.
+            poll_workers (int, optional): Size of the worker pool trainers are read on.
+            backend (devices.TrainerBackend, optional): How trainers are discovered and read;
+                                          defaults to a devices.SimulatedBackend.
+            publish_on_change (bool, optional): With a notifying backend, publish a trainer's
+                                          reading as soon as it changes instead of once per
+                                          poll period.
+            buffer_size (int, optional): Notifications kept per trainer.
+            clock (clock.SystemClock, optional): The clock poll ticks are scheduled against.
+                                          Tests and simulations can pass a virtual clock.
+            power_deadband (float, optional): Publish a trainer only when its power moved by more
+                                          than this many watts since it was last published.
+            cadence_deadband (float, optional): Likewise for cadence, in rpm. With publish_on_change
+                                          and neither deadband set, any change is published.
+            heartbeat (float, optional): With a deadband or publish_on_change, a trainer whose
+                                          reading holds steady is still republished after this
+                                          many seconds, so dashboards can tell it is alive. The
+                                          republish comes with the next poll tick or
+                                          notification, and the gap
+                                          must stay within analytics.MAX_GAP, which the coach's
+                                          analytics treat as a dropout.
+            retain_telemetry (bool, optional): Publish the per-trainer topics as retained "last
+                                          known value" messages, so a new dashboard gets every
+                                          trainer's current reading on subscribing. Implies
+                                          per_trainer_topics, so not with batch_telemetry.
+            clock_sync (bool, optional): While running, sync this process's wall clock to the
+                                          coach's (see timesync.py), so telemetry timestamps are
+                                          comparable with the coach's and the plan starts when
+                                          the coach's does.
+            scheduler (scheduler.Scheduler, optional): Timer scheduler that fires the segments of
+                                          the locally run plan. If None, one is started with the
+                                          first plan.
+            session (str, optional): Follow the plan of a coach run with this session (see
+                                          Coach): plan topics are under APP_ID/session/<session>/.
+                                          Device and telemetry topics stay shared.
         """
+        if batch_telemetry and (per_trainer_topics or retain_telemetry):
+            raise ValueError("batch_telemetry publishes one frame per tick; it cannot be combined "
+                             "with per_trainer_topics or retain_telemetry")
+        filter_changes = publish_on_change or power_deadband is not None or cadence_deadband is not None
+        if filter_changes and (heartbeat is None or heartbeat + poll_period > MAX_GAP):
+            raise ValueError(f"With a deadband or publish_on_change, heartbeat ({heartbeat}) plus poll_period "
+                             f"({poll_period}) must be at most analytics.MAX_GAP ({MAX_GAP} s), or the "
+                             f"analytics count a steady trainer as a dropout")
         self.client = mqtt_client
+        self.session = session
+        self.clock = SYSTEM_CLOCK if clock is None else clock
+        if backend is None:
+            backend = SimulatedBackend(trainer_ids, clock=self.clock)
+        self.backend = backend
+        self.batch_telemetry = batch_telemetry
+        self.per_trainer_topics = per_trainer_topics or retain_telemetry
+        self.retain_telemetry = retain_telemetry
+        # Per-trainer message objects, created on first use: key: uuid_trainer.
+        self._trainer_msgs = {}
 
         # Initialize logger before calling _discover_trainers.
         self.logger = logging.getLogger(self.__class__.__name__)
-        # Register command callbacks.
-        self._register_command_callbacks()
-
         # If no trainer_ids are provided, attempt to discover them.
         if trainer_ids is None:
             self.trainer_ids = self._discover_trainers()
         else:
             self.trainer_ids = trainer_ids
 
-        # Create messaging objects once in __init__
-        self.set_measured_power_msg = SetMeasuredPower(self.client)
-        self.set_measured_cadence_msg = SetMeasuredCadence(self.client)
+        # Create messaging objects once in __init__.
+        # The poller builds its own payloads, so its messages skip argument validation.
+        self.set_measured_power_msg = SetMeasuredPower(self.client, binary=binary_telemetry, validate=False)
+        self.set_measured_cadence_msg = SetMeasuredCadence(self.client, binary=binary_telemetry, validate=False)
+        self.set_measured_telemetry_msg = SetMeasuredTelemetry(self.client, binary=binary_telemetry,
+                                                               validate=False)
         self.device_list_msg = DeviceList(self.client)
         self.reply_ftp_msg = SendFTP(self.client)
 
         self._running = False
         self._thread = None
+        self._poll_wakeup = threading.Condition()
+
+        # Concurrent polling state.
+        self.poll_period = poll_period
+        self.read_timeout = read_timeout
+        self.max_stale = max_stale
+        self.poll_workers = poll_workers
+        self.poll_overruns = 0
+        self._pool = None
+        self._pending_reads = {}   # key: uuid_trainer, value: future of the read in flight
+        self._last_readings = {}   # key: uuid_trainer, value: (power, cadence, time on self.clock)
+        self.read_stats = {}       # key: uuid_trainer, value: DeviceReadStats
+
+        # Notification state.
+        self.publish_on_change = publish_on_change
+        self.buffer_size = buffer_size
+        self.buffers = {}          # key: uuid_trainer, value: deque of devices.Reading
+        self._last_published = {}  # key: uuid_trainer, value: (power, cadence, time on self.clock)
+
+        # Deadband publishing: a deadband left unset never triggers a publish by itself.
+        self.filter_changes = filter_changes
+        if power_deadband is None and cadence_deadband is None:
+            power_deadband = cadence_deadband = 0
+        self.power_deadband = math.inf if power_deadband is None else power_deadband
+        self.cadence_deadband = math.inf if cadence_deadband is None else cadence_deadband
+        self.heartbeat = math.inf if heartbeat is None else heartbeat
+
+        # Current plan segment and its targets, from the locally run plan or from the coach's
+        # set_segment / set_target_power overrides.
+        self.segment = None
+        self.target_power = None   # percent of FTP
+        self.target_cadence = None
+        # The coach's training plan and its version, from send_plan, run locally by start_plan.
+        # A start_plan received before its plan is run once the plan arrives.
+        self.plan = None
+        self.plan_version = None
+        self._pending_start = None
+        self.runner = PlanRunner(self._enter_plan_segment, scheduler=scheduler,
+                                 clock=scheduler.clock if clock is None and scheduler is not None else self.clock)
+
+        # Latency tracing: the trace of the last segment or target power command, carried by the
+        # next telemetry published.
+        self.traces = TraceRecorder()
+        self._pending_trace = None
 
         # Dictionaries to keep pairing and FTP data.
         self.pairings = {}  # key: uuid_trainer, value: uuid_rider
         self.ftps = {}      # key: uuid_trainer, value: ftp
 
+        self.clock_sync = ClockSync(self.client) if clock_sync else None
+
+        # Register command callbacks last: a broker delivers the retained plan and start_plan on
+        # subscribing, and running the plan needs the trainers and targets set up above.
+        self._register_command_callbacks()
+
         self.logger.info(f"Initialized WirelessBridge with trainers: {self.trainer_ids}")
 
     def _register_command_callbacks(self):
         """
         Registers MQTT callbacks for the following command topics:
             - list_devices
-            - pair_device
+            - pair_trainer_rider
             - set_ftp
+            - set_segment
             - set_target_power
-        The topics use the hierarchical naming convention: <APP_ID>/<command_topic>.
+            - send_plan, start_plan and stop_plan: the plan run locally
+        The topics use the hierarchical naming convention: <APP_ID>/<command_topic>; the plan
+        topics, from set_segment on, are scoped to the bridge's session.
+        Only these topics are subscribed to, so telemetry from other bridges is never delivered here.
         """
-
-        subscribe_topic = f"{APP_ID}/#"
-        result, mid = self.client.subscribe(subscribe_topic)
-        if result != mqtt.MQTT_ERR_SUCCESS:
-            self.logger.error(f"Failed to subscribe to topic {subscribe_topic}: {mqtt.error_string(result)}")
-        else:
-            self.logger.info(f"Subscribed to topic {subscribe_topic}")
-
-        topic_list_devices = f"{APP_ID}/list_devices"
-        self.client.message_callback_add(topic_list_devices, self._handle_list_devices)
-
-        topic_pair_device = f"{APP_ID}/pair_device"
-        self.client.message_callback_add(topic_pair_device, self._handle_pair_device)
-
-        topic_set_ftp = f"{APP_ID}/set_ftp"
-        self.client.message_callback_add(topic_set_ftp, self._handle_set_ftp)
-
-        topic_set_target_power = f"{APP_ID}/set_target_power"
-        self.client.message_callback_add(topic_set_target_power, self._handle_set_target_power)
+        self.callbacks = {
+            "list_devices": self._handle_list_devices,
+            "pair_trainer_rider": self._handle_pair_device,
+            "set_ftp": self._handle_set_ftp,
+        }
+        self.session_callbacks = {
+            "set_segment": self._handle_set_segment,
+            "set_target_power": self._handle_set_target_power,
+            # send_plan comes before start_plan, so a broker delivers the retained plan first.
+            "send_plan": self._handle_send_plan,
+            "start_plan": self._handle_start_plan,
+            "stop_plan": self._handle_stop_plan,
+        }
+        subscribe_callbacks(self.client, self.callbacks, self.logger)
+        subscribe_callbacks(self.client, self.session_callbacks, self.logger, session=self.session)
         self.client.loop_start()
-        self.logger.info("Registered command callbacks for list_devices, pair_device, set_ftp, and set_target_power.")
+        self.logger.info(f"Registered command callbacks for "
+                         f"{', '.join(list(self.callbacks) + list(self.session_callbacks))}.")
 
     def _discover_trainers(self):
         """
-        Stubbed out discovery function for trainers.
-        In a production implementation, this method would scan for available trainers via Bluetooth/ANT+.
+        Discovers the trainers reachable through the device backend.
 
         Returns:
             list: A list of discovered trainer UUIDs.
         """
-        # For demonstration purposes, return a simulated list of trainer IDs.
-        simulated_trainers = ["trainer_123", "trainer_456", "trainer_789"]
-        self.logger.info("Discovered trainers: " + ", ".join(simulated_trainers))
-        return simulated_trainers
+        trainers = self.backend.discover()
+        self.logger.info("Discovered trainers: " + ", ".join(trainers))
+        return trainers
 
     def start(self):
-        """Starts the polling loop in a separate thread."""
+        """Starts the backend's notifications and the polling loop in a separate thread."""
         if not self._running:
             self._running = True
-            self._thread = threading.Thread(target=self._poll_trainers, daemon=True)
-            self._thread.start()
+            if self.clock_sync is not None:
+                self.clock_sync.start()
+            self._start_backend()
+            if not self._publishes_on_change():
+                self._thread = threading.Thread(target=self._poll_trainers, daemon=True)
+                self._thread.start()
+                self.clock.started(self._thread)
             self.logger.info("WirelessBridge started polling trainers.")
         else:
             self.logger.warning("WirelessBridge is already running.")
@@ -116,63 +295,375 @@ class WirelessBridge:
     def stop(self):
         """Stops the polling loop and waits for the thread to finish."""
         if self._running:
-            self._running = False
+            with self._poll_wakeup:
+                self._running = False
+                self._poll_wakeup.notify_all()
+                self.clock.notified(self._poll_wakeup)
             if self._thread:
                 self._thread.join()
+                self._thread = None
+            self._stop_backend()
+            self._shutdown_read_pool()
+            if self.clock_sync is not None:
+                self.clock_sync.stop()
             self.logger.info("WirelessBridge stopped polling trainers.")
         else:
             self.logger.warning("WirelessBridge is not running.")
 
     def _poll_trainers(self):
         """
-        Polls all connected trainers once per second.
-        For each trainer, obtains the measured power (via a placeholder function)
-        and publishes the measurement via the MQTT messaging protocol.
+        Polls all connected trainers every poll_period seconds.
+        The trainers are read concurrently (see _collect_readings) and the readings are
+        published via the MQTT messaging protocol. Ticks are scheduled at a fixed rate,
+        so the time spent reading and publishing does not stretch the period.
+        """
+        next_tick = self.clock.monotonic()
+        while self._running:
+            # One timestamp per tick, shared by every trainer's reading.
+            self._poll_once(clock.now())
+            next_tick = self._next_tick(next_tick, self.clock.monotonic())
+            with self._poll_wakeup:
+                if self._running:
+                    self.clock.wait(self._poll_wakeup, next_tick - self.clock.monotonic())
+
+    def _next_tick(self, next_tick, now):
+        """
+        Returns the deadline of the next poll tick.
+        If the loop fell behind, the missed ticks are skipped rather than run back to back.
+        """
+        next_tick += self.poll_period
+        if next_tick < now:
+            missed = int((now - next_tick) // self.poll_period) + 1
+            self.poll_overruns += missed
+            if metrics.REGISTRY.enabled:
+                metrics.REGISTRY.inc("bridge_poll_overruns_total", missed)
+            self.logger.warning(f"Poll tick overran; skipping {missed} tick(s).")
+            next_tick += missed * self.poll_period
+        return next_tick
+
+    async def run_async(self, period=None):
+        """
+        Coroutine form of the polling loop for the asyncio runtime (see aio.py).
+        Ticks at a fixed rate on the event loop's clock; stop_async() ends it.
+
+        Parameters:
+            period (float, optional): Seconds between polls; defaults to poll_period.
         """
+        if period is not None:
+            self.poll_period = period
+        loop = asyncio.get_running_loop()
+        self._running = True
+        self._start_backend()
+        self.logger.info("WirelessBridge started polling trainers (asyncio).")
+        next_tick = loop.time()
         while self._running:
-            for trainer_id in self.trainer_ids:
-                measured_power = self._read_trainer_power(trainer_id)
-                measured_cadence = self._read_trainer_cadence(trainer_id)
-                percent_ftp = int(100 * measured_power / self.ftps.get(trainer_id, 100))
-                try:
-                    # Use the pre-created SetMeasuredPower message object.
-                    self.set_measured_power_msg.publish(
-                        uuid_trainer=trainer_id,
-                        measured_power=measured_power,
-                        percent_ftp=percent_ftp
-                    )
-                    self.logger.debug(f"Published measured power for {trainer_id}: {measured_power}")
-                except Exception as e:
-                    self.logger.error(f"Error publishing measured power for {trainer_id}: {e}")
-            time.sleep(1)
-
-    def _read_trainer_power(self, trainer_id):
-        """
-        Placeholder for the Bluetooth/ANT+ function that reads the trainer's output power.
-        This function should be replaced with the actual implementation to query the trainer.
+            if not self._publishes_on_change():
+                stamp = clock.now()
+                readings = self._changed_readings(await self._collect_readings_async())
+                if readings or not self.filter_changes:
+                    self._publish_readings(readings, stamp)
+            next_tick = self._next_tick(next_tick, loop.time())
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        self._stop_backend()
+        self._shutdown_read_pool()
+        self.logger.info("WirelessBridge stopped polling trainers (asyncio).")
+
+    def stop_async(self):
+        """Ends run_async() after its current tick."""
+        self._running = False
+
+    def _poll_once(self, stamp=None):
+        """Reads every trainer once and publishes the readings, stamped with the tick's timestamp."""
+        readings = self._changed_readings(self._collect_readings())
+        if readings or not self.filter_changes:
+            self._publish_readings(readings, stamp)
+
+    def _changed_readings(self, readings):
+        """
+        Returns the readings to publish: with a deadband or publish_on_change, only those
+        that moved past the deadband since their trainer was last published, or whose
+        heartbeat is due; otherwise all of them.
+        """
+        if not self.filter_changes:
+            return readings
+        now = self.clock.monotonic()
+        changed = []
+        for reading in readings:
+            trainer_id, power, cadence = reading
+            last = self._last_published.get(trainer_id)
+            if (last is None or abs(power - last[0]) > self.power_deadband
+                    or abs(cadence - last[1]) > self.cadence_deadband
+                    or now - last[2] >= self.heartbeat):
+                self._last_published[trainer_id] = (power, cadence, now)
+                changed.append(reading)
+        return changed
+
+    # ---------------------------
+    # Trainer notifications
+    # ---------------------------
+    def _start_backend(self):
+        """Subscribes to every trainer's notifications, if the backend pushes them."""
+        if not self.backend.supports_notifications:
+            return
+        for trainer_id in self.trainer_ids:
+            self.buffers.setdefault(trainer_id, deque(maxlen=self.buffer_size))
+            self.backend.subscribe(trainer_id, self._on_notification)
+        self.backend.start()
+
+    def _stop_backend(self):
+        if not self.backend.supports_notifications:
+            return
+        self.backend.stop()
+        for trainer_id in self.trainer_ids:
+            self.backend.unsubscribe(trainer_id)
+
+    def _publishes_on_change(self):
+        return self.publish_on_change and self.backend.supports_notifications
+
+    def _on_notification(self, trainer_id, reading):
+        """
+        Receives a trainer notification from the backend. Runs on the backend's thread.
 
         Parameters:
             trainer_id (str): The unique identifier of the trainer.
+            reading (devices.Reading): The reported power and cadence.
+        """
+        buffer = self.buffers.get(trainer_id)
+        if buffer is None:
+            buffer = self.buffers[trainer_id] = deque(maxlen=self.buffer_size)
+        buffer.append(reading)
+        if self.publish_on_change:
+            readings = self._changed_readings([(trainer_id, reading.power, reading.cadence)])
+            if readings:
+                self._publish_readings(readings, clock.now())
+
+    def _buffered_readings(self):
+        """
+        Returns the latest notified reading of every trainer, skipping trainers
+        that have not reported for more than max_stale seconds.
+        """
+        now = self.backend.clock.monotonic()
+        readings = []
+        for trainer_id in self.trainer_ids:
+            buffer = self.buffers.get(trainer_id)
+            if not buffer:
+                continue
+            latest = buffer[-1]
+            if now - latest.mono <= self.max_stale:
+                readings.append((trainer_id, latest.power, latest.cadence))
+        return readings
+
+    # ---------------------------
+    # Concurrent trainer reads
+    # ---------------------------
+    def _read_pool(self):
+        """Returns the worker pool trainer reads run on, creating it on first use."""
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.poll_workers, thread_name_prefix="TrainerRead")
+        return self._pool
+
+    def _shutdown_read_pool(self):
+        """Shuts the worker pool down without waiting for reads that are still hung."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pending_reads.clear()
+
+    def _read_trainer(self, trainer_id):
+        """
+        Reads one trainer's power and cadence. Runs on a worker thread.
 
         Returns:
-            int: The simulated measured power.
+            tuple: (measured_power, measured_cadence, read latency in s, time of the reading on self.clock)
         """
-        # Simulate a measured power reading as a random integer between 100 and 400 watts.
-        return random.randint(90, 110)
+        start = time.monotonic()
+        reading = self.backend.read(trainer_id)
+        latency = time.monotonic() - start
+        return reading.power, reading.cadence, latency, self.clock.monotonic()
 
-    def _read_trainer_cadence(self, trainer_id):
+    def _collect_readings(self):
+        """
+        Reads every trainer concurrently on the worker pool and waits at most
+        read_timeout for the results. With a notifying backend the latest buffered
+        notifications are used instead (see _buffered_readings).
+
+        A trainer whose previous read is still in flight is not read again; its pending
+        read is waited on instead, so a hung device ties up at most one worker.
+
+        Returns:
+            list of tuples: (uuid_trainer, measured_power, measured_cadence) for every
+            trainer with a fresh or usable stale reading, in trainer_ids order.
+        """
+        if self.backend.supports_notifications:
+            return self._buffered_readings()
+        pool = self._read_pool()
+        futures = {}
+        for trainer_id in self.trainer_ids:
+            future = self._pending_reads.get(trainer_id)
+            if future is None:
+                future = self._pending_reads[trainer_id] = pool.submit(self._read_trainer, trainer_id)
+            futures[trainer_id] = future
+        concurrent.futures.wait(futures.values(), timeout=self.read_timeout)
+        readings = []
+        for trainer_id, future in futures.items():
+            if future.done():
+                del self._pending_reads[trainer_id]
+                error = future.exception()
+                outcome = error if error is not None else future.result()
+            else:
+                outcome = None
+            reading = self._resolve_reading(trainer_id, outcome)
+            if reading is not None:
+                readings.append(reading)
+        return readings
+
+    async def _collect_readings_async(self):
+        """Coroutine form of _collect_readings(): the reads are gathered on the event loop."""
+        if self.backend.supports_notifications:
+            return self._buffered_readings()
+        loop = asyncio.get_running_loop()
+        pool = self._read_pool()
+
+        async def read(trainer_id):
+            future = self._pending_reads.get(trainer_id)
+            if future is None:
+                future = self._pending_reads[trainer_id] = loop.run_in_executor(
+                    pool, self._read_trainer, trainer_id)
+            try:
+                # shield() keeps a timed-out read running so the next tick can pick it up.
+                outcome = await asyncio.wait_for(asyncio.shield(future), self.read_timeout)
+            except asyncio.TimeoutError:
+                return self._resolve_reading(trainer_id, None)
+            except Exception as e:
+                outcome = e
+            del self._pending_reads[trainer_id]
+            return self._resolve_reading(trainer_id, outcome)
+
+        readings = await asyncio.gather(*(read(trainer_id) for trainer_id in self.trainer_ids))
+        return [reading for reading in readings if reading is not None]
+
+    def _resolve_reading(self, trainer_id, outcome):
         """
-        Placeholder for the Bluetooth/ANT+ function that reads the trainer's output cadence.
-        This function should be replaced with the actual implementation to query the trainer.
+        Turns the outcome of one trainer read into the reading to publish.
 
         Parameters:
             trainer_id (str): The unique identifier of the trainer.
+            outcome: The result tuple of _read_trainer, the exception it raised,
+                     or None if the read missed its deadline.
 
         Returns:
-            int: The simulated measured cadence.
+            tuple or None: (uuid_trainer, measured_power, measured_cadence), or None if there is
+            no fresh reading and the last good one is older than max_stale.
         """
-        # Simulate a measured cadence reading as a random integer between 85 and 95 RPM.
-        return random.randint(80, 95)
+        stats = self.read_stats.get(trainer_id)
+        if stats is None:
+            stats = self.read_stats[trainer_id] = DeviceReadStats()
+        if isinstance(outcome, tuple):
+            measured_power, measured_cadence, latency, taken_at = outcome
+            stats.record(latency)
+            self._last_readings[trainer_id] = (measured_power, measured_cadence, taken_at)
+            return trainer_id, measured_power, measured_cadence
+        if outcome is None:
+            stats.timeouts += 1
+            self.logger.debug(f"Read of {trainer_id} missed its {self.read_timeout}s deadline.")
+        else:
+            stats.errors += 1
+            self.logger.error(f"Error reading trainer {trainer_id}: {outcome}")
+        last = self._last_readings.get(trainer_id)
+        if last is None or self.clock.monotonic() - last[2] > self.max_stale:
+            return None
+        stats.stale += 1
+        return trainer_id, last[0], last[1]
+
+    def read_latency_stats(self):
+        """
+        Returns the per-trainer read statistics.
+
+        Only polled reads are recorded. A notifying backend, such as the default
+        SimulatedBackend, is never read: its readings are pushed into self.buffers, so
+        the statistics stay empty.
+
+        Returns:
+            dict: key: uuid_trainer, value: dict with reads, mean_latency, max_latency,
+                  last_latency (in s), timeouts, errors and stale (readings reused).
+        """
+        return {trainer_id: stats.as_dict() for trainer_id, stats in self.read_stats.items()}
+
+    # ---------------------------
+    # Publishing
+    # ---------------------------
+    def _publish_readings(self, readings, stamp=None):
+        """
+        Publishes one tick's readings.
+
+        Parameters:
+            readings (list of tuples): (uuid_trainer, measured_power, measured_cadence).
+            stamp (clock.Timestamp, optional): The poll tick's timestamp.
+        """
+        trace = self._take_trace()
+        if self.batch_telemetry:
+            self._publish_frame(readings, stamp, trace)
+            return
+        for trainer_id, measured_power, measured_cadence in readings:
+            percent_ftp = int(100 * measured_power / self.ftps.get(trainer_id, 100))
+            try:
+                # Use the pre-created SetMeasuredPower message object.
+                self.set_measured_power_msg.publish(
+                    stamp=stamp,
+                    trace=trace,
+                    uuid_trainer=trainer_id,
+                    measured_power=measured_power,
+                    percent_ftp=percent_ftp
+                )
+                self.logger.debug("Published measured power for %s: %s", trainer_id, measured_power)
+                if self.per_trainer_topics:
+                    self._publish_trainer_topics(trainer_id, measured_power, measured_cadence,
+                                                 percent_ftp, stamp)
+            except Exception as e:
+                self.logger.error(f"Error publishing measured power for {trainer_id}: {e}")
+
+    def _take_trace(self):
+        """Returns the pending set_target_power trace, stamped 'bridge.publish', or None."""
+        trace, self._pending_trace = self._pending_trace, None
+        if trace is not None:
+            trace.hop("bridge.publish")
+        return trace
+
+    def _publish_frame(self, readings, stamp=None, trace=None):
+        """
+        Publishes readings as a single set_measured_telemetry frame.
+        The frame holds parallel lists indexed by trainer; trainers without a reading are left out.
+        """
+        trainer_ids = [reading[0] for reading in readings]
+        powers = [reading[1] for reading in readings]
+        cadences = [reading[2] for reading in readings]
+        percents = [int(100 * power / self.ftps.get(trainer_id, 100))
+                    for trainer_id, power in zip(trainer_ids, powers)]
+        try:
+            self.set_measured_telemetry_msg.publish(
+                stamp=stamp,
+                trace=trace,
+                uuid_trainer=trainer_ids,
+                measured_power=powers,
+                measured_cadence=cadences,
+                percent_ftp=percents
+            )
+            self.logger.debug("Published telemetry frame for %d trainers", len(trainer_ids))
+        except Exception as e:
+            self.logger.error(f"Error publishing telemetry frame: {e}")
+
+    def _publish_trainer_topics(self, trainer_id, measured_power, measured_cadence, percent_ftp, stamp=None):
+        """Publishes one trainer's reading on its per-trainer power and cadence topics."""
+        msgs = self._trainer_msgs.get(trainer_id)
+        if msgs is None:
+            msgs = self._trainer_msgs[trainer_id] = (
+                TrainerPower(self.client, trainer_id, validate=False, retain=self.retain_telemetry),
+                TrainerCadence(self.client, trainer_id, validate=False, retain=self.retain_telemetry),
+            )
+        power_msg, cadence_msg = msgs
+        power_msg.publish(stamp=stamp, measured_power=measured_power, percent_ftp=percent_ftp)
+        cadence_msg.publish(stamp=stamp, measured_cadence=measured_cadence)
 
     # ---------------------------
     # MQTT Command Handler Methods
@@ -196,7 +687,7 @@ class WirelessBridge:
         """
         self.logger.info("Received pair_device command")
         try:
-            data = json.loads(msg.payload.decode())
+            data = decode_payload(msg.payload)
             uuid_trainer = data.get("uuid_trainer")
             uuid_rider = data.get("uuid_rider")
             self.logger.info(f"Pairing trainer {uuid_trainer} with rider {uuid_rider}")
@@ -212,7 +703,7 @@ class WirelessBridge:
         """
         self.logger.info("Received set_ftp command")
         try:
-            data = json.loads(msg.payload.decode())
+            data = decode_payload(msg.payload)
             uuid_trainer = data.get("uuid_trainer")
             ftp = data.get("ftp")
             self.logger.info(f"Setting FTP for trainer {uuid_trainer} to {ftp}")
@@ -228,7 +719,7 @@ class WirelessBridge:
         """
         self.logger.info("Received request_ftp command")
         try:
-            data = json.loads(msg.payload.decode())
+            data = decode_payload(msg.payload)
             uuid_trainer = data.get("uuid_trainer")
             self.logger.info(f"Got an FTP request for trainer {uuid_trainer}")
             # send the FTP value.
@@ -240,32 +731,125 @@ class WirelessBridge:
     def _handle_set_target_power(self, client, userdata, msg):
         """
         Responds to a set_target_power command.
-        Expects a payload containing 'uuid_trainer' and 'target_power' (as a percent).
+        Expects a payload containing 'target_power' (as a percent of FTP), which applies to
+        every trainer on the bridge. A trace in the payload is carried into the next telemetry.
         """
         self.logger.info("Received set_target_power command")
         try:
-            data = json.loads(msg.payload.decode())
+            data = decode_payload(msg.payload)
+            trace = self.traces.receive(data, "bridge.receive")
             target_power = data.get("target_power")
-            if uuid_trainer is None or target_power is None:
+            if target_power is None:
                 self.logger.error("set_target_power payload missing required fields.")
                 return
 
             self.logger.info(f"Setting target power to {target_power}%")
-            if False:
-                for uuid_trainer in self.ftps:
-                    ftp = self.ftps[uuid_trainer]
-                    # Compute the target watts: interpret target_power as a percent.
-                    watts = ftp * target_power / 100
-            # Call our helper method to process the target power command.
-            self._set_target_power(uuid_trainer, target_power)
+            self._apply_target_power(target_power, trace)
         except Exception as e:
             self.logger.error(f"Error handling set_target_power command: {e}")
 
+    def _handle_set_segment(self, client, userdata, msg):
+        """
+        Responds to a set_segment command.
+        Expects a payload containing 'segment', 'target_power' (as a percent of FTP) and
+        'target_cadence'; the targets apply to every trainer on the bridge.
+        """
+        self.logger.info("Received set_segment command")
+        try:
+            data = decode_payload(msg.payload)
+            trace = self.traces.receive(data, "bridge.receive")
+            target_power = data.get("target_power")
+            if target_power is None:
+                self.logger.error("set_segment payload missing required fields.")
+                return
+            self.logger.info(f"Segment {data.get('segment')}: target power {target_power}%, "
+                             f"cadence {data.get('target_cadence')} RPM")
+            self.segment = data.get("segment")
+            self.target_cadence = data.get("target_cadence")
+            self._apply_target_power(target_power, trace)
+        except Exception as e:
+            self.logger.error(f"Error handling set_segment command: {e}")
+
+    def _handle_send_plan(self, client, userdata, msg):
+        """
+        Responds to a send_plan message (retained) by keeping the training plan, which
+        start_plan runs locally. A start_plan waiting for this plan is run now.
+        """
+        if not msg.payload:
+            return  # The coach withdrew its retained plan.
+        try:
+            data = decode_payload(msg.payload)
+            self.plan = data.get("training_plan")
+            self.plan_version = data.get("version")
+            self.logger.info(f"Received training plan version {self.plan_version}")
+            pending, self._pending_start = self._pending_start, None
+            if pending is not None and pending.get("version") in (None, self.plan_version):
+                self.runner.start(self.plan, pending["start_time"], pending.get("elapsed"))
+        except Exception as e:
+            self.logger.error(f"Error handling send_plan message: {e}")
+
+    def _handle_start_plan(self, client, userdata, msg):
+        """
+        Responds to a start_plan message (retained) by running the plan locally from the coach's
+        start time, or pausing it at the running time given. If the bridge does not hold the
+        plan's version yet, it is run when send_plan delivers it.
+        """
+        if not msg.payload:
+            return  # The coach cleared its retained start_plan.
+        try:
+            data = decode_payload(msg.payload)
+            start_time = data.get("start_time")
+            if start_time is None:
+                self.logger.info("Received start_plan without a start time.")
+                return
+            version = data.get("version")
+            if self.plan is None or (version is not None and version != self.plan_version):
+                self.logger.info(f"Received start_plan for plan version {version}, waiting for the plan.")
+                self._pending_start = data
+                return
+            self._pending_start = None
+            self.runner.start(self.plan, start_time, data.get("elapsed"))
+            self.logger.info(f"Running training plan version {self.plan_version} locally.")
+        except Exception as e:
+            self.logger.error(f"Error handling start_plan message: {e}")
+
+    def _handle_stop_plan(self, client, userdata, msg):
+        """
+        Responds to a stop_plan message by ending the locally run plan: the trainers are put at
+        its terminating segment's target, as when the plan runs to its end.
+        """
+        self.logger.info("Received stop_plan command")
+        self._pending_start = None
+        self.runner.stop(finish=True)
+
+    def _enter_plan_segment(self, index, segment, remaining):
+        """PlanRunner callback: puts every trainer at the target power of the segment entered."""
+        self.logger.info(f"Segment {index} '{segment.description}': target power {segment.power}%, "
+                         f"cadence {segment.cadence} RPM")
+        self.segment = index
+        self.target_cadence = segment.cadence
+        self._apply_target_power(segment.power)
+
+    def _apply_target_power(self, target_power, trace=None):
+        """
+        Puts every trainer in ERG mode at target_power percent of its FTP.
+        The watts of all trainers are computed before any is pushed to the backend.
+        """
+        # Compute the target watts: interpret target_power as a percent of FTP.
+        watts = {uuid_trainer: self.ftps.get(uuid_trainer, 100) * target_power / 100
+                 for uuid_trainer in self.trainer_ids}
+        self.target_power = target_power
+        for uuid_trainer, trainer_watts in watts.items():
+            self._set_target_power(uuid_trainer, trainer_watts)
+        if trace is not None:
+            trace.hop("bridge.applied")
+            self._pending_trace = trace
+
     def _set_target_power(self, uuid_trainer, watts):
         """
         Helper method to log the target power setting.
         (The actual target power publishing is not re-broadcast to avoid recursion.)
         """
         self.logger.info(f"Setting target power for trainer {uuid_trainer} to {watts} watts")
-        # You could add code here to perform further actions if required.
+        self.backend.set_target_power(uuid_trainer, watts)
 
@@ -305,6 +305,70 @@ Dashboard.animate();
  ***********************/
 const clientId = "web_client_" + Math.floor(Math.random() * 100);
 let pairedTrainerId = null;
+
+// Topics this dashboard handles. It subscribes to these only, not to APP_ID/#.
+// With per-trainer topics the measured values come from the paired trainer's own topics.
+const RIDER_TOPICS = ["device_list", "send_plan", "start_plan", "stop_plan", "set_segment", "set_target_power",
+                      "set_target_cadence", "set_ftp"]
+  .concat(Config.per_trainer_topics ? [] : ["set_measured_power", "set_measured_cadence"]);
+let followedTrainerTopic = null;
+
+// Subscribes to the per-trainer topics of the paired trainer, replacing the previous one.
+function followTrainer(trainerId) {
+  if (!Config.per_trainer_topics || !mqttClient.isConnected()) {
+    return;
+  }
+  if (followedTrainerTopic) {
+    mqttClient.unsubscribe(followedTrainerTopic);
+    followedTrainerTopic = null;
+  }
+  if (trainerId) {
+    followedTrainerTopic = Config.APP_ID + "/trainer/" + trainerId + "/+";
+    mqttClient.subscribe(followedTrainerTopic);
+  }
+}
+/***********************
+ * Local Plan Execution
+ ***********************/
+// The coach's plan (retained send_plan) runs here from the start time in the retained start_plan,
+// so the targets change on time without a message per segment, also for a dashboard opened
+// mid-plan. set_segment and set_target_power override the targets until the next segment.
+let localPlan = null;        // [[offset, power, cadence, description], ...]
+let localPlanStart = null;   // start_plan's start_time: epoch seconds of offset 0
+let localPlanPaused = null;  // running time the plan is paused at, if it is paused
+let localSegment = -1;
+let localPlanTimer = null;
+
+// Enters the segment in force, if it changed, and sets a timer for the next one.
+function runLocalPlan() {
+  clearTimeout(localPlanTimer);
+  localPlanTimer = null;
+  if (!localPlan || localPlanStart === null) {
+    return;
+  }
+  const elapsed = localPlanPaused !== null ? localPlanPaused : Date.now() / 1000 - localPlanStart;
+  let index = -1;
+  while (index + 1 < localPlan.length && localPlan[index + 1][0] <= elapsed) {
+    index++;
+  }
+  if (index >= 0 && index !== localSegment) {
+    localSegment = index;
+    Dashboard.targetPower = localPlan[index][1];
+    Dashboard.targetCadence = localPlan[index][2];
+  }
+  if (localPlanPaused === null && index + 1 < localPlan.length) {
+    localPlanTimer = setTimeout(runLocalPlan, (localPlanStart + localPlan[index + 1][0]) * 1000 - Date.now());
+  }
+}
+
+function stopLocalPlan() {
+  clearTimeout(localPlanTimer);
+  localPlanTimer = null;
+  localPlanStart = null;
+  localPlanPaused = null;
+  localSegment = -1;
+}
+
 // Create MQTT client using values from Config.
 const mqttClient = new Paho.MQTT.Client(Config.mqtt_hostname, Number(Config.mqtt_port), "/mqtt", clientId);
   
@@ -355,6 +419,29 @@ mqttClient.onMessageArrived = function(message) {
           selectElem.value = savedTrainer;
         }
       }
+    } else if (topic.endsWith("send_plan")) {
+      if (data.training_plan && Array.isArray(data.training_plan)) {
+        localPlan = data.training_plan;
+        localSegment = -1;
+        runLocalPlan();
+      }
+    } else if (topic.endsWith("start_plan")) {
+      // Sent again on pause and resume: elapsed is the running time while paused.
+      if (data.start_time !== undefined) {
+        localPlanStart = data.start_time;
+        localPlanPaused = data.elapsed !== undefined ? data.elapsed : null;
+        runLocalPlan();
+      }
+    } else if (topic.endsWith("stop_plan")) {
+      stopLocalPlan();
+    } else if (topic.endsWith("set_segment")) {
+      // A plan segment carries both targets in one message.
+      if (data.target_power !== undefined) {
+        Dashboard.targetPower = data.target_power;
+      }
+      if (data.target_cadence !== undefined) {
+        Dashboard.targetCadence = data.target_cadence;
+      }
     } else if (topic.endsWith("set_target_power")) {
       if (data.target_power !== undefined) {
         if (!data.uuid_trainer || data.uuid_trainer === pairedTrainerId) {
@@ -403,6 +490,14 @@ mqttClient.onMessageArrived = function(message) {
           Dashboard.currentCadence = data.measured_cadence;
         }
       }
+    } else if (topic === Config.APP_ID + "/trainer/" + pairedTrainerId + "/power") {
+      if (data.measured_power !== undefined) {
+        Dashboard.currentPower = data.measured_power;
+      }
+    } else if (topic === Config.APP_ID + "/trainer/" + pairedTrainerId + "/cadence") {
+      if (data.measured_cadence !== undefined) {
+        Dashboard.currentCadence = data.measured_cadence;
+      }
     }
   } catch (err) {
     console.error("Error parsing MQTT JSON:", err);
@@ -413,7 +508,7 @@ mqttClient.onMessageArrived = function(message) {
 mqttClient.connect({
   onSuccess: function() {
     console.log("Connected to MQTT broker at " + Config.mqtt_hostname + ":" + Config.mqtt_port);
-    mqttClient.subscribe(Config.APP_ID + "/#");
+    RIDER_TOPICS.forEach(topic => mqttClient.subscribe(Config.APP_ID + "/" + topic));
     const listDevicesMsg = new Paho.MQTT.Message("");
     listDevicesMsg.destinationName = Config.APP_ID + "/list_devices";
     mqttClient.send(listDevicesMsg);
@@ -454,6 +549,7 @@ mqttClient.connect({
       const pairMessage = new Paho.MQTT.Message(JSON.stringify(pairPayload));
       pairMessage.destinationName = Config.APP_ID + "/pair_trainer_rider";
       mqttClient.send(pairMessage);
+      followTrainer(savedTrainer);
       console.log("Automatically paired with trainer from cookie:", savedTrainer);
       document.getElementById("ftpSlider").disabled = false;
       document.getElementById("ftpText").disabled = false;
@@ -521,6 +617,7 @@ trainerSelect.addEventListener("change", function() {
     pairMessage.destinationName = Config.APP_ID + "/pair_trainer_rider";
     if (mqttClient.isConnected()) {
       mqttClient.send(pairMessage);
+      followTrainer(selectedTrainer);
       console.log("Pairing with trainer:", selectedTrainer);
     } else {
       console.warn("MQTT client not connected; pairing message not sent.");
@@ -529,6 +626,7 @@ trainerSelect.addEventListener("change", function() {
     ftpText.disabled = false;
   } else {
     pairedTrainerId = null;
+    followTrainer(null);
     setCookie("pairedTrainer", "", -1);
     setCookie("trainerFtp", "", -1);
     ftpSlider.disabled = true;